@@ -0,0 +1,57 @@
+"""Load time and peak RSS of .pth vs. flat (memory-mapped) checkpoints.
+
+Writes one synthetic state dict in both formats, then loads it in a fresh
+subprocess per method: full torch.load, mmap torch.load, and load_flat with
+and without touching every tensor (a lazy open only reads the header).
+
+    python -m benchmarks.bench_checkpoint_load --params-m 100
+"""
+import os
+import time
+import resource
+import argparse
+import tempfile
+import multiprocessing as mp
+import torch
+from utils.flat_tensors import save_checkpoint, load_checkpoint
+
+METHODS = ("pth", "pth mmap", "flat (open)", "flat (touch all)")
+
+
+def run(method, pth_path, flat_path, out):
+    start = time.perf_counter()
+    if method == "pth":
+        state = load_checkpoint(pth_path)
+    elif method == "pth mmap":
+        state = load_checkpoint(pth_path, mmap=True)
+    else:
+        state = load_checkpoint(flat_path)
+    if method.endswith("(touch all)"):
+        sum(float(v.float().sum()) for v in state.values() if v.numel())
+    out.put((time.perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--params-m", type=int, default=100, help="approx. parameters, in millions")
+    args = parser.parse_args()
+
+    shapes = [(1024, 1024)] * args.params_m + [(768,)] * 1000
+    state = {f"layer{i}.weight": torch.randn(s) for i, s in enumerate(shapes)}
+
+    ctx = mp.get_context("spawn")
+    with tempfile.TemporaryDirectory() as tmp:
+        pth_path, flat_path = os.path.join(tmp, "model.pth"), os.path.join(tmp, "model.flat")
+        save_checkpoint(state, pth_path, fmt="pth")
+        save_checkpoint(state, flat_path, fmt="flat")
+        del state
+        print(f"{os.path.getsize(pth_path) / 2**20:.0f} MB checkpoint")
+        print(f"{'method':<20}{'time s':>10}{'peak RSS MB':>14}")
+
+        for method in METHODS:
+            out = ctx.Queue()
+            proc = ctx.Process(target=run, args=(method, pth_path, flat_path, out))
+            proc.start()
+            elapsed, peak = out.get()
+            proc.join()
+            print(f"{method:<20}{elapsed:>10.2f}{peak:>14.0f}")
@@ -0,0 +1,73 @@
+"""Streaming FedAvg vs. the original in-memory fed_avg.
+
+Writes N synthetic client checkpoints to disk, then aggregates them in a
+fresh subprocess per method and reports wall time and peak RSS.
+
+    python -m benchmarks.bench_fed_avg --clients 8 --params-m 25
+"""
+import os
+import copy
+import time
+import resource
+import argparse
+import tempfile
+import multiprocessing as mp
+import torch
+from utils.fed_utils import fed_avg
+
+
+def legacy_fed_avg(state_dicts, data_sizes):
+    """The previous implementation: all clients in memory, deepcopy, Python sum."""
+    total_size = sum(data_sizes)
+    avg_state = copy.deepcopy(state_dicts[0])
+    for key in avg_state.keys():
+        avg_state[key] = sum(
+            state_dicts[i][key] * (data_sizes[i] / total_size)
+            for i in range(len(state_dicts))
+        )
+    return avg_state
+
+
+def make_clients(tmp_dir, n_clients, params_m):
+    # A handful of large tensors plus many small ones, roughly like a ViT encoder
+    shapes = [(1024, 1024)] * max(1, params_m - 1) + [(768,)] * 1300
+    paths = []
+    for i in range(n_clients):
+        g = torch.Generator().manual_seed(i)
+        state = {f"layer{j}.weight": torch.randn(s, generator=g) for j, s in enumerate(shapes)}
+        path = os.path.join(tmp_dir, f"client_{i}.pth")
+        torch.save(state, path)
+        paths.append(path)
+    return paths
+
+
+def run(method, paths, sizes, out):
+    start = time.perf_counter()
+    if method == "legacy":
+        legacy_fed_avg([torch.load(p, map_location="cpu") for p in paths], sizes)
+    else:
+        fed_avg(paths, sizes)
+    out.put((time.perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--params-m", type=int, default=25, help="approx. parameters per model, in millions")
+    args = parser.parse_args()
+
+    ctx = mp.get_context("spawn")
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = make_clients(tmp, args.clients, args.params_m)
+        sizes = list(range(100, 100 + args.clients))
+        model_mb = os.path.getsize(paths[0]) / 2**20
+        print(f"{args.clients} clients x {model_mb:.0f} MB")
+        print(f"{'method':<12}{'time s':>10}{'peak RSS MB':>14}")
+
+        for method in ("legacy", "streaming"):
+            out = ctx.Queue()
+            proc = ctx.Process(target=run, args=(method, paths, sizes, out))
+            proc.start()
+            elapsed, peak = out.get()
+            proc.join()
+            print(f"{method:<12}{elapsed:>10.2f}{peak:>14.0f}")
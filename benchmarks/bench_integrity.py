@@ -0,0 +1,123 @@
+"""CPU cost of chunk-manifest hashing, and how early a bad download is caught.
+
+  - raw hash throughput: SHA-256 vs. BLAKE2b chunk digests vs. a plain copy,
+  - save_flat with the streaming manifest vs. an unhashed write_flat,
+  - downloading the global model from an in-process federated_server with
+    and without per-chunk verification,
+  - a download whose manifest disagrees at 10% of the file (corruption) and
+    one cut short (truncation): bytes read before the error.
+
+    python -m benchmarks.bench_integrity --size-mb 256
+"""
+import os
+import time
+import hashlib
+import argparse
+import tempfile
+import threading
+import requests
+import torch
+from werkzeug.serving import make_server
+import federated_server
+from utils.flat_tensors import write_flat, save_flat
+from utils.hashing import ChunkHasher, ChunkVerifier, IntegrityError, file_manifest
+
+
+def serve(app):
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def timed(fn, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def download(url, verifier=None, limit=None):
+    """Read the global model from the server; returns the number of bytes received."""
+    received = 0
+    with requests.get(f"{url}/api/get-global-model", params={"format": "flat"}, stream=True, timeout=30) as response:
+        for chunk in response.iter_content(chunk_size=1024 * 1024):
+            if limit is not None:
+                chunk = chunk[:max(0, limit - received)]
+            if verifier is not None:
+                verifier.update(chunk)
+            received += len(chunk)
+            if limit is not None and received >= limit:
+                break
+    if verifier is not None:
+        verifier.finish()
+    return received
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=int, default=256)
+    args = parser.parse_args()
+
+    n = args.size_mb * 1024 * 1024 // 4 // 64
+    state = {f"block{i}.weight": torch.randn(n) for i in range(64)}
+    buffer = bytearray(args.size_mb * 1024 * 1024)
+
+    def chunked():
+        hasher = ChunkHasher()
+        hasher.update(buffer)
+        hasher.finish()
+
+    print(f"{'hash (in memory)':<32}{'seconds':>9}{'MB/s':>9}")
+    for label, fn in (
+        ("copy (baseline)", lambda: bytes(buffer)),
+        ("sha256 whole", lambda: hashlib.sha256(buffer).hexdigest()),
+        ("blake2b chunk manifest", chunked),
+    ):
+        seconds = timed(fn)
+        print(f"{label:<32}{seconds:>9.3f}{args.size_mb / seconds:>9.0f}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "model.flat")
+
+        def plain_write():
+            with open(path, "wb") as f:
+                write_flat(state, f)
+                f.flush()
+                os.fsync(f.fileno())
+
+        plain = timed(plain_write)
+        hashed = timed(lambda: save_flat(state, path))
+        print(f"\n{'write':<32}{'seconds':>9}{'overhead':>9}")
+        print(f"{'write_flat':<32}{plain:>9.3f}{'':>9}")
+        print(f"{'save_flat + manifest':<32}{hashed:>9.3f}{(hashed / plain - 1):>9.0%}")
+
+        federated_server.DATA_DIR = os.path.join(tmp, "server")
+        os.makedirs(federated_server.global_dir(), exist_ok=True)
+        save_flat(state, federated_server.global_model_path())
+        server, url = serve(federated_server.app)
+        manifest = requests.get(f"{url}/api/get-global-model-manifest", params={"format": "flat"}, timeout=30).json()
+        assert manifest["root"] == file_manifest(federated_server.global_model_path())["root"]
+
+        plain = timed(lambda: download(url))
+        verified = timed(lambda: download(url, ChunkVerifier(manifest)))
+        print(f"\n{'download':<32}{'seconds':>9}{'overhead':>9}")
+        print(f"{'unverified':<32}{plain:>9.3f}{'':>9}")
+        print(f"{'per-chunk verified':<32}{verified:>9.3f}{(verified / plain - 1):>9.0%}")
+
+        total = manifest["size"]
+        bad = dict(manifest, chunks=list(manifest["chunks"]))
+        index = len(bad["chunks"]) // 10
+        bad["chunks"][index] = "0" * len(bad["chunks"][index])
+        print(f"\n{'failure':<32}{'MB read':>9}{'of MB':>9}")
+        for label, verifier, limit in (
+            ("corrupt chunk at 10%", ChunkVerifier(bad), None),
+            ("truncated at 50%", ChunkVerifier(manifest), total // 2),
+        ):
+            try:
+                download(url, verifier, limit)
+            except IntegrityError as e:
+                print(f"{label:<32}{verifier.size / 2**20:>9.1f}{total / 2**20:>9.1f}   {e}")
+
+        server.shutdown()
@@ -0,0 +1,68 @@
+"""Latency/throughput of client_backend's upload proxy against the local server.
+
+Runs federated_server and client_backend in-process on free ports and posts a
+synthetic checkpoint through /api/send-local-model, once with the streaming
+pass-through (target URL in the query string) and once through the buffered
+multipart path. Python heap peaks come from tracemalloc.
+
+    python -m benchmarks.bench_proxy_upload --size-mb 300 --repeats 3
+"""
+import io
+import os
+import time
+import argparse
+import tempfile
+import threading
+import tracemalloc
+import requests
+from werkzeug.serving import make_server
+import federated_server
+import client_backend
+
+
+def serve(app):
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def upload(backend_url, server_url, payload, streaming):
+    data = {"client_id": "bench", "cur_round": 1, "dataset_size": 1, "federated_server_url": server_url}
+    params = {"federated_server_url": server_url} if streaming else None
+    response = requests.post(
+        f"{backend_url}/api/send-local-model",
+        params=params, data=data, files={"file": ("round_1.pth", io.BytesIO(payload))}
+    )
+    response.raise_for_status()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=int, default=300)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    payload = os.urandom(args.size_mb * 1024 * 1024)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        federated_server.DATA_DIR = tmp
+        fed, server_url = serve(federated_server.app)
+        backend, backend_url = serve(client_backend.app)
+
+        print(f"{'mode':<12}{'latency s':>12}{'MB/s':>10}{'heap peak MB':>15}")
+        for streaming in (True, False):
+            times = []
+            tracemalloc.start()
+            for _ in range(args.repeats):
+                start = time.perf_counter()
+                upload(backend_url, server_url, payload, streaming)
+                times.append(time.perf_counter() - start)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            best = min(times)
+            label = "streaming" if streaming else "buffered"
+            print(f"{label:<12}{best:>12.2f}{args.size_mb / best:>10.1f}{peak / 2**20:>15.1f}")
+
+        backend.shutdown()
+        fed.shutdown()
@@ -0,0 +1,102 @@
+"""Bandwidth/accuracy benchmark for the model update codec on synthetic data.
+
+Simulates federated least squares: each client runs a few local gradient
+steps from the global weights, uploads through encode_update, and the server
+averages with fed_avg_deltas. Reports bytes per update and the final global
+loss for each codec setting.
+
+    python -m benchmarks.bench_update_codec
+"""
+import io
+import time
+import torch
+from utils.update_codec import encode_update
+from utils.fed_utils import fed_avg_deltas
+
+N_CLIENTS = 8
+ROUNDS = 30
+LOCAL_STEPS = 5
+LR = 0.05
+SHAPES = {"encoder.weight": (512, 512), "encoder.bias": (512,), "decoder.weight": (256, 512), "decoder.bias": (256,)}
+
+SETTINGS = [
+    ("raw fp32 .pth", None, None),
+    ("delta fp32", "fp32", None),
+    ("delta fp16", "fp16", None),
+    ("delta int8", "int8", None),
+    ("top-10% fp16 + EF", "fp16", 0.10),
+    ("top-1% fp16 + EF", "fp16", 0.01),
+    ("top-1% int8 + EF", "int8", 0.01),
+]
+
+
+def make_problem(seed=0):
+    g = torch.Generator().manual_seed(seed)
+    target = {k: torch.randn(shape, generator=g) for k, shape in SHAPES.items()}
+    # Each client sees a noisy, shifted view of the target (non-IID)
+    clients = [
+        {k: v + 0.3 * torch.randn(v.shape, generator=g) for k, v in target.items()}
+        for _ in range(N_CLIENTS)
+    ]
+    sizes = [int(x) for x in torch.randint(50, 500, (N_CLIENTS,), generator=g)]
+    return target, clients, sizes
+
+
+def loss(state, target):
+    return sum(((state[k] - target[k]) ** 2).mean().item() for k in target) / len(target)
+
+
+def run(quantization, topk_ratio, target, clients, sizes, tmp_dir):
+    global_state = {k: torch.zeros(shape) for k, shape in SHAPES.items()}
+    residuals = [{} for _ in clients]
+    total_bytes = 0
+    encode_time = 0.0
+
+    for _ in range(ROUNDS):
+        paths = []
+        for i, local_target in enumerate(clients):
+            state = {k: v.clone() for k, v in global_state.items()}
+            for _ in range(LOCAL_STEPS):
+                for k in state:
+                    state[k] -= LR * 2 * (state[k] - local_target[k])
+
+            start = time.perf_counter()
+            if quantization is None:
+                buf = io.BytesIO()
+                torch.save(state, buf)
+                total_bytes += buf.tell()
+                # Raw uploads are averaged as deltas too, so all settings share one aggregator
+                blob = encode_update(state, global_state, quantization="fp32", compression_level=0)
+            else:
+                blob = encode_update(
+                    state, global_state, quantization=quantization,
+                    topk_ratio=topk_ratio, residual=residuals[i] if topk_ratio else None
+                )
+                total_bytes += len(blob)
+            encode_time += time.perf_counter() - start
+
+            path = f"{tmp_dir}/client_{i}.upd"
+            with open(path, "wb") as f:
+                f.write(blob)
+            paths.append(path)
+
+        global_state = fed_avg_deltas(paths, sizes, global_state)
+
+    n_updates = ROUNDS * len(clients)
+    return total_bytes / n_updates, encode_time / n_updates, loss(global_state, target)
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    target, clients, sizes = make_problem()
+    n_params = sum(torch.Size(s).numel() for s in SHAPES.values())
+    print(f"{N_CLIENTS} clients, {ROUNDS} rounds, {n_params:,} parameters")
+    print(f"{'setting':<22}{'KB/update':>12}{'ratio':>8}{'encode ms':>12}{'final loss':>12}")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        baseline = None
+        for name, quantization, topk_ratio in SETTINGS:
+            size, enc, final_loss = run(quantization, topk_ratio, target, clients, sizes, tmp_dir)
+            baseline = baseline or size
+            print(f"{name:<22}{size / 1024:>12.1f}{baseline / size:>7.1f}x{enc * 1000:>12.2f}{final_loss:>12.5f}")
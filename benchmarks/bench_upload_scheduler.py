@@ -0,0 +1,102 @@
+"""Chunked uploads through UploadScheduler against a throttled, faulty local server.
+
+Runs federated_server in-process with a capped ingress rate and a share of
+chunk PUTs failing with 503, then checks that:
+  - the client-side cap holds (achieved MB/s vs. configured cap),
+  - injected faults are retried chunk by chunk and the update arrives intact,
+  - a job interrupted mid-upload is finished by a fresh scheduler (restart)
+    without re-sending the chunks the server already has.
+
+    python -m benchmarks.bench_upload_scheduler --size-mb 64
+"""
+import os
+import json
+import time
+import argparse
+import tempfile
+import threading
+import torch
+from werkzeug.serving import make_server
+import federated_server
+from utils.upload_scheduler import UploadScheduler, TokenBucket
+
+
+def serve(app):
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def make_update(size_mb):
+    n = size_mb * 1024 * 1024 // 4 // 16
+    g = torch.Generator().manual_seed(0)
+    base = {f"block{i}.weight": torch.randn(n, generator=g) for i in range(16)}
+    # Later blocks change more, so prioritisation should send them first
+    state = {k: v + 0.01 * (i + 1) * torch.randn(n, generator=g) for i, (k, v) in enumerate(base.items())}
+    return state, base
+
+
+def delivered(client_id, round_num):
+    path = os.path.join(federated_server.DATA_DIR, "client_updates", f"round_{round_num}", f"client_{client_id}.upd.json")
+    with open(path) as f:
+        return json.load(f)
+
+
+def timed_upload(scheduler, url, round_num, state, base, client_id):
+    meta = {"client_id": client_id, "dataset_size": 1, "cur_round": round_num, "encoding": "delta-fp16"}
+    job = scheduler.enqueue(url, meta, state, base, quantization="fp16", compression_level=1)
+    start = time.perf_counter()
+    scheduler.upload(job)
+    return time.perf_counter() - start, delivered(client_id, round_num)["bytes"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=int, default=64)
+    parser.add_argument("--chunk-mb", type=float, default=4)
+    parser.add_argument("--ingress-mbps", type=float, default=50)
+    parser.add_argument("--fault-rate", type=float, default=0.2)
+    args = parser.parse_args()
+
+    state, base = make_update(args.size_mb)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        federated_server.DATA_DIR = os.path.join(tmp, "server")
+        federated_server.INGRESS_LIMIT_MBPS = args.ingress_mbps
+        server, url = serve(federated_server.app)
+        queue_dir = os.path.join(tmp, "queue")
+
+        print(f"{'scenario':<28}{'seconds':>9}{'MB sent':>9}{'MB/s':>8}")
+        for i, cap in enumerate((None, 20.0, 5.0)):
+            scheduler = UploadScheduler(queue_dir, chunk_mb=args.chunk_mb)
+            scheduler.bucket = TokenBucket(rate_fn=lambda cap=cap: cap)
+            seconds, sent = timed_upload(scheduler, url, i + 1, state, base, f"cap{i}")
+            label = f"cap {cap} MB/s" if cap else "uncapped"
+            print(f"{label:<28}{seconds:>9.2f}{sent / 2**20:>9.1f}{sent / 2**20 / seconds:>8.1f}")
+
+        federated_server.CHUNK_FAULT_RATE = args.fault_rate
+        scheduler = UploadScheduler(queue_dir, chunk_mb=args.chunk_mb, retries=20)
+        seconds, sent = timed_upload(scheduler, url, 10, state, base, "faults")
+        label = f"{args.fault_rate:.0%} chunk faults"
+        print(f"{label:<28}{seconds:>9.2f}{sent / 2**20:>9.1f}{sent / 2**20 / seconds:>8.1f}")
+
+        # Interrupted job: give up after one attempt, then resume from a new scheduler instance
+        federated_server.CHUNK_FAULT_RATE = 0.5
+        meta = {"client_id": "restart", "dataset_size": 1, "cur_round": 11, "encoding": "delta-fp16"}
+        first = UploadScheduler(queue_dir, chunk_mb=args.chunk_mb, retries=1)
+        job = first.enqueue(url, meta, state, base, quantization="fp16", compression_level=1)
+        try:
+            first.upload(job)
+        except IOError:
+            pass
+        session_dir = federated_server.upload_session_dir(job)
+        already = len([n for n in os.listdir(session_dir) if n.endswith(".upd")]) if os.path.isdir(session_dir) else 0
+
+        federated_server.CHUNK_FAULT_RATE = 0.0
+        start = time.perf_counter()
+        UploadScheduler(queue_dir, chunk_mb=args.chunk_mb).upload_all()
+        total = len(delivered("restart", 11)["chunks"])
+        print(f"{'restart resume':<28}{time.perf_counter() - start:>9.2f}"
+              f"   ({already}/{total} chunks were already on the server)")
+
+        server.shutdown()
@@ -1,18 +1,53 @@
 import os,csv
+import io
+import math
+import hashlib
+from urllib.parse import urlencode
 from datetime import datetime
 import time
+from concurrent.futures import ThreadPoolExecutor
 import torch
 from utils.train_utils import train_one_epoch,evaluate,combined_loss
+from utils.update_codec import encode_update
+from utils.hashing import (
+    file_digest, file_manifest, read_manifest, write_manifest, verified_prefix, stream_digest,
+    ChunkHasher, ChunkVerifier, IntegrityError
+)
+from utils.flat_tensors import is_flat_file, read_flat_into, TeeReader, load_checkpoint, save_checkpoint, write_flat
+from utils.fs_watch import wait_for_file
+from utils.checkpoint_store import CheckpointStore
+from utils.peft import apply_peft, trainable_state_dict
+from utils.upload_scheduler import UploadScheduler, UploadRejected
+from utils.round_budget import EpochBudget, seconds_until
+from models.unetr_model import infer_preset
 import config
 import requests
 from tqdm import tqdm
 
+_CURRENT = object()  # send_update default: use the client's current round state
+
+
 class FederatedClient:
     def __init__(self,client_id,model_fn,train_loader,val_loader,cur_round,device=None):
 
         self.client_id=client_id
         self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
         self.model = model_fn(self.device)
+        self.model_preset = infer_preset(self.model.state_dict())
+
+        # Parameter-efficient rounds: only the trainable subset is optimized and uploaded
+        self.peft_mode = config.PEFT_MODE
+        self.trainable_keys = apply_peft(
+            self.model, self.peft_mode,
+            frozen_prefixes=config.PEFT_FROZEN_PREFIXES, lora_targets=config.LORA_TARGETS,
+            rank=config.LORA_RANK, alpha=config.LORA_ALPHA, seed=config.LORA_SEED
+        )
+        self.upload_keys = set(trainable_state_dict(self.model, self.trainable_keys))
+        if self.peft_mode:
+            n_total = sum(p.numel() for p in self.model.parameters())
+            n_train = sum(p.numel() for p in self.model.parameters() if p.requires_grad)
+            print(f"[Client {client_id}] PEFT mode '{self.peft_mode}': training "
+                  f"{n_train:,} of {n_total:,} parameters ({100 * n_train / n_total:.1f}%)")
 
         self.global_model_dir = os.path.join("global_models")
         self.global_model_path = os.path.join(self.global_model_dir, "global_latest.pth")
@@ -21,12 +56,56 @@ class FederatedClient:
             self._init_log_file()
 
         self.cur_round=cur_round
-
+        self.round_base_state=None  # global weights this round started from, for delta updates
+        self.loaded_global_digest=None  # manifest root of the global model currently in self.model
+        self.last_val_dice=None
+        self.round_deadline=None  # Unix time by which the server wants this round's update
+        self.long_poll_rounds=True  # cleared if the server has no /api/wait-round
+        self.last_round_samples=None  # samples actually trained on, reported for FedAvg weighting
+        self.epoch_budget=EpochBudget(logs_path=self.logs_path)
+
+        # Deduplicated round history: local checkpoints, and optionally past global models
+        self.checkpoint_store = CheckpointStore("client_checkpoints")
+        self.global_store = None
+        if config.GLOBAL_HISTORY_KEEP_LAST:
+            self.global_store = CheckpointStore(
+                os.path.join(self.global_model_dir, "history"),
+                keep_last=config.GLOBAL_HISTORY_KEEP_LAST, keep_best=0
+            )
+
+        # Error-feedback residual for top-k updates, carried across rounds and restarts
+        self.error_feedback_path = os.path.join("client_checkpoints", "error_feedback.pth")
+        self.residual = {}
+        if os.path.exists(self.error_feedback_path):
+            self.residual = load_checkpoint(self.error_feedback_path)
 
         self.train_loader=train_loader
         self.val_loader=val_loader
         self.scaler=torch.cuda.amp.GradScaler('cuda')
-        self.optimizer=torch.optim.Adam(self.model.parameters(), lr=1e-4)
+        self.optimizer=torch.optim.Adam([p for p in self.model.parameters() if p.requires_grad], lr=1e-4)
+        self._warm_data_workers()
+
+        # Background commit stage (save + encode + upload), one commit at a time
+        self._commit_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="commit")
+        self._commit_buffers = None
+        self._commit_future = None
+
+        # Chunked, rate-limited uploads; jobs left from a previous run are resumed in the background
+        self.upload_scheduler = None
+        if config.UPLOAD_SCHEDULER:
+            self.upload_scheduler = UploadScheduler()
+            if self.upload_scheduler.pending():
+                self._commit_future = self._commit_executor.submit(self._resume_uploads)
+
+    def _resume_uploads(self):
+        for job in self.upload_scheduler.pending():
+            print(f"[Client {self.client_id}] Resuming queued upload for Round {job['meta']['cur_round']}")
+            try:
+                self.upload_scheduler.upload(job["job_id"])
+            except UploadRejected as e:
+                print(f"[Client {self.client_id}] Queued upload rejected by the server ({e}), dropped from the queue")
+            except IOError as e:
+                print(f"[Client {self.client_id}] Queued upload still failing ({e}), kept for later")
 
     def _init_log_file(self):
         """Initialize the CSV log file with header if not present."""
@@ -45,99 +124,616 @@ class FederatedClient:
                 f"{train_loss:.4f}", f"{val_loss:.4f}", f"{val_dice:.4f}"
             ])
 
+    def check_model_preset(self, federated_server_url):
+        """Raise ValueError if the federation trains a different UNETR preset than this client."""
+        response = requests.get(f"{federated_server_url}/api/get-current-round", timeout=10)
+        response.raise_for_status()
+        server_preset = response.json().get("model_preset")
+        if server_preset and server_preset != self.model_preset:
+            raise ValueError(f"Server trains the '{server_preset}' UNETR preset, this client built "
+                             f"'{self.model_preset}'; set config.MODEL_PRESET = \"{server_preset}\"")
+
     def wait_for_global(self):
-        while not os.path.exists(self.global_model_path):
+        if not os.path.exists(self.global_model_path):
             print(f"[Client {self.client_id}] Waiting for global model...")
-            time.sleep(5)
+            wait_for_file(self.global_model_path)
+
+        if self.loaded_global_digest == file_manifest(self.global_model_path)["root"]:
+            print(f"[Client {self.client_id}] Global model already loaded.")
+            return
 
         print(f"[Client {self.client_id}] Loading global model...")
-        state = torch.load(self.global_model_path, map_location=self.device)
-        self.model.load_state_dict(state)
+        self._load_global_state(self.global_model_path)
+
+    def wait_for_round(self, federated_server_url, after_round=None, stop_event=None):
+        """Block until the server publishes a round newer than `after_round` and return it.
+
+        Uses long-poll requests to /api/wait-round, so an idle client holds one
+        open request instead of polling. Servers without that endpoint (404/405)
+        are polled on /api/get-current-round every config.ROUND_POLL_INTERVAL
+        seconds instead. `stop_event` (a threading.Event) ends the wait early,
+        returning None.
+        """
+        after_round = self.cur_round if after_round is None else after_round
+        backoff = 1
+
+        def sleep(seconds):
+            if stop_event is not None:
+                stop_event.wait(seconds)
+            else:
+                time.sleep(seconds)
+
+        while stop_event is None or not stop_event.is_set():
+            try:
+                if self.long_poll_rounds:
+                    response = requests.get(
+                        f"{federated_server_url}/api/wait-round",
+                        params={"after": after_round, "timeout": config.ROUND_WAIT_TIMEOUT},
+                        timeout=config.ROUND_WAIT_TIMEOUT + 10
+                    )
+                    if response.status_code in (404, 405):
+                        print(f"[Client {self.client_id}] Server has no /api/wait-round, polling the current round")
+                        self.long_poll_rounds = False
+                        continue
+                else:
+                    response = requests.get(f"{federated_server_url}/api/get-current-round", timeout=10)
+                response.raise_for_status()
+                backoff = 1
+                result = response.json()
+                self.round_deadline = result.get("deadline")
+                if result["current_round"] > after_round:
+                    return result["current_round"]
+                if not self.long_poll_rounds:
+                    sleep(config.ROUND_POLL_INTERVAL)
+            except requests.RequestException as e:
+                print(f"[Client {self.client_id}] Round wait failed ({e}), retrying in {backoff}s")
+                sleep(backoff)
+                backoff = min(backoff * 2, 60)
+
+        return None
 
-    def train_one_round(self, epochs=config.EPOCHS_PER_CLIENT, loss_fn=combined_loss):
+    def _snapshot_round_base(self):
+        # Only delta-encoded uploads need a copy of the round's starting weights
+        if config.UPDATE_ENCODING:
+            self.round_base_state = {k: v.detach().cpu().clone() for k, v in self.upload_state_dict().items()}
+
+    def upload_state_dict(self, state=None):
+        """The part of a state dict that is sent to the server: all of it, or the PEFT subset."""
+        state = self.model.state_dict() if state is None else state
+        if not self.peft_mode:
+            return state
+        return {k: v for k, v in state.items() if k in self.upload_keys}
+
+    def _read_global_weights(self, path):
+        """Copy a cached global model (flat or .pth) into the existing parameters; returns its manifest root."""
+        if is_flat_file(path):
+            # Hash (or verify against the sidecar) the bytes as they are loaded, not in a second pass
+            manifest = read_manifest(path)
+            hasher = ChunkVerifier(manifest) if manifest else ChunkHasher()
+            with open(path, "rb") as f:
+                read_flat_into(TeeReader(f, hash=False, verifier=hasher), self.model.state_dict(), strict=not self.peft_mode)
+            return hasher.finish()["root"]
+        self._copy_into_model(load_checkpoint(path))
+        return file_manifest(path)["root"]
+
+    def _load_global_state(self, path):
+        """Load a cached global model (flat or .pth) into the existing parameters."""
+        self.loaded_global_digest = self._read_global_weights(path)
+        self._apply_optimizer_policy()
+        self._snapshot_round_base()
+        self._archive_global()
+
+    def load_global_state_dict(self, state):
+        """Load global weights that are already in memory (e.g. shared by the simulator)."""
+        self._copy_into_model(state)
+        self.loaded_global_digest = None
+        self._apply_optimizer_policy()
+        self._snapshot_round_base()
+
+    # --- Round transitions ---
+    def begin_round(self, round_num, state=None, path=None):
+        """Switch to `round_num` reusing the model, optimizer and data loaders.
+
+        New global weights (an in-memory `state`, or a cached checkpoint at
+        `path`) are copied into the existing parameters, Adam's moments are
+        kept or reset per config.OPTIMIZER_STATE_POLICY, and persistent
+        DataLoader workers keep running, so the gap between rounds is little
+        more than the weight copy.
+        """
+        start = time.perf_counter()
+        self.cur_round = round_num
+        self.last_round_samples = None
+        if state is not None:
+            self.load_global_state_dict(state)
+        elif path is not None and self.loaded_global_digest != file_manifest(path)["root"]:
+            self._load_global_state(path)
+        print(f"[Client {self.client_id}] Round {round_num} ready in {time.perf_counter() - start:.2f}s "
+              f"(optimizer state: {config.OPTIMIZER_STATE_POLICY})")
+
+    def _copy_into_model(self, state):
+        """Copy `state` into the model's existing tensors, in place."""
+        targets = self.model.state_dict()
+        mismatched = sorted(set(state).symmetric_difference(targets))
+        if mismatched and not self.peft_mode:
+            raise KeyError(f"Global and model tensors differ: {mismatched[:5]}")
+        with torch.no_grad():
+            for name, value in state.items():
+                if name in targets:  # PEFT: adapters may be missing from the global model
+                    targets[name].copy_(value, non_blocking=True)
+
+    def _apply_optimizer_policy(self):
+        """Carry Adam's state into the new round, or reset it, per config.OPTIMIZER_STATE_POLICY."""
+        policy = config.OPTIMIZER_STATE_POLICY
+        if policy == "keep":
+            return
+        if policy not in ("reset", "keep_variance"):
+            raise ValueError(f"Unknown OPTIMIZER_STATE_POLICY: {policy}")
+        for param_state in self.optimizer.state.values():
+            if policy == "reset":
+                param_state.clear()  # Adam re-initialises empty state on its next step
+            elif "exp_avg" in param_state:
+                # Momentum points along the old weights' gradients; the variance estimate still holds
+                param_state["exp_avg"].zero_()
+
+    def _warm_data_workers(self):
+        """Start persistent DataLoader workers now rather than at the first epoch."""
+        for loader in (self.train_loader, self.val_loader):
+            if getattr(loader, "persistent_workers", False):
+                iter(loader)
+
+    def _archive_global(self):
+        if self.global_store is not None:
+            self.global_store.put(self.cur_round, self.model.state_dict())
+
+    def plan_round(self, deadline=None):
+        """(epochs, samples_per_epoch) for this round, shrunk to meet the server deadline if needed."""
+        n_samples = len(self.train_loader.dataset)
+        deadline = self.round_deadline if deadline is None else deadline
+        if not config.ADAPTIVE_EPOCHS:
+            return config.EPOCHS_PER_CLIENT, n_samples
+
+        epochs, samples = self.epoch_budget.plan(n_samples, seconds_until(deadline))
+        if (epochs, samples) != (config.EPOCHS_PER_CLIENT, n_samples):
+            print(f"[Client {self.client_id}] Deadline in {seconds_until(deadline):.0f}s: training {epochs} epoch(s) "
+                  f"of {samples}/{n_samples} samples (predicted {self.epoch_budget.predict(epochs, samples):.0f}s)")
+        return epochs, samples
+
+    def train_one_round(self, epochs=None, loss_fn=combined_loss, deadline=None):
+        n_samples = len(self.train_loader.dataset)
+        samples_per_epoch = n_samples
+        if epochs is None:
+            epochs, samples_per_epoch = self.plan_round(deadline)
+        max_batches = None
+        if samples_per_epoch < n_samples:
+            max_batches = max(1, math.ceil(samples_per_epoch / self.train_loader.batch_size))
+
+        trained = 0
         for epoch in range(1,epochs+1):
-            train_loss=train_one_epoch(self.model,self.train_loader,self.optimizer,loss_fn,self.device,self.scaler)
+            stats = {}
+            train_loss=train_one_epoch(self.model,self.train_loader,self.optimizer,loss_fn,self.device,self.scaler,
+                                       max_batches=max_batches,stats=stats)
+            val_start=time.perf_counter()
             val_loss,val_dice=evaluate(self.model,self.val_loader,loss_fn,self.device,0.5)
+            self.epoch_budget.record_epoch(self.cur_round, epoch, stats["samples"], stats["seconds"],
+                                           stats["data_wait_s"], time.perf_counter() - val_start)
             self._log_metrics(self.cur_round,epoch,train_loss,val_loss,val_dice)
+            self.last_val_dice=val_dice
+            trained += stats["samples"]
+        self.last_round_samples=trained
 
         print(f"[Client {self.client_id}] Local training complete for Round {self.cur_round}.")
         
     
-    def save_local_checkpoint(self):
-        os.makedirs("client_checkpoints", exist_ok=True)
-        ckpt_path = os.path.join(
-            "client_checkpoints",
-            f"round_{self.cur_round}.pth"
+    def save_local_checkpoint(self, state=None, round_num=None, metrics=None):
+        """Add the round to the checkpoint store and return a checkpoint file for upload.
+
+        The file is client_checkpoints/upload.pth, not the store's default
+        checkout.pth, which the prediction paths materialise through their
+        own stores while the commit worker may be uploading this one.
+        """
+        round_num = self.cur_round if round_num is None else round_num
+        state = self.model.state_dict() if state is None else state
+        if metrics is None and self.last_val_dice is not None:
+            metrics = {"val_dice": float(self.last_val_dice)}
+
+        written = self.checkpoint_store.put(round_num, state, metrics)
+        ckpt_path = self.checkpoint_store.checkout(
+            round_num, path=os.path.join(self.checkpoint_store.root, "upload.pth"), state=state
         )
-        torch.save(self.model.state_dict(), ckpt_path)
-        print(f"[Client {self.client_id}] Saved local checkpoint → {ckpt_path}")
+        print(f"[Client {self.client_id}] Saved local checkpoint for Round {round_num} "
+              f"({written / 2**20:.1f} MB new data) → {ckpt_path}")
         return ckpt_path
 
-    def send_update(self,federated_server_url, local_model_path):
-        api_url = "http://127.0.0.1:5000/api/send-local-model"
+    def _save_residual(self, residual):
+        self.residual = residual
+        os.makedirs("client_checkpoints", exist_ok=True)
+        save_checkpoint(residual, self.error_feedback_path)
+
+    def _snapshot_for_commit(self):
+        """Copy the weights into reusable (pinned on CUDA) host buffers without blocking on the copy."""
+        # The buffers are reused, so the previous commit must have finished with them
+        if self._commit_future is not None:
+            self._commit_future.exception()
+
+        state = self.model.state_dict()
+        if self._commit_buffers is None:
+            pin = torch.cuda.is_available() and str(self.device).startswith("cuda")
+            self._commit_buffers = {
+                k: torch.empty(v.shape, dtype=v.dtype, pin_memory=pin) for k, v in state.items()
+            }
 
-        # Open the checkpoint file
-        with open(local_model_path, "rb") as f:
+        for k, v in state.items():
+            self._commit_buffers[k].copy_(v.detach(), non_blocking=True)
+
+        copied = None
+        if str(self.device).startswith("cuda"):
+            copied = torch.cuda.Event()
+            copied.record()
+        return copied
+
+    def commit_round_async(self, federated_server_url, on_progress=None):
+        """Snapshot the weights now; save, encode and upload them on a background worker.
+
+        Returns a Future resolving to the server response; a rejected upload or
+        any other failure surfaces as the Future's exception. `on_progress` is
+        called with status messages from the worker thread.
+        """
+        copied = self._snapshot_for_commit()
+        round_num = self.cur_round
+        metrics = None if self.last_val_dice is None else {"val_dice": float(self.last_val_dice)}
+        base_state = self.round_base_state  # the next round's pull replaces, not mutates, this
+        samples_trained = self.last_round_samples
+        report = on_progress or (lambda message: None)
+
+        def commit():
+            start = time.perf_counter()
+            if copied is not None:
+                copied.synchronize()
+            report(f"Saving checkpoint for Round {round_num}...")
+            path = self.save_local_checkpoint(self._commit_buffers, round_num, metrics)
+            report(f"Uploading update for Round {round_num}...")
+            result = self.send_update(
+                federated_server_url, path,
+                state=self._commit_buffers, round_num=round_num, base_state=base_state,
+                samples_trained=samples_trained
+            )
+            if result is None:
+                raise IOError(f"Server rejected the update for Round {round_num}")
+            self.epoch_budget.record_commit(time.perf_counter() - start)
+            report(f"Update for Round {round_num} delivered")
+            return result
+
+        self._commit_future = self._commit_executor.submit(commit)
+        return self._commit_future
+
+    def send_update(self,federated_server_url, local_model_path, state=None, round_num=None, base_state=_CURRENT,
+                    samples_trained=_CURRENT):
+        """Upload a round's weights. `base_state` and `samples_trained` default to the
+        client's current values; passing None means "no delta base" / "not reported"."""
+        api_url = f"{config.CLIENT_BACKEND_URL}/api/send-local-model"
+        if base_state is _CURRENT:
+            base_state = self.round_base_state
+        if samples_trained is _CURRENT:
+            samples_trained = self.last_round_samples
+
+        # Encode as a quantized delta from the round's global weights, or send the raw checkpoint
+        encoding = "raw"
+        residual = None
+        if config.UPDATE_ENCODING or self.peft_mode or self.upload_scheduler:
+            if state is None:
+                state = load_checkpoint(local_model_path)
+            state = self.upload_state_dict(state)
+
+        if self.upload_scheduler:
+            return self._send_scheduled(federated_server_url, state, base_state, round_num, samples_trained)
+
+        if config.UPDATE_ENCODING:
+            sparse = config.UPDATE_TOPK_RATIO is not None and base_state is not None
+            if sparse:
+                residual = dict(self.residual)  # only committed once the upload succeeds
+            payload = encode_update(
+                state, base_state,
+                quantization=config.UPDATE_ENCODING,
+                compression_level=config.UPDATE_COMPRESSION_LEVEL,
+                topk_ratio=config.UPDATE_TOPK_RATIO if sparse else None,
+                residual=residual
+            )
+            encoding = ("delta-" if base_state is not None else "") + ("topk-" if sparse else "") + config.UPDATE_ENCODING
+            print(f"[Client {self.client_id}] Encoded update ({encoding}): "
+                  f"{os.path.getsize(local_model_path) / 2**20:.1f} MB → {len(payload) / 2**20:.1f} MB")
+            upload = io.BytesIO(payload)
+        elif self.peft_mode:
+            upload = io.BytesIO()
+            if config.CHECKPOINT_FORMAT == "flat":
+                write_flat(state, upload)
+            else:
+                torch.save(state, upload)
+            upload.seek(0)
+        else:
+            upload = open(local_model_path, "rb")
+
+        with upload:
             files = {
-                "file": f
+                "file": upload
             }
 
             data = {
                 "client_id": self.client_id,
                 "dataset_size":len(self.train_loader.dataset),
+                "samples_trained":samples_trained,
                 "federated_server_url":federated_server_url,
-                "cur_round":self.cur_round
+                "cur_round":self.cur_round if round_num is None else round_num,
+                "encoding":encoding,
+                "model_preset":self.model_preset,
+                "sha256":stream_digest(upload)  # checked by client_backend and the server before use
             }
 
             print(f"[Client {self.client_id}] Uploading checkpoint → {api_url}")
-            response = requests.post(api_url, files=files, data=data)
+            # The query parameter lets the backend stream the body through without parsing it;
+            # it checks the whole body against X-Content-SHA256 on the way
+            upload_request = requests.Request(
+                "POST", api_url, params={"federated_server_url": federated_server_url}, files=files, data=data
+            ).prepare()
+            upload_request.headers["X-Content-SHA256"] = hashlib.sha256(upload_request.body).hexdigest()
+            with requests.Session() as session:
+                try:
+                    response = session.send(upload_request, timeout=config.UPLOAD_TIMEOUT)
+                except requests.RequestException as e:
+                    print(f"[Client {self.client_id}] Upload failed → {e}")
+                    return None
 
         if response.status_code == 200:
             print(f"[Client {self.client_id}] Upload successful.")
+            if residual is not None:
+                self._save_residual(residual)
             return response.json()
 
         print(f"[Client {self.client_id}] Upload failed → {response.text}")
         return None
 
 
-    def pull_global_model(self,federated_server_url):
+    def _send_scheduled(self, federated_server_url, state, base_state, round_num, samples_trained=None):
+        """Queue the update as prioritized chunks on disk and deliver it through the upload scheduler."""
+        sparse = bool(config.UPDATE_ENCODING) and config.UPDATE_TOPK_RATIO is not None and base_state is not None
+        residual = dict(self.residual) if sparse else None
+        encoding = "raw"
+        if config.UPDATE_ENCODING:
+            encoding = ("delta-" if base_state is not None else "") + ("topk-" if sparse else "") + config.UPDATE_ENCODING
+
+        meta = {
+            "client_id": self.client_id,
+            "dataset_size": len(self.train_loader.dataset),
+            "samples_trained": samples_trained,
+            "cur_round": self.cur_round if round_num is None else round_num,
+            "encoding": encoding,
+            "model_preset": self.model_preset,
+        }
+        endpoint = f"{config.CLIENT_BACKEND_URL}?{urlencode({'federated_server_url': federated_server_url})}"
+        job_id = self.upload_scheduler.enqueue(
+            endpoint, meta, state, base_state if config.UPDATE_ENCODING else None,
+            quantization=config.UPDATE_ENCODING,
+            compression_level=config.UPDATE_COMPRESSION_LEVEL,
+            topk_ratio=config.UPDATE_TOPK_RATIO if sparse else None,
+            residual=residual
+        )
+        if residual is not None:
+            self._save_residual(residual)  # the queued job will be delivered even across restarts
+
+        print(f"[Client {self.client_id}] Uploading queued update {job_id[:8]} ({encoding}) in chunks")
+        try:
+            result = self.upload_scheduler.upload(job_id)
+        except UploadRejected as e:
+            print(f"[Client {self.client_id}] Server rejected the update ({e})")
+            return None
+        except IOError as e:
+            print(f"[Client {self.client_id}] Upload interrupted ({e}); it stays queued and resumes on restart")
+            return None
+        print(f"[Client {self.client_id}] Upload successful.")
+        return result
+
+    def fetch_global_manifest(self, federated_server_url, params=None):
+        """The server's chunk manifest for the current global model, or None if it has none."""
+        try:
+            response = requests.get(f"{federated_server_url}/api/get-global-model-manifest", params=params, timeout=30)
+        except requests.RequestException:
+            return None
+        return response.json() if response.status_code == 200 else None
+
+    def _cached_global_matches(self, manifest):
+        """True if global_latest.pth already is the model the manifest describes (no download needed)."""
+        path = self.global_model_path
+        return manifest is not None and os.path.exists(path) and file_manifest(path)["root"] == manifest["root"]
+
+    def stream_global_model(self, federated_server_url):
+        """Load the global model directly from the download stream, without a disk read.
+
+        The server sends the flat tensor format, so each parameter is filled in
+        place as its bytes arrive while the same bytes are written to a temp
+        file that is atomically renamed to global_latest.pth. Every chunk is
+        checked against the server's manifest as it arrives, so a corrupt or
+        truncated stream fails at the first bad chunk. There is no second full
+        copy and no disk read; if the stream fails, the parameters are put back
+        from the previous global_latest.pth, which is only replaced once the
+        new model has verified.
+        """
         api_url = f"{federated_server_url}/api/get-global-model"
-        os.makedirs('global_models',exist_ok='True')
-        local_save_path = "global_models/global_latest.pth"
-        response = requests.get(api_url, stream=True)
+        os.makedirs(self.global_model_dir, exist_ok=True)
+        path = self.global_model_path
+
+        manifest = self.fetch_global_manifest(federated_server_url, {"format": "flat"})
+        if self._cached_global_matches(manifest):
+            if self.loaded_global_digest != manifest["root"]:
+                self._load_global_state(path)
+            print(f"[Client {self.client_id}] Global model unchanged, skipping download.")
+            return path
+
+        headers = {}
+        if os.path.exists(path):
+            headers["If-None-Match"] = f'"{file_manifest(path)["root"]}"'
+
+        response = requests.get(api_url, params={"format": "flat"}, headers=headers, stream=True, timeout=30)
+        if response.status_code == 304:
+            if self.loaded_global_digest != file_manifest(path)["root"]:
+                self._load_global_state(path)
+            print(f"[Client {self.client_id}] Global model unchanged, skipping download.")
+            return path
         if response.status_code != 200:
             print("Error:", response.status_code)
+            return None
+        if manifest is not None and response.headers.get("ETag", "").strip('"') != manifest["root"]:
+            manifest = None  # a new model was published in between; fall back to the whole-file hash
+
+        print(f"[Client {self.client_id}] Streaming global model into memory...")
+        response.raw.decode_content = True
+        tmp_path = path + ".tmp"
+        expected = response.headers.get("X-Content-SHA256")
+        verifier = ChunkVerifier(manifest) if manifest else ChunkHasher()
+        try:
+            with open(tmp_path, "wb") as cache:
+                reader = TeeReader(response.raw, sink=cache, hash=manifest is None, verifier=verifier)
+                # In PEFT mode the global model may not carry this client's adapters yet
+                read_flat_into(reader, self.model.state_dict(), strict=not self.peft_mode)
+                cache.flush()
+                os.fsync(cache.fileno())
+            received = verifier.finish()
+            if manifest is None and expected and reader.hexdigest() != expected:
+                raise IntegrityError(f"Global model checksum mismatch (expected {expected})")
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            self._restore_loaded_global()
+            raise
+
+        os.replace(tmp_path, path)
+        write_manifest(path, received)
+        self.loaded_global_digest = received["root"]
+        self._apply_optimizer_policy()
+        self._snapshot_round_base()
+        self._archive_global()
+        print(f"[Client {self.client_id}] Global model loaded and cached → {path}")
+        return path
+
+    def _restore_loaded_global(self):
+        """Put back the weights of the loaded global model after a failed in-place stream.
+
+        The cached global_latest.pth is used only if its manifest root is the
+        model that was loaded; it is verified again while it is read.
+        """
+        path = self.global_model_path
+        if self.loaded_global_digest is None or not os.path.exists(path) \
+                or file_manifest(path)["root"] != self.loaded_global_digest:
+            print(f"[Client {self.client_id}] No cached copy of the loaded global model; "
+                  "weights stay partially overwritten until the next successful load.")
+            self.loaded_global_digest = None
             return
+        self._read_global_weights(path)
 
-        total_size = int(response.headers.get("content-length", 0))
-
-        with open(local_save_path, "wb") as f, tqdm(
-            total=total_size,
-            unit="B",
-            unit_scale=True,
-            unit_divisor=1024,
-            desc="Downloading Global Model"
-        ) as bar:
-            for chunk in response.iter_content(chunk_size=1024 * 1024):  # 1MB chunks
-                if chunk:
-                    f.write(chunk)
-                    bar.update(len(chunk))
-
-        print(f"\nDownload complete → {local_save_path}")
-
-
-
-    
-
-
-
-
-
-
-
-
-
-
-        
-        
-
+    def pull_global_model(self,federated_server_url):
+        """Download the global model, skipping it if unchanged and resuming partial downloads.
+
+        With the server's chunk manifest, a local copy with the same root is
+        kept without any request, a leftover .part file is resumed from its
+        longest prefix of chunks that match the new model (even if it was
+        left by an older one), and every chunk is checked as it arrives so a
+        corrupt download is abandoned early. Without a manifest the
+        content-hash ETag, Range/If-Range and the advertised SHA-256 are used.
+        """
+        api_url = f"{federated_server_url}/api/get-global-model"
+        os.makedirs(self.global_model_dir, exist_ok=True)
+        local_save_path = self.global_model_path
+        part_path = local_save_path + ".part"
+        etag_path = part_path + ".etag"
+        params = {"format": "flat"} if config.CHECKPOINT_FORMAT == "flat" else None
+
+        manifest = self.fetch_global_manifest(federated_server_url, params)
+        for attempt in range(1, config.DOWNLOAD_RETRIES + 1):
+            if self._cached_global_matches(manifest):
+                print(f"[Client {self.client_id}] Global model unchanged, skipping download.")
+                return local_save_path
+
+            headers = {}
+            if os.path.exists(local_save_path):
+                headers["If-None-Match"] = f'"{file_manifest(local_save_path)["root"]}"'
+
+            if manifest is not None:
+                offset = verified_prefix(part_path, manifest)
+                if os.path.exists(part_path):
+                    os.truncate(part_path, offset)
+                if offset and offset == manifest["size"]:
+                    os.replace(part_path, local_save_path)  # the partial file was already complete
+                    write_manifest(local_save_path, manifest)
+                    return local_save_path
+                if offset:
+                    headers["Range"] = f"bytes={offset}-"
+            else:
+                offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+                if offset and os.path.exists(etag_path):
+                    with open(etag_path) as f:
+                        headers["Range"] = f"bytes={offset}-"
+                        headers["If-Range"] = f.read().strip()
+
+            try:
+                response = requests.get(api_url, params=params, headers=headers, stream=True, timeout=30)
+
+                if response.status_code == 304:
+                    print(f"[Client {self.client_id}] Global model unchanged, skipping download.")
+                    return local_save_path
+                if response.status_code not in (200, 206):
+                    print("Error:", response.status_code)
+                    return None
+                if manifest is not None and response.headers.get("ETag", "").strip('"') != manifest["root"]:
+                    # A new model was published since the manifest was fetched
+                    manifest = self.fetch_global_manifest(federated_server_url, params)
+                    continue
+
+                # 200 means the server ignored the range (new model or no partial file)
+                mode = "ab" if response.status_code == 206 else "wb"
+                if mode == "wb":
+                    offset = 0
+                etag = response.headers.get("ETag", "")
+                with open(etag_path, "w") as f:
+                    f.write(etag)
+                verifier = ChunkVerifier(manifest, offset) if manifest is not None else None
+
+                total_size = offset + int(response.headers.get("content-length", 0))
+
+                with open(part_path, mode) as f, tqdm(
+                    total=total_size,
+                    initial=offset,
+                    unit="B",
+                    unit_scale=True,
+                    unit_divisor=1024,
+                    desc="Downloading Global Model"
+                ) as bar:
+                    for chunk in response.iter_content(chunk_size=1024 * 1024):  # 1MB chunks
+                        if chunk:
+                            if verifier is not None:
+                                verifier.update(chunk)  # raises at the first bad chunk
+                            f.write(chunk)
+                            bar.update(len(chunk))
+                if verifier is not None:
+                    received = verifier.finish()
+
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                print(f"[Client {self.client_id}] Download interrupted ({e}), resuming (attempt {attempt}/{config.DOWNLOAD_RETRIES})")
+                time.sleep(min(2 ** attempt, 30))
+                continue
+            except IntegrityError as e:
+                # The next attempt resumes after the last chunk that verified
+                print(f"[Client {self.client_id}] Download corrupt ({e}), retrying (attempt {attempt}/{config.DOWNLOAD_RETRIES})")
+                continue
+
+            if manifest is None:
+                expected = response.headers.get("X-Content-SHA256")
+                if expected and file_digest(part_path) != expected:
+                    os.remove(part_path)
+                    raise IntegrityError(f"Global model checksum mismatch (expected {expected})")
+
+            os.replace(part_path, local_save_path)
+            os.remove(etag_path)
+            if manifest is not None:
+                write_manifest(local_save_path, received)
+            print(f"\nDownload complete → {local_save_path}")
+            return local_save_path
+
+        raise IOError(f"Global model download failed after {config.DOWNLOAD_RETRIES} attempts")
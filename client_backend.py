@@ -1,30 +1,167 @@
 from flask import Flask,request, jsonify
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
+import io
+import zlib
+import base64
+import hashlib
+import threading
+import numpy as np
+import torch
+import config
+from utils.hashing import stream_digest, IntegrityError
 
 app=Flask(__name__)
 
+PROXY_CHUNK_SIZE = 1024 * 1024
+
+def _make_upstream_session():
+    """Pooled keep-alive session for the federated server.
+
+    Only connection failures are retried: they happen before any of the
+    streamed body is sent, so the upload can be replayed safely.
+    """
+    session = requests.Session()
+    retry = Retry(total=config.PROXY_RETRIES, connect=config.PROXY_RETRIES, read=0, status=0,
+                  backoff_factor=config.PROXY_BACKOFF)
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+upstream_session = _make_upstream_session()
+
+class _BodyDigest:
+    """SHA-256 of a proxied body, checked against the client's X-Content-SHA256.
+
+    The check runs before the end of the body is sent upstream, so on a
+    mismatch the upload is cut short and the server never accepts it.
+    """
+
+    def __init__(self, expected):
+        self.expected = expected
+        self.sha256 = hashlib.sha256()
+        self.mismatch = False
+
+    def update(self, data):
+        self.sha256.update(data)
+
+    def check(self):
+        if self.expected and self.sha256.hexdigest() != self.expected:
+            self.mismatch = True
+            raise IntegrityError("Upload body does not match its X-Content-SHA256")
+
+def _iter_request_body(stream, digest=None):
+    """Yield the incoming body in bounded chunks, gzip-compressing it if configured."""
+    compressor = zlib.compressobj(config.PROXY_COMPRESSION_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS) \
+        if config.PROXY_COMPRESSION else None
+    for chunk in iter(lambda: stream.read(PROXY_CHUNK_SIZE), b""):
+        if digest is not None:
+            digest.update(chunk)
+        if compressor is not None:
+            chunk = compressor.compress(chunk)
+        if chunk:
+            yield chunk
+    if digest is not None:
+        digest.check()  # raising here withholds the end of the chunked body
+    if compressor is not None:
+        yield compressor.flush()
+
+class _SizedStream:
+    """The incoming body as a file-like object with a length.
+
+    requests sends a generator with chunked encoding even when a
+    Content-Length header is given, so known-length bodies go through this
+    wrapper to get a plain Content-Length upload instead.
+    """
+
+    def __init__(self, stream, length, digest=None):
+        self.stream = stream
+        self.remaining = length
+        self.digest = digest
+
+    def __len__(self):
+        return self.remaining
+
+    def read(self, n=-1):
+        data = self.stream.read(PROXY_CHUNK_SIZE if n is None or n < 0 else min(n, PROXY_CHUNK_SIZE))
+        self.remaining -= len(data)
+        if self.digest is not None:
+            self.digest.update(data)
+            if self.remaining <= 0 or not data:
+                self.digest.check()  # before the last bytes go out, so a bad body arrives short
+        return data
+
+_predictor = None
+_predictor_lock = threading.Lock()
+
+def get_predictor():
+    """Load the prediction model once and keep it warm across requests."""
+    global _predictor
+    with _predictor_lock:
+        if _predictor is None:
+            from predict_mask import find_latest_checkpoint, load_prediction_model
+            from utils.batched_inference import CoalescingPredictor
+
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+            model_path = config.PREDICT_MODEL_PATH or find_latest_checkpoint()
+            model = load_prediction_model(model_path, device)
+            _predictor = CoalescingPredictor(
+                model, device,
+                roi_size=getattr(model, "roi_size", (128, 160, 160)),
+                window_ms=config.PREDICT_BATCH_WINDOW_MS,
+                max_batch=config.PREDICT_MAX_BATCH
+            )
+            print(f"[CLIENT] Prediction model loaded from {model_path}")
+    return _predictor
+
+def _load_array(file):
+    """Read an uploaded .npy/.npz volume (any dtype, e.g. float16 to halve the payload)."""
+    data = np.load(io.BytesIO(file.read()))
+    if isinstance(data, np.lib.npyio.NpzFile):
+        data = data[data.files[0]]
+    return data
+
 @app.route('/api/send-local-model', methods=['POST'])
 def send_local_model():
+    # With the target in the query string the multipart body is passed through
+    # untouched, chunk by chunk, without being parsed or buffered here
+    federated_server_url = request.args.get("federated_server_url")
+    if federated_server_url:
+        return _stream_local_model(federated_server_url)
+
     file = request.files.get("file")
     client_id = request.form.get("client_id")
     federated_server_url = request.form.get("federated_server_url")
     cur_round=request.form.get("cur_round")
     dataset_size=request.form.get("dataset_size")
+    samples_trained=request.form.get("samples_trained")
+    encoding=request.form.get("encoding", "raw")
+    sha256=request.form.get("sha256")
+    model_preset=request.form.get("model_preset")
 
     if file is None:
         return jsonify({"success": False, "error": "No file received"}), 400
+    if sha256 and stream_digest(file.stream) != sha256:
+        # Damaged between client and backend: fail now instead of after the upstream transfer
+        return jsonify({"success": False, "error": "Checksum mismatch"}), 400
 
     upload_url = f"{federated_server_url}/api/upload-client-weights"
 
     print(f"[CLIENT] Forwarding model to {upload_url}")
 
-    response = requests.post(
+    response = upstream_session.post(
         upload_url,
         files={"file": (f"client_{client_id}.pth", file)},
         data={"client_id": client_id,
               "cur_round":cur_round,
-              "dataset_size":dataset_size
+              "dataset_size":dataset_size,
+              "samples_trained":samples_trained,
+              "encoding":encoding,
+              "sha256":sha256,
+              "model_preset":model_preset
               }
     )
 
@@ -33,8 +170,83 @@ def send_local_model():
 
     return jsonify({"success": False, "server_response": response.text}), response.status_code
 
+def _stream_local_model(federated_server_url):
+    upload_url = f"{federated_server_url}/api/upload-client-weights"
+    print(f"[CLIENT] Streaming model to {upload_url}")
+
+    headers = {"Content-Type": request.content_type}
+    # Hashed as it streams through; the server still checks the file's own sha256 field
+    digest = _BodyDigest(request.headers.get("X-Content-SHA256"))
+    if config.PROXY_COMPRESSION:
+        headers["Content-Encoding"] = "gzip"  # length unknown up front, sent chunked
+        body = _iter_request_body(request.stream, digest)
+    elif request.content_length is not None:
+        body = _SizedStream(request.stream, request.content_length, digest)
+    else:
+        body = _iter_request_body(request.stream, digest)
+
+    try:
+        response = upstream_session.post(upload_url, data=body, headers=headers)
+    except (requests.RequestException, IntegrityError) as e:
+        if digest.mismatch:
+            print(f"[CLIENT] Aborted upload to {upload_url}: body damaged between client and backend")
+            return jsonify({"success": False, "error": "Checksum mismatch"}), 400
+        return jsonify({"success": False, "error": str(e)}), 502
+
+    if response.status_code == 200:
+        return jsonify({"success": True, "server_response": response.json()})
+
+    return jsonify({"success": False, "server_response": response.text}), response.status_code
+
+@app.route('/api/upload-session', methods=['POST'])
+@app.route('/api/upload-session/<upload_id>/chunk/<int:index>', methods=['PUT'])
+def proxy_upload_session(upload_id=None, index=None):
+    """Pass chunked-upload requests through to the federated server unchanged."""
+    federated_server_url = request.args.get("federated_server_url")
+    if not federated_server_url:
+        return jsonify({"success": False, "error": "federated_server_url is required"}), 400
+
+    headers = {k: v for k, v in request.headers.items() if k in ("Content-Type", "X-Content-SHA256")}
+    body = request.get_data() if index is None else _SizedStream(request.stream, request.content_length or 0)
+    try:
+        response = upstream_session.request(
+            request.method, f"{federated_server_url}{request.path}", data=body, headers=headers
+        )
+    except requests.RequestException as e:
+        return jsonify({"success": False, "error": str(e)}), 502
+
+    return response.content, response.status_code, {"Content-Type": response.headers.get("Content-Type", "application/json")}
+
+@app.route('/api/predict', methods=['POST'])
+def predict_volume():
+    from predict_mask import preprocess_image, preprocess_mask
+    from utils.metrics import compute_segmentation_metrics
+
+    image_file = request.files.get("image")
+    mask_file = request.files.get("mask")
+
+    if image_file is None:
+        return jsonify({"success": False, "error": "No image received"}), 400
+
+    try:
+        image = preprocess_image(_load_array(image_file))
+        mask = None if mask_file is None else preprocess_mask(_load_array(mask_file))
+        pred_mask = get_predictor().submit(image).result()
+
+        result = {
+            "success": True,
+            "shape": list(pred_mask.shape),
+            "mask": base64.b64encode(np.packbits(pred_mask.numpy().ravel()).tobytes()).decode("ascii")
+        }
+        if mask is not None:
+            result["metrics"] = compute_segmentation_metrics(pred_mask, mask, slice_dim=1).to_dict()
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+    return jsonify(result)
+
 if __name__ == "__main__":
-    app.run(port=5000)
+    app.run(port=5000, threaded=True)
 
 
 
@@ -3,3 +3,84 @@ EPOCHS_PER_CLIENT = 3
 BASE_DIR = "./"
 
 
+# --- Prediction endpoint (client_backend /api/predict) ---
+PREDICT_MODEL_PATH = None  # None → latest client_checkpoints/round_N.pth
+PREDICT_BATCH_WINDOW_MS = 20
+PREDICT_MAX_BATCH = 4
+
+# --- Prediction cache (PredictionFrame) ---
+PREDICTION_CACHE_DIR = "prediction_cache"
+PREDICTION_CACHE_MAX_MB = 512
+
+# --- Model update codec (FederatedClient.send_update) ---
+# None uploads the raw .pth, which is what the production FL server's /api/upload-client-weights
+# accepts. "fp32", "fp16" or "int8" send an encoded delta that only a server with
+# utils/update_codec (e.g. federated_server.py) can decode: opt in per deployment.
+UPDATE_ENCODING = None
+UPDATE_COMPRESSION_LEVEL = 6
+UPDATE_TOPK_RATIO = None  # e.g. 0.01 sends the top 1% of each tensor's delta, with error feedback
+
+# --- Global model download (FederatedClient.pull_global_model) ---
+DOWNLOAD_RETRIES = 5
+
+# --- Round notifications ---
+ROUND_WAIT_TIMEOUT = 30  # seconds per long-poll request to /api/wait-round
+ROUND_POLL_INTERVAL = 10  # seconds between /api/get-current-round polls on servers without /api/wait-round
+AUTO_TRAIN_ON_NEW_ROUND = False  # GUI starts training as soon as a new round is published
+
+# --- Upload proxy (client_backend /api/send-local-model) ---
+CLIENT_BACKEND_URL = "http://127.0.0.1:5000"
+UPLOAD_TIMEOUT = (10, 300)  # (connect, read) seconds for a single-request update upload; read covers the server's checks
+PROXY_RETRIES = 3
+PROXY_BACKOFF = 0.5
+PROXY_COMPRESSION = False  # gzip the forwarded body; little gain on raw fp32 weights
+PROXY_COMPRESSION_LEVEL = 1
+
+# --- Robust aggregation (utils/fed_utils median / trimmed mean / Krum) ---
+AGGREGATION_CHUNK_MB = 256  # working set per column chunk of the memory-mapped update matrix
+
+# --- Checkpoint format (utils/flat_tensors) ---
+# "pth": torch.save pickle; "flat": memory-mappable header + raw buffers (FLTNSR01). The production
+# FL server neither serves nor accepts flat files, so switch to "flat" only with a server that does
+# (e.g. federated_server.py). Loading detects either format by content.
+CHECKPOINT_FORMAT = "pth"
+
+# --- Checkpoint store (client_checkpoints/, global_models/history/) ---
+CHECKPOINT_CHUNK_MB = 4  # dedup granularity
+CHECKPOINT_KEEP_LAST = 3
+CHECKPOINT_KEEP_BEST = 1  # by validation Dice
+GLOBAL_HISTORY_KEEP_LAST = 3  # 0 disables global model history
+
+# --- Parameter-efficient rounds (FederatedClient) ---
+PEFT_MODE = None  # None trains/uploads everything; "decoder" freezes the ViT encoder; "lora" also adds adapters
+PEFT_FROZEN_PREFIXES = ("vit.",)
+LORA_TARGETS = ("attn.qkv", "attn.out_proj")
+LORA_RANK = 8
+LORA_ALPHA = 16
+LORA_SEED = 0  # must match across the federation: adapters start identical so they can be averaged
+
+# --- Upload scheduler (chunked, resumable, rate-limited uploads) ---
+UPLOAD_SCHEDULER = False
+UPLOAD_QUEUE_DIR = "upload_queue"
+UPLOAD_CHUNK_MB = 8
+UPLOAD_RETRIES = 8
+UPLOAD_RATE_LIMIT_MBPS = None  # cap outside the scheduled windows; None = unlimited
+UPLOAD_RATE_SCHEDULE = []  # e.g. [("08:00", "18:00", 2.0)] caps clinic hours at 2 MB/s; 0 pauses uploads
+
+# --- Round deadline budgeting (utils/round_budget) ---
+ADAPTIVE_EPOCHS = True  # shrink local epochs/samples to meet the server's advertised round deadline
+MIN_SAMPLES_PER_ROUND = 4  # never train on fewer samples than this, even if the deadline is missed
+DEADLINE_SAFETY = 0.9  # plan to use only this share of the time left
+
+# --- Transfer integrity (utils/hashing chunk manifests) ---
+INTEGRITY_CHUNK_MB = 4  # granularity of per-chunk hashes: a corrupt download is caught within this many MB
+
+# --- Round transitions (FederatedClient.begin_round) ---
+OPTIMIZER_STATE_POLICY = "keep"  # Adam moments at a new global model: "keep", "reset", or "keep_variance" (zero momentum only)
+DATA_WORKERS = 2  # DataLoader worker processes for the client's train/val loaders
+PERSISTENT_DATA_WORKERS = True  # keep workers (and their caches) alive between epochs and rounds
+DATASET_CACHE_ITEMS = 0  # decoded volumes each worker keeps in memory; 0 disables the cache
+
+# --- Model size (models/unetr_model presets, utils/preset_selection) ---
+MODEL_PRESET = "base"  # "tiny" | "small" | "base"; must match the federation's (federated_server --model-preset)
+ROUND_TIME_BUDGET_S = 3600  # local training time per round the preset recommendation must fit in
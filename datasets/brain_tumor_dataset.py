@@ -1,22 +1,44 @@
 import os
+from collections import OrderedDict
 import numpy as np
 import torch
 from torch.utils.data import Dataset, DataLoader
 from monai.transforms import DivisiblePad
 from glob import glob
+import config
 from config import BASE_DIR
 
 
 class BrainTumor3DDataset(Dataset):
-    def __init__(self, img_dir, mask_dir):
+    """Padded (image, mask) volumes from .npy files.
+
+    With `cache_items` > 0 the most recently used volumes are kept decoded in
+    memory. Each DataLoader worker has its own cache, so it only survives
+    between epochs and rounds when the loader keeps persistent workers.
+    """
+
+    def __init__(self, img_dir, mask_dir, cache_items=None):
         self.img_files = sorted(glob(os.path.join(img_dir, "*.npy")))
         self.mask_files = sorted(glob(os.path.join(mask_dir, "*.npy")))
         self.pad = DivisiblePad(k=16)
+        self.cache_items = config.DATASET_CACHE_ITEMS if cache_items is None else cache_items
+        self.cache = OrderedDict()
 
     def __len__(self):
         return len(self.img_files)
 
     def __getitem__(self, idx):
+        if idx in self.cache:
+            self.cache.move_to_end(idx)
+            return self.cache[idx]
+        item = self._load(idx)
+        if self.cache_items:
+            self.cache[idx] = item
+            if len(self.cache) > self.cache_items:
+                self.cache.popitem(last=False)
+        return item
+
+    def _load(self, idx):
         img = np.load(self.img_files[idx])
         mask = np.load(self.mask_files[idx])
 
@@ -34,6 +56,16 @@ class BrainTumor3DDataset(Dataset):
         return img, mask
 
 
+def make_loader(dataset, batch_size=1, shuffle=False, num_workers=None):
+    """DataLoader whose workers (and their dataset caches) stay alive across epochs and rounds."""
+    num_workers = config.DATA_WORKERS if num_workers is None else num_workers
+    return DataLoader(
+        dataset, batch_size=batch_size, shuffle=shuffle, num_workers=num_workers,
+        persistent_workers=num_workers > 0 and config.PERSISTENT_DATA_WORKERS,
+        pin_memory=torch.cuda.is_available()
+    )
+
+
 def get_client_data(batch_size=1):
 
     data_path=os.path.join(BASE_DIR,"data")
@@ -51,8 +83,8 @@ def get_client_data(batch_size=1):
     val_ds = BrainTumor3DDataset(val_img, val_mask)
     test_ds = BrainTumor3DDataset(test_img, test_mask)
 
-    train_loader = DataLoader(train_ds, batch_size=batch_size, shuffle=True)
-    val_loader = DataLoader(val_ds, batch_size=1, shuffle=False)
+    train_loader = make_loader(train_ds, batch_size=batch_size, shuffle=True)
+    val_loader = make_loader(val_ds, batch_size=1, shuffle=False)
     test_loader = DataLoader(test_ds, batch_size=1, shuffle=False)
 
     return train_loader, val_loader, test_loader
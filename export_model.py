@@ -0,0 +1,93 @@
+import os
+import json
+import argparse
+import torch
+from models.unetr_model import get_unetr, infer_preset
+from utils.inference_runtime import META_FILE
+from utils.flat_tensors import load_checkpoint
+from utils.peft import merge_lora_state
+
+ROI_SIZE = (128, 160, 160)
+IN_CHANNELS = 3
+
+
+def load_checkpoint_into_model(model_path, device):
+    """Build UNETR in the checkpoint's size preset and load a round_N.pth (flat or pickled) state dict into it."""
+    checkpoint = load_checkpoint(model_path, map_location=device)
+
+    if isinstance(checkpoint, dict) and 'model_state_dict' in checkpoint:
+        checkpoint = checkpoint['model_state_dict']
+    model = get_unetr(device, preset=infer_preset(checkpoint))
+    # LoRA-trained checkpoints: fold the adapters into the base weights
+    model.load_state_dict(merge_lora_state(checkpoint))
+
+    model.eval()
+    return model
+
+
+def _meta(model_path, device, fmt):
+    return {
+        "source": os.path.basename(model_path),
+        "format": fmt,
+        "device": str(device),
+        "roi_size": list(ROI_SIZE),
+        "in_channels": IN_CHANNELS,
+    }
+
+
+def export_torchscript(model_path, out_path, device="cpu"):
+    """Trace the checkpoint at a fixed ROI shape, freeze it and fuse ops for inference.
+
+    The frozen graph is specialised for the device type it was exported on.
+    """
+    model = load_checkpoint_into_model(model_path, device)
+    example = torch.zeros((1, IN_CHANNELS, *ROI_SIZE), device=device)
+
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example)
+        frozen = torch.jit.optimize_for_inference(torch.jit.freeze(traced))
+
+    extra = {META_FILE: json.dumps(_meta(model_path, device, "torchscript"))}
+    torch.jit.save(frozen, out_path, _extra_files=extra)
+    print(f"[Export] TorchScript artifact → {out_path}")
+    return out_path
+
+
+def export_onnx(model_path, out_path, device="cpu", opset=17):
+    """Export the checkpoint to ONNX with a fixed ROI and a dynamic window batch."""
+    model = load_checkpoint_into_model(model_path, device)
+    example = torch.zeros((1, IN_CHANNELS, *ROI_SIZE), device=device)
+
+    with torch.no_grad():
+        torch.onnx.export(
+            model, example, out_path,
+            input_names=["image"],
+            output_names=["logits"],
+            dynamic_axes={"image": {0: "batch"}, "logits": {0: "batch"}},
+            opset_version=opset,
+            do_constant_folding=True
+        )
+
+    # ONNX has no extra-files slot, so the metadata sits next to the model
+    with open(os.path.splitext(out_path)[0] + ".json", "w") as f:
+        json.dump(_meta(model_path, device, "onnx"), f)
+
+    print(f"[Export] ONNX artifact → {out_path}")
+    return out_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export a round checkpoint for inference-only nodes")
+    parser.add_argument("checkpoint", help="Path to a round_N.pth checkpoint")
+    parser.add_argument("--format", choices=["torchscript", "onnx"], default="torchscript")
+    parser.add_argument("--out", help="Output path (defaults next to the checkpoint)")
+    parser.add_argument("--device", default="cpu", help="Device the artifact will run on")
+    args = parser.parse_args()
+
+    ext = ".ts" if args.format == "torchscript" else ".onnx"
+    out = args.out or os.path.splitext(args.checkpoint)[0] + ext
+
+    if args.format == "torchscript":
+        export_torchscript(args.checkpoint, out, args.device)
+    else:
+        export_onnx(args.checkpoint, out, args.device)
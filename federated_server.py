@@ -0,0 +1,581 @@
+"""Local reference federated server.
+
+Implements the endpoints FederatedClient and client_backend talk to, so the
+client can be developed and benchmarked without the production server.
+Uploaded updates are aggregated either synchronously (a round closes when
+every expected client has reported) or FedBuff-style asynchronously (a new
+global model is published after every K updates, whatever round they were
+trained in, with stale updates down-weighted).
+
+    python federated_server.py --data-dir server_data --port 8000 --mode async --buffer-size 4
+"""
+from flask import Flask, request, jsonify, send_file, Response
+import os
+import re
+import json
+import gzip
+import time
+import queue
+import shutil
+import hashlib
+import argparse
+import threading
+import config
+from utils.hashing import file_digest, file_manifest
+from utils.flat_tensors import is_flat_file, save_flat, load_checkpoint, save_checkpoint
+from utils.update_codec import MAGIC, is_encoded_update, decode_delta, decode_update
+from utils.fed_utils import StreamingFedAvg, GlobalRoundIndex, resume_global_state, record_global_round
+
+app = Flask(__name__)
+
+DATA_DIR = "server_data"
+server_state = {"current_round": 1, "deadline": None}
+MODEL_PRESET = config.MODEL_PRESET  # UNETR size every client in this federation must train
+ROUND_DEADLINE_S = None  # seconds clients get per round; advertised as an absolute "deadline"
+round_changed = threading.Condition()
+aggregator = None  # set by start_aggregator(); without it uploads are only stored
+
+# Throttled stand-in for testing uploads: cap on how fast request bodies are read
+# (MB/s, None = unlimited) and the chance that a chunk upload fails with a 503
+INGRESS_LIMIT_MBPS = None
+CHUNK_FAULT_RATE = 0.0
+
+
+def global_model_path():
+    return os.path.join(DATA_DIR, "global_models", "global_latest.pth")
+
+
+def global_dir():
+    return os.path.join(DATA_DIR, "global_models")
+
+
+def logs_dir():
+    return os.path.join(DATA_DIR, "logs")
+
+
+def flat_global_model_path():
+    """Flat-format copy of the global model, rebuilt whenever the .pth changes."""
+    path = global_model_path()
+    if is_flat_file(path):
+        return path
+
+    flat_path = os.path.splitext(path)[0] + ".flat"
+    if not os.path.exists(flat_path) or os.path.getmtime(flat_path) < os.path.getmtime(path):
+        save_flat(load_checkpoint(path), flat_path)
+    return flat_path
+
+
+@app.before_request
+def decode_request_body():
+    """Transparently inflate gzip-encoded uploads (e.g. from client_backend's proxy)."""
+    if request.headers.get("Content-Encoding") == "gzip":
+        environ = request.environ
+        environ["wsgi.input"] = gzip.GzipFile(fileobj=environ["wsgi.input"], mode="rb")
+        environ["wsgi.input_terminated"] = True
+        environ.pop("CONTENT_LENGTH", None)
+
+
+def publish_round(new_round):
+    """Advance the round and wake every long-poll and event-stream listener."""
+    with round_changed:
+        server_state["current_round"] = new_round
+        server_state["deadline"] = time.time() + ROUND_DEADLINE_S if ROUND_DEADLINE_S else None
+        round_changed.notify_all()
+    print(f"[SERVER] Round {new_round} published")
+
+
+# --- Aggregation (sync FedAvg / buffered async FedBuff) ---
+class Aggregator:
+    """Folds uploaded client updates into the global model on a worker thread.
+
+    Every update is turned into a delta against the global model it was
+    trained from (global_round_{r-1} for round r) and added to a
+    StreamingFedAvg accumulator with weight n * s(staleness), where n is the
+    number of samples the client actually trained on (deadline-shortened
+    rounds report fewer) or else its dataset size, and
+    where s(t) = (1 + t) ** -staleness_exponent. The accumulator holds one
+    model's worth of memory however many updates are buffered.
+
+    mode="sync":  only updates for the current round count; the round closes
+                  once `clients_per_round` distinct clients have reported. A
+                  client that uploads again replaces its earlier update, so
+                  sync updates are kept as files and folded at publish time.
+    mode="async": updates up to `max_staleness` rounds old are accepted; a new
+                  global model is published after every `buffer_size`.
+
+    The new global model is global + server_lr * weighted mean delta. Updates
+    that cover only part of the model (PEFT rounds) change only those tensors.
+    """
+
+    def __init__(self, mode="sync", clients_per_round=2, buffer_size=4, max_staleness=4,
+                 staleness_exponent=0.5, server_lr=1.0):
+        if mode not in ("sync", "async"):
+            raise ValueError(f"Unknown aggregation mode '{mode}'")
+        self.mode = mode
+        self.target = clients_per_round if mode == "sync" else buffer_size
+        self.max_staleness = 0 if mode == "sync" else max_staleness
+        self.staleness_exponent = staleness_exponent
+        self.server_lr = server_lr
+
+        start_round, weights, _ = resume_global_state(global_dir(), logs_dir())
+        self.global_state = None if weights is None else {k: v.clone() for k, v in weights.items()}
+        if weights is not None:
+            server_state["current_round"] = start_round
+
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        self._reset_buffer()
+        self.round_started = time.time()
+        self.history = []  # per published round: updates, staleness, latency
+        threading.Thread(target=self._worker, daemon=True, name="aggregator").start()
+
+    def _reset_buffer(self):
+        self.accumulator = None
+        self.buffered = []  # (client_id, staleness) of every update in the accumulator
+        self.pending = {}  # sync mode: client_id → (update_path, meta, weight), latest upload only
+
+    def set_global(self, state, round_num):
+        """Seed or replace the global model (e.g. from /api/publish-global-model)."""
+        with self.lock:
+            self.global_state = {k: v.detach().cpu().clone() for k, v in state.items()}
+            record_global_round(global_dir(), logs_dir(), round_num - 1, self.global_state)
+            self._reset_buffer()
+            self.round_started = time.time()
+
+    def submit(self, update_path, meta):
+        self.queue.put((update_path, meta))
+
+    def _worker(self):
+        while True:
+            update_path, meta = self.queue.get()
+            try:
+                self._fold(update_path, meta)
+            except Exception as e:
+                print(f"[SERVER] Failed to aggregate {update_path}: {e}")
+
+    def _base_state(self, trained_round):
+        """Global model a client trained from in `trained_round`."""
+        if trained_round == server_state["current_round"]:
+            return self.global_state
+        index = GlobalRoundIndex(global_dir())
+        return load_checkpoint(index.path_for(trained_round - 1), mmap=True)
+
+    def _delta(self, update_path, base):
+        with open(update_path, "rb") as f:
+            head = f.read(len(MAGIC))
+            if is_encoded_update(head):
+                f.seek(0)
+                blob = f.read()
+                try:
+                    return decode_delta(blob)[0]
+                except ValueError:  # encoded full weights
+                    state = decode_update(blob)
+            else:
+                state = load_checkpoint(update_path, mmap=True)
+        # Tensors the global model does not have yet (LoRA adapters in their first
+        # round) count from zero, so their mean becomes the new global value
+        return {k: v.float() - base[k].float() if k in base else v.float()
+                for k, v in state.items() if v.is_floating_point()}
+
+    def _fold(self, update_path, meta):
+        with self.lock:
+            if self.global_state is None:
+                print(f"[SERVER] No global model yet, ignoring update from client {meta['client_id']}")
+                return
+
+            current = server_state["current_round"]
+            staleness = current - meta["round"]
+            if staleness < 0 or staleness > self.max_staleness:
+                print(f"[SERVER] Dropping update from client {meta['client_id']} "
+                      f"for round {meta['round']} (current round {current})")
+                return
+
+            samples = meta.get("samples_trained") or meta["dataset_size"]
+            weight = samples * (1 + staleness) ** -self.staleness_exponent
+            if self.mode == "sync":
+                replaced = meta["client_id"] in self.pending
+                self.pending[meta["client_id"]] = (update_path, meta, weight)
+                count = len(self.pending)
+            else:
+                replaced = False
+                self._accumulate(update_path, meta, weight, staleness)
+                count = len(self.buffered)
+            print(f"[SERVER] {'Replaced' if replaced else 'Buffered'} update from client {meta['client_id']} "
+                  f"(staleness {staleness}, weight {weight:.1f}) [{count}/{self.target}]")
+
+            if count >= self.target:
+                try:
+                    self._publish()
+                except Exception:
+                    # A buffer that cannot be published would fail again on every later update
+                    self._reset_buffer()
+                    raise
+
+    def _accumulate(self, update_path, meta, weight, staleness):
+        # Chunked uploads arrive as several files, each holding a group of tensors
+        base = self._base_state(meta["round"])
+        delta = {}
+        for path in meta.get("chunks") or [update_path]:
+            delta.update(self._delta(path, base))
+        if self.accumulator is None:
+            self.accumulator = StreamingFedAvg(delta)
+        self.accumulator.add(delta, weight)
+        self.buffered.append((meta["client_id"], staleness))
+
+    def _publish(self):
+        start = time.time()
+        for update_path, meta, weight in self.pending.values():
+            self._accumulate(update_path, meta, weight, 0)
+        mean_delta = self.accumulator.result()
+        new_state = dict(self.global_state)
+        for key, delta in mean_delta.items():
+            base = self.global_state.get(key)
+            if base is None:
+                new_state[key] = delta.clone()  # first round of a tensor the global model lacked
+            else:
+                new_state[key] = (base.float() + self.server_lr * delta).to(base.dtype)
+
+        closed_round = server_state["current_round"]
+        latency = start - self.round_started
+        round_metrics = {
+            "updates": len(self.buffered),
+            "mean_staleness": sum(s for _, s in self.buffered) / len(self.buffered),
+            "round_seconds": round(latency, 3),
+            "aggregate_seconds": round(time.time() - start, 3),
+        }
+        record_global_round(global_dir(), logs_dir(), closed_round, new_state, round_metrics)
+        save_checkpoint(new_state, global_model_path())
+
+        self.global_state = new_state
+        self.history.append({"round": closed_round, **round_metrics})
+        self._reset_buffer()
+        self.round_started = time.time()
+        publish_round(closed_round + 1)
+
+    def status(self):
+        with self.lock:
+            return {
+                "mode": self.mode,
+                "current_round": server_state["current_round"],
+                "buffered": len(self.pending) if self.mode == "sync" else len(self.buffered),
+                "target": self.target,
+                "history": self.history[-20:],
+            }
+
+
+def start_aggregator(**kwargs):
+    global aggregator
+    aggregator = Aggregator(**kwargs)
+    return aggregator
+
+
+@app.route('/api/get-current-round', methods=['GET'])
+def get_current_round():
+    return jsonify({
+        "current_round": server_state["current_round"], "deadline": server_state["deadline"], "model_preset": MODEL_PRESET
+    })
+
+
+@app.route('/api/wait-round', methods=['GET'])
+def wait_round():
+    """Long-poll: answer as soon as the round moves past `after`, or after `timeout` seconds."""
+    after = request.args.get("after", type=int, default=0)
+    timeout = min(request.args.get("timeout", type=float, default=30.0), 120.0)
+
+    with round_changed:
+        round_changed.wait_for(lambda: server_state["current_round"] > after, timeout=timeout)
+        current = server_state["current_round"]
+    return jsonify({"current_round": current, "changed": current > after, "deadline": server_state["deadline"]})
+
+
+@app.route('/api/round-events', methods=['GET'])
+def round_events():
+    """Server-sent events: one message per published round, plus keep-alive comments."""
+    def stream():
+        last = None
+        while True:
+            with round_changed:
+                round_changed.wait_for(lambda: server_state["current_round"] != last, timeout=15)
+                current = server_state["current_round"]
+            if current != last:
+                last = current
+                yield f"data: {json.dumps({'current_round': current})}\n\n"
+            else:
+                yield ": keep-alive\n\n"
+
+    return Response(stream(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@app.route('/api/publish-global-model', methods=['POST'])
+def publish_global_model():
+    """Stand-in for the aggregation step: store a new global model and advance the round."""
+    file = request.files.get("file")
+    if file is None:
+        return jsonify({"success": False, "error": "No file received"}), 400
+
+    path = global_model_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    file.save(path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+    new_round = request.form.get("round", type=int, default=server_state["current_round"] + 1)
+    if aggregator is not None:
+        aggregator.set_global(load_checkpoint(path), new_round)
+    publish_round(new_round)
+    return jsonify({"success": True, "current_round": server_state["current_round"]})
+
+
+@app.route('/api/get-global-model', methods=['GET'])
+def get_global_model():
+    path = global_model_path()
+    if not os.path.exists(path):
+        return jsonify({"error": "No global model published yet"}), 404
+
+    # ?format=flat streams header + raw buffers that clients can load in place
+    if request.args.get("format") == "flat":
+        path = flat_global_model_path()
+
+    # The manifest root is the ETag: clients send If-None-Match to skip unchanged
+    # models and Range/If-Range to resume partial downloads (conditional=True)
+    response = send_file(path, mimetype="application/octet-stream", conditional=True, etag=file_manifest(path)["root"])
+    response.headers["X-Content-SHA256"] = file_digest(path)
+    return response
+
+
+@app.route('/api/get-global-model-manifest', methods=['GET'])
+def get_global_model_manifest():
+    """Per-chunk hashes of the file /api/get-global-model serves, for verifying it while it downloads."""
+    path = global_model_path()
+    if not os.path.exists(path):
+        return jsonify({"error": "No global model published yet"}), 404
+    if request.args.get("format") == "flat":
+        path = flat_global_model_path()
+    return jsonify({**file_manifest(path), "round": server_state["current_round"]})
+
+
+@app.route('/api/upload-client-weights', methods=['POST'])
+def upload_client_weights():
+    file = request.files.get("file")
+    client_id = request.form.get("client_id")
+    cur_round = request.form.get("cur_round", server_state["current_round"])
+
+    if file is None or client_id is None:
+        return jsonify({"success": False, "error": "file and client_id are required"}), 400
+    error = _invalid_upload(client_id, cur_round)
+    if error:
+        return jsonify({"success": False, "error": error}), 400
+    cur_round = int(cur_round)
+    if not _preset_matches(request.form.get("model_preset")):
+        return _preset_mismatch(client_id, request.form.get("model_preset"))
+
+    round_dir = os.path.join(DATA_DIR, "client_updates", f"round_{cur_round}")
+    os.makedirs(round_dir, exist_ok=True)
+    update_path = os.path.join(round_dir, f"client_{client_id}.upd")
+    expected = request.form.get("sha256")
+    sha256 = hashlib.sha256()
+    with open(update_path + ".tmp", "wb") as f:
+        for block in iter(lambda: file.stream.read(1024 * 1024), b""):
+            sha256.update(block)
+            f.write(block)
+    if expected and sha256.hexdigest() != expected:
+        os.remove(update_path + ".tmp")
+        print(f"[SERVER] Rejected corrupt update from client {client_id} for round {cur_round}")
+        return jsonify({"success": False, "error": "Checksum mismatch"}), 400
+    os.replace(update_path + ".tmp", update_path)
+
+    meta = {
+        "client_id": client_id,
+        "round": cur_round,
+        "dataset_size": int(request.form.get("dataset_size", 1)),
+        "samples_trained": request.form.get("samples_trained", type=int),
+        "encoding": request.form.get("encoding", "raw"),
+        "bytes": os.path.getsize(update_path),
+    }
+    with open(update_path + ".json", "w") as f:
+        json.dump(meta, f)
+
+    print(f"[SERVER] Received update from client {client_id} for round {cur_round} ({meta['bytes']} bytes)")
+    if aggregator is not None:
+        aggregator.submit(update_path, meta)
+    return jsonify({"success": True, "round": cur_round})
+
+
+def _invalid_upload(client_id, cur_round):
+    """Why an upload's client_id/cur_round cannot be used in file paths, or None if they can."""
+    if not re.fullmatch(r"[\w-][\w .-]{0,63}", str(client_id)):
+        return "client_id may only contain letters, digits, spaces, '_', '-' and '.' (not leading)"
+    try:
+        int(cur_round)
+    except (TypeError, ValueError):
+        return f"cur_round must be an integer, got {cur_round!r}"
+    return None
+
+
+def _preset_matches(model_preset):
+    # Clients that do not say which preset they trained are accepted as before
+    return model_preset in (None, "", MODEL_PRESET)
+
+
+def _preset_mismatch(client_id, model_preset):
+    print(f"[SERVER] Rejected update from client {client_id}: '{model_preset}' preset, federation trains '{MODEL_PRESET}'")
+    return jsonify({"success": False, "error": f"Model preset '{model_preset}' does not match the "
+                                              f"federation's '{MODEL_PRESET}'"}), 409
+
+
+# --- Chunked, resumable uploads (utils/upload_scheduler) ---
+def upload_session_dir(upload_id):
+    return os.path.join(DATA_DIR, "upload_sessions", os.path.basename(upload_id))
+
+
+def _received_chunks(session_dir, n_chunks):
+    return [i for i in range(n_chunks) if os.path.exists(os.path.join(session_dir, f"chunk_{i:04d}.upd"))]
+
+
+def _completed_session(session_dir):
+    """The final response of an upload that was already filed, or None if it is still open."""
+    path = os.path.join(session_dir, "complete.json")
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def _read_body(stream, sink):
+    """Copy the request body to `sink`, no faster than INGRESS_LIMIT_MBPS; returns its SHA-256."""
+    sha256 = hashlib.sha256()
+    for block in iter(lambda: stream.read(64 * 1024), b""):
+        if INGRESS_LIMIT_MBPS:
+            time.sleep(len(block) / (INGRESS_LIMIT_MBPS * 1024 * 1024))
+        sha256.update(block)
+        sink.write(block)
+    return sha256.hexdigest()
+
+
+@app.route('/api/upload-session', methods=['POST'])
+def open_upload_session():
+    """Start (or resume) a chunked upload; answers with the chunks already received."""
+    session = request.get_json(silent=True)
+    if not isinstance(session, dict) or not isinstance(session.get("chunks"), list) or "upload_id" not in session:
+        return jsonify({"success": False, "error": "Expected a JSON object with upload_id and chunks"}), 400
+    error = _invalid_upload(session.get("client_id"), session.get("cur_round"))
+    if error:
+        return jsonify({"success": False, "error": error}), 400
+    if not _preset_matches(session.get("model_preset")):
+        return _preset_mismatch(session.get("client_id"), session.get("model_preset"))
+    session_dir = upload_session_dir(session["upload_id"])
+    completed = _completed_session(session_dir)
+    if completed is not None:
+        return jsonify({"upload_id": session["upload_id"], **completed})
+    os.makedirs(session_dir, exist_ok=True)
+    session_path = os.path.join(session_dir, "session.json")
+    if not os.path.exists(session_path):
+        with open(session_path, "w") as f:
+            json.dump(session, f)
+
+    received = _received_chunks(session_dir, len(session["chunks"]))
+    return jsonify({"upload_id": session["upload_id"], "received": received})
+
+
+@app.route('/api/upload-session/<upload_id>/chunk/<int:index>', methods=['PUT'])
+def upload_chunk(upload_id, index):
+    session_dir = upload_session_dir(upload_id)
+    completed = _completed_session(session_dir)
+    if completed is not None:
+        return jsonify(completed)  # a retry after the last chunk already went through
+    session_path = os.path.join(session_dir, "session.json")
+    if not os.path.exists(session_path):
+        return jsonify({"success": False, "error": "Unknown upload session"}), 404
+    with open(session_path) as f:
+        session = json.load(f)
+
+    if index >= len(session["chunks"]):
+        return jsonify({"success": False, "error": f"Chunk {index} out of range for {len(session['chunks'])} chunks"}), 400
+
+    if CHUNK_FAULT_RATE and int.from_bytes(os.urandom(2), "little") / 65536 < CHUNK_FAULT_RATE:
+        return jsonify({"success": False, "error": "Injected fault"}), 503
+
+    chunk_path = os.path.join(session_dir, f"chunk_{index:04d}.upd")
+    with open(chunk_path + ".tmp", "wb") as f:
+        digest = _read_body(request.stream, f)
+    if digest != session["chunks"][index]["sha256"]:
+        os.remove(chunk_path + ".tmp")
+        return jsonify({"success": False, "error": f"Checksum mismatch for chunk {index}"}), 400
+    os.replace(chunk_path + ".tmp", chunk_path)
+
+    received = _received_chunks(session_dir, len(session["chunks"]))
+    if len(received) < len(session["chunks"]):
+        return jsonify({"success": True, "received": received, "complete": False})
+
+    # All chunks in: file them like a single upload and hand them to the aggregator
+    client_id, cur_round = session["client_id"], int(session["cur_round"])
+    update_dir = os.path.join(DATA_DIR, "client_updates", f"round_{cur_round}", f"client_{client_id}")
+    if os.path.exists(update_dir):
+        shutil.rmtree(update_dir)
+    shutil.move(session_dir, update_dir)
+    chunks = [os.path.join(update_dir, f"chunk_{i:04d}.upd") for i in range(len(session["chunks"]))]
+
+    meta = {
+        "client_id": client_id,
+        "round": cur_round,
+        "dataset_size": int(session.get("dataset_size", 1)),
+        "samples_trained": session.get("samples_trained"),
+        "encoding": session.get("encoding", "raw"),
+        "bytes": sum(os.path.getsize(p) for p in chunks),
+        "chunks": chunks,
+    }
+    with open(update_dir + ".upd.json", "w") as f:
+        json.dump(meta, f)
+
+    # Remember the session as delivered, so a client that resends it is not counted twice
+    completed = {"success": True, "received": received, "complete": True, "round": cur_round}
+    os.makedirs(session_dir)
+    with open(os.path.join(session_dir, "complete.json"), "w") as f:
+        json.dump(completed, f)
+
+    print(f"[SERVER] Received chunked update from client {client_id} for round {cur_round} "
+          f"({len(chunks)} chunks, {meta['bytes']} bytes)")
+    if aggregator is not None:
+        aggregator.submit(update_dir, meta)
+    return jsonify(completed)
+
+
+@app.route('/api/status', methods=['GET'])
+def status():
+    if aggregator is None:
+        return jsonify({"mode": None, "current_round": server_state["current_round"]})
+    return jsonify(aggregator.status())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local reference federated server")
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--mode", choices=("sync", "async"), default="sync")
+    parser.add_argument("--clients-per-round", type=int, default=2, help="sync: updates that close a round")
+    parser.add_argument("--buffer-size", type=int, default=4, help="async: updates per published model (K)")
+    parser.add_argument("--max-staleness", type=int, default=4, help="async: oldest accepted update, in rounds")
+    parser.add_argument("--staleness-exponent", type=float, default=0.5)
+    parser.add_argument("--server-lr", type=float, default=1.0)
+    parser.add_argument("--init-model", help="Seed the global model from this checkpoint")
+    parser.add_argument("--model-preset", choices=("tiny", "small", "base"), default=config.MODEL_PRESET,
+                        help="UNETR size every client must train (see utils/preset_selection)")
+    parser.add_argument("--round-deadline", type=float, default=None, help="Seconds clients get per round")
+    parser.add_argument("--ingress-mbps", type=float, default=None, help="Throttle chunk uploads (testing)")
+    parser.add_argument("--chunk-fault-rate", type=float, default=0.0, help="Fail this share of chunk uploads (testing)")
+    args = parser.parse_args()
+
+    DATA_DIR = args.data_dir
+    ROUND_DEADLINE_S = args.round_deadline
+    MODEL_PRESET = args.model_preset
+    INGRESS_LIMIT_MBPS = args.ingress_mbps
+    CHUNK_FAULT_RATE = args.chunk_fault_rate
+    os.makedirs(global_dir(), exist_ok=True)
+    start_aggregator(
+        mode=args.mode, clients_per_round=args.clients_per_round, buffer_size=args.buffer_size,
+        max_staleness=args.max_staleness, staleness_exponent=args.staleness_exponent, server_lr=args.server_lr
+    )
+    if args.init_model and aggregator.global_state is None:
+        state = load_checkpoint(args.init_model)
+        aggregator.set_global(state, server_state["current_round"])
+        save_checkpoint(state, global_model_path())
+    app.run(port=args.port, threaded=True)
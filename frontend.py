@@ -9,6 +9,7 @@ from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from matplotlib.figure import Figure
 import requests
 import torch
+import config
 
 from prediction_frame import PredictionFrame
 
@@ -148,6 +149,13 @@ class FederatedClientGUI:
                 cur_round=cur_round,
                 device=self.device
             )
+            try:
+                self.client.check_model_preset(self.server_url)
+            except ValueError as e:
+                messagebox.showerror("Model Size Mismatch", str(e))
+                return
+            except requests.RequestException:
+                pass  # server unreachable; already reported above
             
             # Clear setup screen and show main UI
             for widget in self.root.winfo_children():
@@ -414,6 +422,8 @@ class FederatedClientGUI:
             update_status_callback=self.update_status
         )
 
+        self.start_round_watcher()
+
     def show_prediction_frame(self):
         """Switch to prediction frame"""
         # Hide training frame
@@ -483,6 +493,44 @@ class FederatedClientGUI:
         except Exception as e:
             messagebox.showerror("Connection Error", f"Could not connect to server:\n{str(e)}")
     
+    def start_round_watcher(self):
+        """Follow round changes on the server with a long-poll thread (polling if the server has no long-poll endpoint)"""
+        self.round_watch_stop = threading.Event()
+        self.round_watch_thread = threading.Thread(target=self.round_watch_worker, daemon=True)
+        self.round_watch_thread.start()
+    
+    def round_watch_worker(self):
+        """Worker thread that blocks on the server until a new round is published"""
+        last_seen = self.client.cur_round
+        while not self.round_watch_stop.is_set():
+            new_round = self.client.wait_for_round(
+                self.server_url, after_round=last_seen, stop_event=self.round_watch_stop
+            )
+            if new_round is None:
+                break
+            last_seen = new_round
+            # Download here, off the Tk thread; begin_round then only copies the weights in
+            try:
+                path = self.client.pull_global_model(self.server_url)
+            except (OSError, ValueError) as e:
+                self.root.after(0, self.log_message, f"✗ Could not pull the global model for Round {new_round}: {e}")
+                path = None
+            # Tk widgets must only be touched from the main thread
+            self.root.after(0, self.on_new_round, new_round, path)
+    
+    def on_new_round(self, new_round, global_path=None):
+        """Handle a round published by the server, warm-starting from the pulled global model"""
+        self.log_message(f"Server published Round {new_round}")
+        if self.is_training:
+            return
+        
+        self.client.begin_round(new_round, path=global_path)
+        self.round_label.config(text=str(new_round))
+        self.update_status("New round available", "#3498db")
+        
+        if config.AUTO_TRAIN_ON_NEW_ROUND:
+            self.start_training()
+    
     def start_training(self):
         """Start training in a separate thread"""
         if self.is_training:
@@ -582,11 +630,18 @@ class FederatedClientGUI:
             # if self.stop_requested:
             #     raise InterruptedError("Training stopped by user")
             
-            self.log_message("Sending update to server...")
-            self.client.send_update(self.server_url,os.path.join('client_checkpoints',"round_1.pth"))
+            # Save + upload run on the client's commit worker; the GUI moves on right away
+            self.log_message("Committing update in background...")
+            commit = self.client.commit_round_async(
+                self.server_url,
+                on_progress=lambda message: self.root.after(0, self.log_message, message)
+            )
+            commit.add_done_callback(
+                lambda future, round_num=self.current_training_round: self.root.after(0, self.on_commit_done, future, round_num)
+            )
             
-            self.log_message("✓ Training round completed successfully!")
-            self.update_status("Training completed", "#2ecc71")
+            self.log_message("✓ Local training finished, upload in progress")
+            self.update_status("Uploading update...", "#f39c12")
             
             # Increment round for next training
             self.client.cur_round += 1
@@ -610,6 +665,17 @@ class FederatedClientGUI:
             self.sync_button.config(state=tk.NORMAL)
             self.update_plot()
     
+    def on_commit_done(self, future, round_num):
+        """Report the result of a background save + upload"""
+        error = future.exception()
+        if error is None:
+            self.log_message(f"✓ Round {round_num} update received by server")
+            self.update_status("Training completed", "#2ecc71")
+        else:
+            self.log_message(f"✗ Upload for Round {round_num} failed: {str(error)}")
+            self.update_status("Upload failed", "#e74c3c")
+            messagebox.showerror("Upload Error", str(error))
+    
     def update_metrics_from_log(self):
         """Read and display latest metrics from log file"""
         if not os.path.exists(self.logs_path):
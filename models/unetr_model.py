@@ -1,16 +1,38 @@
 import torch
 from monai.networks.nets import UNETR
+import config
 
-def get_unetr(device):
+# ViT-Tiny/Small/Base-sized encoders. Every client in a federation must use the
+# same preset: weights of different presets have different shapes and cannot
+# be averaged (the server rejects updates for another preset).
+UNETR_PRESETS = {
+    "tiny": {"feature_size": 8, "hidden_size": 192, "mlp_dim": 768, "num_heads": 3},
+    "small": {"feature_size": 16, "hidden_size": 384, "mlp_dim": 1536, "num_heads": 6},
+    "base": {"feature_size": 16, "hidden_size": 768, "mlp_dim": 3072, "num_heads": 12},
+}
+
+
+def get_unetr(device, preset=None):
+    """UNETR in the named size preset (config.MODEL_PRESET by default)."""
+    preset = preset or config.MODEL_PRESET
+    if preset not in UNETR_PRESETS:
+        raise ValueError(f"Unknown UNETR preset '{preset}', expected one of {list(UNETR_PRESETS)}")
     return UNETR(
         in_channels=3,
         out_channels=1,
         img_size=(128, 160, 160),
-        feature_size=16,
-        hidden_size=768,
-        mlp_dim=3072,
-        num_heads=12,
         norm_name="instance",
         res_block=True,
-        dropout_rate=0.0
+        dropout_rate=0.0,
+        **UNETR_PRESETS[preset]
     ).to(device)
+
+
+def infer_preset(state_dict):
+    """The preset a UNETR state dict was trained with, from its ViT width and first-stage channels."""
+    hidden = state_dict["vit.norm.weight"].shape[0]
+    features = state_dict["encoder1.layer.conv1.conv.weight"].shape[0]
+    for name, preset in UNETR_PRESETS.items():
+        if (preset["hidden_size"], preset["feature_size"]) == (hidden, features):
+            return name
+    raise ValueError(f"No UNETR preset with hidden_size={hidden}, feature_size={features}")
@@ -1,28 +1,57 @@
 import numpy as np
 import re, os
-from utils.predict_eval_utils import predict, evaluate_per_slice
-from models.unetr_model import get_unetr
+import json
+import argparse
+from utils.predict_eval_utils import predict, alloc_mask
+from utils.metrics import compute_segmentation_metrics
+from utils.inference_runtime import is_exported_model, load_inference_model, pad_divisible
+from utils.checkpoint_store import CheckpointStore
 import torch
-from monai.transforms import DivisiblePad
 
-def predict_and_evaluate_mask(image_path, mask_path=None, model_path=None, device=None):
+def find_latest_checkpoint(checkpoint_dir="client_checkpoints/"):
+    if not os.path.exists(checkpoint_dir):
+        raise FileNotFoundError(f"Checkpoint directory not found: {checkpoint_dir}")
+        
+    # Checkpoint store: O(1) lookup through its round index
+    if os.path.exists(os.path.join(checkpoint_dir, "index.json")):
+        store = CheckpointStore(checkpoint_dir)
+        if store.latest_round() is not None:
+            return store.checkout()
+
+    files = os.listdir(checkpoint_dir)
+    round_files = [f for f in files if re.match(r"round_(\d+)\.pth$", f)]
+    
+    if not round_files:
+        raise FileNotFoundError("No checkpoint files found in client_checkpoints/")
+        
+    latest = max(round_files, key=lambda f: int(re.search(r"(\d+)", f).group()))
+    return os.path.join(checkpoint_dir, latest)
+
+def load_prediction_model(model_path, device):
+    # Exported artifacts run without MONAI; raw state dicts need the UNETR definition
+    if is_exported_model(model_path):
+        return load_inference_model(model_path, device)
+
+    from export_model import load_checkpoint_into_model
+    return load_checkpoint_into_model(model_path, device)
+
+def preprocess_image(img_array):
+    # [H, W, D, C] → [C, D, H, W] as a view; padding makes the only copy
+    image = torch.from_numpy(img_array).permute(3, 2, 0, 1).float()
+    return pad_divisible(image, k=16)
+
+def preprocess_mask(mask_array):
+    # [H, W, D] → [1, D, H, W], kept as uint8 instead of float32
+    mask = torch.from_numpy(mask_array).permute(2, 0, 1).unsqueeze(0)
+    return pad_divisible((mask > 0.5).to(torch.uint8), k=16)
+
+def predict_and_evaluate_mask(image_path, mask_path=None, model_path=None, device=None, cache=None, threshold=0.5):
     
     device = device or ("cuda" if torch.cuda.is_available() else "cpu")
     
     # Load model checkpoint
     if not model_path:
-        checkpoint_dir = "client_checkpoints/"
-        if not os.path.exists(checkpoint_dir):
-            raise FileNotFoundError(f"Checkpoint directory not found: {checkpoint_dir}")
-            
-        files = os.listdir(checkpoint_dir)
-        round_files = [f for f in files if re.match(r"round_(\d+)\.pth$", f)]
-        
-        if not round_files:
-            raise FileNotFoundError("No checkpoint files found in client_checkpoints/")
-            
-        latest = max(round_files, key=lambda f: int(re.search(r"(\d+)", f).group()))
-        model_path = os.path.join(checkpoint_dir, latest)
+        model_path = find_latest_checkpoint()
     
     # Check if files exist
     if not os.path.exists(image_path):
@@ -31,41 +60,49 @@ def predict_and_evaluate_mask(image_path, mask_path=None, model_path=None, devic
     if mask_path and not os.path.exists(mask_path):
         raise FileNotFoundError(f"Mask file not found: {mask_path}")
     
-    # Load model
-    model = get_unetr(device)
-    checkpoint = torch.load(model_path, map_location=device)
+    # Load and preprocess image (kept on the host for display, copied to device once in predict)
+    image = preprocess_image(np.load(image_path))
     
-    if isinstance(checkpoint, dict) and 'model_state_dict' in checkpoint:
-        model.load_state_dict(checkpoint['model_state_dict'])
-    else:
-        model.load_state_dict(checkpoint)
-    
-    model.eval()  # Set to evaluation mode
-    
-    # Load and preprocess image
-    img_array = np.load(image_path)
-    image = np.transpose(img_array, (3, 2, 0, 1))  # Adjust based on your data format
-    image = torch.from_numpy(image).float().to(device)  # Move to device
-    
-    pad = DivisiblePad(k=16)
-    image = pad(image)
-    
-    # Predict
-    with torch.no_grad():  # Disable gradient computation
-        pred_mask = predict(model, image, device)
+    # A cache hit skips model loading and inference entirely
+    cache_key = cache.make_key(image_path, model_path, threshold=threshold, pad_k=16) if cache else None
+    pred_mask = cache.get(cache_key) if cache else None
+    cache_hit = pred_mask is not None
     
-    # If no ground truth, return prediction only
-    if not mask_path:
-        return pred_mask, None
+    if not cache_hit:
+        model = load_prediction_model(model_path, device)
+        roi_size = getattr(model, "roi_size", (128, 160, 160))
+        
+        # Predict, leaving the bool mask on the device for evaluation
+        pred_mask = predict(model, image, device, threshold=threshold, roi_size=roi_size)
     
-    # Load and preprocess ground truth mask
-    mask_array = np.load(mask_path)
-    mask = np.transpose(mask_array, (2, 0, 1))  # Check if this matches your data
-    mask = np.expand_dims(mask, axis=0)
-    mask = torch.from_numpy(mask).float().to(device)  # Move to device
-    mask = pad(mask)
+    metrics, mask = None, None
+    if mask_path:
+        # uint8 ground truth, moved to the device once inside the metrics pass
+        mask = preprocess_mask(np.load(mask_path))
+        
+        # Evaluate (per-slice Dice along the axial axis of [1, D, H, W])
+        metrics = compute_segmentation_metrics(pred_mask, mask, slice_dim=1)
     
-    # Evaluate
-    dice_scores = evaluate_per_slice(pred_mask, mask)
+    if cache_hit:
+        return pred_mask, metrics, image, mask
     
-    return pred_mask, dice_scores, image, mask
+    pred_host = alloc_mask((1, *image.shape[1:]), device)
+    pred_host.copy_(pred_mask)  # single device → host transfer of the mask
+    if cache:
+        cache.put(cache_key, pred_host)
+    return pred_host, metrics, image, mask
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Predict a tumour mask and report segmentation metrics")
+    parser.add_argument("image")
+    parser.add_argument("--mask", help="Ground truth mask for evaluation")
+    parser.add_argument("--model", help="Checkpoint or exported artifact (defaults to latest round)")
+    args = parser.parse_args()
+
+    _, metrics, _, _ = predict_and_evaluate_mask(args.image, args.mask, args.model)
+    if metrics is None:
+        print("Prediction complete (no ground truth provided for evaluation)")
+    else:
+        summary = metrics.to_dict()
+        summary.pop("dice_per_slice")
+        print(json.dumps(summary, indent=2))
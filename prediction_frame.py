@@ -2,6 +2,8 @@ import tkinter as tk
 from tkinter import filedialog, messagebox
 import os
 from predict_mask import predict_and_evaluate_mask
+from utils.prediction_cache import PredictionCache
+from utils.checkpoint_store import CheckpointStore
 import torch
 class PredictionFrame:
     """Handles the prediction UI and functionality"""
@@ -22,7 +24,9 @@ class PredictionFrame:
         self.frame = None
         self.loaded_image_path = None
         self.loaded_model_path = None
+        self.loaded_model_name = None
         self.loaded_groundtruth_path = None
+        self.prediction_cache = PredictionCache()
         
     def create_frame(self, back_callback):
         """Create the prediction frame UI"""
@@ -321,21 +325,81 @@ class PredictionFrame:
             self.groundtruth_label.config(text=f"✓ {filename}", fg="#27ae60")
             self.update_status("Ground truth loaded", "#3498db")
     
+    def _checkpoint_store(self):
+        """The client's round store, or the one in client_checkpoints/ if there is no client"""
+        store = getattr(self.client, "checkpoint_store", None)
+        if store is None and os.path.exists(os.path.join("client_checkpoints", "index.json")):
+            store = CheckpointStore("client_checkpoints")
+        return store
+
     def load_model_checkpoint(self):
-        """Load a specific model checkpoint"""
+        """Pick a stored round, or browse for any checkpoint file"""
+        store = self._checkpoint_store()
+        if store is None or not store.rounds():
+            self.browse_model_file()
+            return
+
+        rounds = sorted(store.rounds(), reverse=True)
+        best = store.best_round()
+        dialog = tk.Toplevel(self.frame)
+        dialog.title("Select Model Checkpoint")
+        dialog.transient(self.frame)
+        dialog.grab_set()
+
+        tk.Label(dialog, text="Stored rounds:", font=("Arial", 10, "bold")).pack(anchor="w", padx=15, pady=(15, 5))
+        listbox = tk.Listbox(dialog, width=40, height=min(10, len(rounds)), font=("Arial", 10))
+        for round_num in rounds:
+            dice = store.metrics(round_num).get("val_dice")
+            label = f"Round {round_num}"
+            if dice is not None:
+                label += f"  —  val Dice {dice:.4f}"
+            if round_num == best:
+                label += "  (best)"
+            listbox.insert(tk.END, label)
+        listbox.selection_set(0)
+        listbox.pack(fill=tk.BOTH, expand=True, padx=15)
+
+        def use_round():
+            selection = listbox.curselection()
+            if not selection:
+                return
+            round_num = rounds[selection[0]]
+            # Materialized on demand; the store itself keeps only deduplicated chunks
+            path = store.checkout(round_num, path=os.path.join(store.root, "selected.pth"))
+            dialog.destroy()
+            self.set_model(path, f"Round {round_num}")
+
+        def browse():
+            dialog.destroy()
+            self.browse_model_file()
+
+        listbox.bind("<Double-Button-1>", lambda event: use_round())
+        button_frame = tk.Frame(dialog)
+        button_frame.pack(fill=tk.X, padx=15, pady=15)
+        tk.Button(button_frame, text="Use Round", command=use_round, bg="#16a085", fg="white",
+                  padx=10, cursor="hand2").pack(side=tk.LEFT)
+        tk.Button(button_frame, text="📂 Other File...", command=browse, padx=10,
+                  cursor="hand2").pack(side=tk.RIGHT)
+
+    def set_model(self, path, name):
+        self.loaded_model_path = path
+        self.loaded_model_name = name
+        self.model_path_label.config(text=f"✓ {name}", fg="#27ae60")
+
+    def browse_model_file(self):
+        """Load a specific model checkpoint file"""
         file_path = filedialog.askopenfilename(
             title="Select Model Checkpoint",
             initialdir='client_checkpoints/',
             filetypes=[
                 ("PyTorch Model", "*.pth *.pt"),
+                ("Exported Model", "*.ts *.torchscript *.onnx"),
                 ("All files", "*.*")
             ]
         )
         
         if file_path:
-            self.loaded_model_path = file_path
-            filename = os.path.basename(file_path)
-            self.model_path_label.config(text=f"✓ {filename}", fg="#27ae60")
+            self.set_model(file_path, os.path.basename(file_path))
     
     def run_prediction(self):
         """Run prediction on the loaded image"""
@@ -351,11 +415,12 @@ class PredictionFrame:
             from predict_mask import predict_and_evaluate_mask
             
             # Run prediction
-            pred_mask, dice_scores, image, mask = predict_and_evaluate_mask(
+            pred_mask, metrics, image, mask = predict_and_evaluate_mask(
                 image_path=self.loaded_image_path,
                 mask_path=self.loaded_groundtruth_path,
                 model_path=self.loaded_model_path,
-                device=self.device
+                device=self.device,
+                cache=self.prediction_cache
             )
             
             # Clear previous results
@@ -363,25 +428,28 @@ class PredictionFrame:
                 widget.destroy()
             
             # Display results
-            self.display_prediction_results(pred_mask, dice_scores, image, mask)
+            self.display_prediction_results(pred_mask, metrics, image, mask)
             
             self.update_status("Prediction complete", "#2ecc71")
             
             # Show success message with dice scores if available
-            if dice_scores is not None:
+            if metrics is not None:
                 messagebox.showinfo(
                     "Prediction Complete", 
                     f"Prediction successful!\n\n"
                     f"Image: {os.path.basename(self.loaded_image_path)}\n"
                     f"Ground Truth: {os.path.basename(self.loaded_groundtruth_path)}\n"
-                    f"Model: {'Latest checkpoint' if not self.loaded_model_path else os.path.basename(self.loaded_model_path)}"
+                    f"Model: {self.loaded_model_name or 'Latest checkpoint'}\n\n"
+                    f"Dice: {metrics.dice:.4f}   IoU: {metrics.iou:.4f}\n"
+                    f"Sensitivity: {metrics.sensitivity:.4f}   Specificity: {metrics.specificity:.4f}\n"
+                    f"Volume (pred / true): {metrics.pred_volume:.0f} / {metrics.true_volume:.0f} voxels"
                 )
             else:
                 messagebox.showinfo(
                     "Prediction Complete", 
                     f"Prediction successful!\n\n"
                     f"Image: {os.path.basename(self.loaded_image_path)}\n"
-                    f"Model: {'Latest checkpoint' if not self.loaded_model_path else os.path.basename(self.loaded_model_path)}\n"
+                    f"Model: {self.loaded_model_name or 'Latest checkpoint'}\n"
                     f"(No ground truth provided for evaluation)"
                 )
             
@@ -396,7 +464,7 @@ class PredictionFrame:
         finally:
             self.predict_btn.config(state=tk.NORMAL, text="▶ Generate Prediction")
 
-    def display_prediction_results(self, pred_mask, dice_scores, image, mask):
+    def display_prediction_results(self, pred_mask, metrics, image, mask):
         import matplotlib.pyplot as plt
         from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
         import tkinter as tk
@@ -405,6 +473,7 @@ class PredictionFrame:
         self.pred_mask = pred_mask        # torch.Size([1, D, H, W])
         self.gt_mask = mask               # torch.Size([1, D, H, W])
         self.image_tensor = image         # torch.Size([3, D, H, W])
+        self.metrics = metrics            # SegmentationMetrics or None
 
         self.depth = pred_mask.shape[1]
         self.current_slice = self.depth // 2  # Start in the middle
@@ -452,19 +521,6 @@ class PredictionFrame:
         self.slice_slider.pack()
 
 
-    def _compute_dice(self, pred_slice, gt_slice):
-        """Compute Dice score for a single 2D slice."""
-        import numpy as np
-
-        pred_bin = (pred_slice > 0.5).astype(np.float32)
-        gt_bin   = (gt_slice > 0.5).astype(np.float32)
-
-        intersection = (pred_bin * gt_bin).sum()
-        denom = pred_bin.sum() + gt_bin.sum() + 1e-8
-
-        return (2 * intersection) / denom
-
-
     def _draw_slice(self, z):
         # Clear axes
         self.ax_c0.clear()
@@ -491,19 +547,23 @@ class PredictionFrame:
         self.ax_c2.axis("off")
 
         # --- Ground Truth ---
-        gt = self.gt_mask[0, z].cpu().numpy()
-        self.ax_gt.imshow(gt, cmap="gray")
-        self.ax_gt.set_title("Ground Truth")
+        if self.gt_mask is not None:
+            gt = self.gt_mask[0, z].cpu().numpy()
+            self.ax_gt.imshow(gt, cmap="gray")
+            self.ax_gt.set_title("Ground Truth")
+        else:
+            self.ax_gt.set_title("No Ground Truth")
         self.ax_gt.axis("off")
 
         # --- Prediction ---
         pred = self.pred_mask[0, z].cpu().numpy()
         self.ax_pred.imshow(pred, cmap="gray")
 
-        # Compute Dice *NOW*
-        dice = self._compute_dice(pred, gt)
-
-        self.ax_pred.set_title(f"Prediction\nDice: {dice:.4f}")
+        # Per-slice Dice was computed once for the whole volume
+        if self.metrics is not None:
+            self.ax_pred.set_title(f"Prediction\nDice: {self.metrics.dice_per_slice[z]:.4f}")
+        else:
+            self.ax_pred.set_title("Prediction")
         self.ax_pred.axis("off")
 
         self.fig.suptitle("Image Channels • Ground Truth • Prediction",
@@ -0,0 +1,239 @@
+"""Run N FederatedClients on one machine against the local reference server.
+
+Each client is a separate process with its own working directory (logs.csv,
+client_checkpoints/, global_models/) and its own shard of the training and
+validation data. The global model is downloaded once per round into
+shared-memory tensors that every client process reads from, instead of N
+separate downloads. federated_server and client_backend run in-process on
+free ports.
+
+    python simulate.py --clients 4 --rounds 3 --mode sync --epochs 1
+"""
+import os
+import json
+import time
+import shutil
+import argparse
+import threading
+import requests
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+from torch.utils.data import DataLoader, Subset
+from werkzeug.serving import make_server
+import config
+import federated_server
+import client_backend
+from datasets.brain_tumor_dataset import BrainTumor3DDataset
+from models.unetr_model import get_unetr
+from utils.flat_tensors import read_flat_into, TeeReader, save_checkpoint
+
+
+# --- Data partitioning ---
+def partition(n_items, n_clients, scheme="iid", seed=0):
+    """Split item indices among clients: shuffled ("iid") or contiguous blocks ("sequential", site-like)."""
+    indices = np.arange(n_items)
+    if scheme == "iid":
+        np.random.default_rng(seed).shuffle(indices)
+    return [part.tolist() for part in np.array_split(indices, n_clients)]
+
+
+def data_dirs(data_root, split):
+    return os.path.join(data_root, split, "images"), os.path.join(data_root, split, "masks")
+
+
+# --- Client process ---
+def client_main(client_id, work_dir, data_root, train_idx, val_idx, shared_state, backend_url, server_url,
+                device, batch_size, commands, results, model_preset=None):
+    config.CLIENT_BACKEND_URL = backend_url
+    config.MODEL_PRESET = model_preset or config.MODEL_PRESET  # spawned processes re-import config
+    train_ds = Subset(BrainTumor3DDataset(*data_dirs(data_root, "Training")), train_idx)
+    val_ds = Subset(BrainTumor3DDataset(*data_dirs(data_root, "Validation")), val_idx)
+    os.makedirs(work_dir, exist_ok=True)
+    os.chdir(work_dir)
+
+    from client import FederatedClient
+    client = FederatedClient(
+        client_id=client_id,
+        model_fn=get_unetr,
+        train_loader=DataLoader(train_ds, batch_size=batch_size, shuffle=True),
+        val_loader=DataLoader(val_ds, batch_size=1, shuffle=False),
+        cur_round=1,
+        device=device
+    )
+    results.put({"client_id": client_id, "ready": True})
+
+    while True:
+        command = commands.get()
+        if command is None:
+            break
+        round_num, epochs, deadline = command
+
+        start = time.perf_counter()
+        client.begin_round(round_num, state=shared_state)
+        loaded = time.perf_counter()
+        client.train_one_round(epochs=epochs, deadline=deadline)
+        trained = time.perf_counter()
+        client.commit_round_async(server_url).result()
+        committed = time.perf_counter()
+
+        results.put({
+            "client_id": client_id,
+            "round": round_num,
+            "samples": client.last_round_samples,
+            "load_s": loaded - start,
+            "train_s": trained - loaded,
+            "commit_s": committed - trained,
+            "total_s": committed - start,
+            "val_dice": client.last_val_dice,
+        })
+
+
+# --- Simulation driver ---
+def serve(app):
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def fetch_global(server_url, shared_state):
+    """Stream the current global model straight into the shared tensors; returns bytes received."""
+    response = requests.get(f"{server_url}/api/get-global-model", params={"format": "flat"}, stream=True, timeout=30)
+    response.raise_for_status()
+    response.raw.decode_content = True
+    read_flat_into(TeeReader(response.raw, hash=False), shared_state, strict=False)
+    return int(response.headers.get("Content-Length", 0))
+
+
+def upload_bytes(round_num):
+    """Bytes each client uploaded in a round, from the server's update sidecars."""
+    round_dir = os.path.join(federated_server.DATA_DIR, "client_updates", f"round_{round_num}")
+    sizes = {}
+    for name in os.listdir(round_dir) if os.path.isdir(round_dir) else []:
+        if name.endswith(".json"):
+            with open(os.path.join(round_dir, name)) as f:
+                meta = json.load(f)
+            sizes[meta["client_id"]] = meta["bytes"]
+    return sizes
+
+
+def run(args):
+    if os.path.exists(args.work_dir):
+        shutil.rmtree(args.work_dir)
+    federated_server.DATA_DIR = os.path.abspath(os.path.join(args.work_dir, "server"))
+    federated_server.ROUND_DEADLINE_S = args.round_deadline
+    federated_server.MODEL_PRESET = config.MODEL_PRESET = args.model_preset
+    os.makedirs(federated_server.global_dir(), exist_ok=True)
+    data_root = os.path.abspath(os.path.join(config.BASE_DIR, "data"))
+
+    # Server stand-in and upload proxy
+    federated_server.start_aggregator(
+        mode=args.mode, clients_per_round=args.clients, buffer_size=args.buffer_size or args.clients
+    )
+    fed, server_url = serve(federated_server.app)
+    backend, backend_url = serve(client_backend.app)
+
+    initial = get_unetr("cpu").state_dict()
+    federated_server.aggregator.set_global(initial, federated_server.server_state["current_round"])
+    save_checkpoint(initial, federated_server.global_model_path())
+
+    # Read-only global weights in shared memory, refreshed once per round
+    shared_state = {k: v.clone().share_memory_() for k, v in initial.items()}
+    del initial
+
+    n_train = len(BrainTumor3DDataset(*data_dirs(data_root, "Training")))
+    n_val = len(BrainTumor3DDataset(*data_dirs(data_root, "Validation")))
+    train_parts = partition(n_train, args.clients, args.partition)
+    val_parts = partition(n_val, args.clients, "sequential")
+
+    ctx = mp.get_context("spawn")
+    results = ctx.Queue()
+    commands, procs = [], []
+    for i in range(args.clients):
+        client_id = f"sim{i}"
+        queue = ctx.Queue()
+        proc = ctx.Process(target=client_main, args=(
+            client_id, os.path.abspath(os.path.join(args.work_dir, client_id)), data_root,
+            train_parts[i], val_parts[i], shared_state, backend_url, server_url,
+            args.device, args.batch_size, queue, results, args.model_preset
+        ))
+        proc.start()
+        commands.append(queue)
+        procs.append(proc)
+    for _ in procs:
+        results.get()  # wait until every client has built its model
+
+    report = {"clients": args.clients, "mode": args.mode, "rounds": []}
+    round_num = federated_server.server_state["current_round"]
+    for _ in range(args.rounds):
+        start = time.perf_counter()
+        download = fetch_global(server_url, shared_state)
+        deadline = federated_server.server_state["deadline"]
+        epochs = None if deadline else args.epochs  # with a deadline, clients size their own rounds
+        for queue in commands:
+            queue.put((round_num, epochs, deadline))
+        per_client = [results.get() for _ in procs]
+
+        # The round is over once the server has published the next global model
+        with federated_server.round_changed:
+            federated_server.round_changed.wait_for(
+                lambda: federated_server.server_state["current_round"] > round_num, timeout=args.round_timeout
+            )
+        latency = time.perf_counter() - start
+
+        uploads = upload_bytes(round_num)
+        for entry in per_client:
+            entry["upload_bytes"] = uploads.get(entry["client_id"], 0)
+        samples = sum(e["samples"] for e in per_client)
+        summary = {
+            "round": round_num,
+            "latency_s": latency,
+            "download_bytes": download,
+            "upload_bytes": sum(uploads.values()),
+            "samples_per_s": samples / latency,
+            "slowest_client_s": max(e["total_s"] for e in per_client),
+            "clients": per_client,
+        }
+        report["rounds"].append(summary)
+
+        print(f"\n[SIM] Round {round_num}: {latency:.1f} s, {summary['samples_per_s']:.2f} samples/s, "
+              f"down {download / 2**20:.1f} MB (shared), up {summary['upload_bytes'] / 2**20:.1f} MB")
+        print(f"{'client':<8}{'train s':>9}{'commit s':>10}{'samples/s':>11}{'up MB':>8}{'dice':>8}")
+        for e in sorted(per_client, key=lambda e: e["client_id"]):
+            dice = f"{e['val_dice']:.3f}" if e["val_dice"] is not None else "-"
+            print(f"{e['client_id']:<8}{e['train_s']:>9.1f}{e['commit_s']:>10.1f}"
+                  f"{e['samples'] / e['train_s']:>11.2f}{e['upload_bytes'] / 2**20:>8.1f}{dice:>8}")
+
+        round_num = federated_server.server_state["current_round"]
+
+    for queue in commands:
+        queue.put(None)
+    for proc in procs:
+        proc.join()
+    backend.shutdown()
+    fed.shutdown()
+
+    with open(os.path.join(args.work_dir, "report.json"), "w") as f:
+        json.dump(report, f, indent=2)
+    total = sum(r["latency_s"] for r in report["rounds"])
+    print(f"\n[SIM] {args.rounds} rounds in {total:.1f} s "
+          f"(mean round latency {total / args.rounds:.1f} s) → {os.path.join(args.work_dir, 'report.json')}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate a federation of N clients on this machine")
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--epochs", type=int, default=config.EPOCHS_PER_CLIENT)
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--partition", choices=("iid", "sequential"), default="iid")
+    parser.add_argument("--mode", choices=("sync", "async"), default="sync")
+    parser.add_argument("--buffer-size", type=int, default=None, help="async: updates per global model (default: --clients)")
+    parser.add_argument("--model-preset", choices=("tiny", "small", "base"), default=config.MODEL_PRESET)
+    parser.add_argument("--device", default="cpu", help="Device for every client; processes share it")
+    parser.add_argument("--round-timeout", type=float, default=600)
+    parser.add_argument("--round-deadline", type=float, default=None,
+                        help="Seconds per round advertised by the server; clients shrink their epochs to fit")
+    parser.add_argument("--work-dir", default="simulation")
+    run(parser.parse_args())
@@ -0,0 +1,100 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("numpy")
+from utils.flat_tensors import save_checkpoint
+from utils.fed_utils import krum_aggregate, median_aggregate, trimmed_mean_aggregate
+
+# ~1 KB column chunks, so every aggregator crosses several chunk boundaries
+CHUNK_MB = 0.001
+
+
+def make_updates(n, seed=0):
+    g = torch.Generator().manual_seed(seed)
+    return [{
+        "conv.weight": torch.randn(8, 4, 3, generator=g),
+        "conv.bias": torch.randn(8, generator=g),
+        "norm.weight": torch.randn(8, generator=g).half(),
+        "steps": torch.tensor(5),
+    } for _ in range(n)]
+
+
+def stacked(updates, key):
+    return torch.stack([u[key].float() for u in updates])
+
+
+def assert_matches(result, updates, reference):
+    for key, value in updates[0].items():
+        if not value.is_floating_point():
+            assert torch.equal(result[key], value)
+            continue
+        assert result[key].dtype == value.dtype and result[key].shape == value.shape, key
+        atol = 1e-3 if value.dtype == torch.float16 else 1e-6
+        torch.testing.assert_close(result[key].float(), reference(stacked(updates, key)).to(value.dtype).float(),
+                                   rtol=0, atol=atol)
+
+
+def test_median_matches_reference():
+    updates = make_updates(5)
+    result = median_aggregate(updates, chunk_mb=CHUNK_MB)
+    assert_matches(result, updates, lambda x: x.median(dim=0).values)
+
+
+def test_median_of_even_count_averages_the_middle_pair():
+    updates = make_updates(4)
+    result = median_aggregate(updates, chunk_mb=CHUNK_MB)
+    assert_matches(result, updates, lambda x: x.sort(dim=0).values[1:3].mean(dim=0))
+
+
+def test_median_reads_checkpoints_from_disk(tmp_path):
+    updates = make_updates(3)
+    paths = []
+    for i, update in enumerate(updates):
+        paths.append(str(tmp_path / f"client_{i}.pth"))
+        save_checkpoint(update, paths[-1])
+    assert_matches(median_aggregate(paths, chunk_mb=CHUNK_MB), updates, lambda x: x.median(dim=0).values)
+
+
+@pytest.mark.parametrize("n, trim_ratio", [(5, 0.0), (5, 0.2), (10, 0.3)])
+def test_trimmed_mean_matches_reference(n, trim_ratio):
+    updates = make_updates(n)
+    k = int(n * trim_ratio)
+    result = trimmed_mean_aggregate(updates, trim_ratio=trim_ratio, chunk_mb=CHUNK_MB)
+    assert_matches(result, updates, lambda x: x.sort(dim=0).values[k:n - k].mean(dim=0))
+
+
+def test_trimmed_mean_rejects_trimming_everyone():
+    with pytest.raises(ValueError):
+        trimmed_mean_aggregate(make_updates(4), trim_ratio=0.5)
+
+
+def krum_reference(updates, n_byzantine, multi_krum):
+    flat = [torch.cat([u[k].double().flatten() for k in u if u[k].is_floating_point()]) for u in updates]
+    n = len(flat)
+    scores = []
+    for i in range(n):
+        dists = sorted(float(((flat[i] - flat[j]) ** 2).sum()) for j in range(n) if j != i)
+        scores.append(sum(dists[:n - n_byzantine - 2]))
+    return sorted(range(n), key=scores.__getitem__)[:multi_krum]
+
+
+@pytest.mark.parametrize("multi_krum", [1, 3])
+def test_krum_excludes_outliers_and_matches_reference(multi_krum):
+    updates = make_updates(7)
+    for outlier in (updates[2], updates[5]):
+        for key, value in outlier.items():
+            if value.is_floating_point():
+                outlier[key] = value + 50
+
+    result, selected = krum_aggregate(updates, n_byzantine=2, multi_krum=multi_krum, chunk_mb=CHUNK_MB)
+
+    expected = krum_reference(updates, n_byzantine=2, multi_krum=multi_krum)
+    assert sorted(selected) == sorted(expected)
+    assert not {2, 5} & set(selected)
+    chosen = [updates[i] for i in selected]
+    assert_matches(result, chosen, lambda x: x.mean(dim=0))
+
+
+def test_krum_needs_more_than_f_plus_two_clients():
+    with pytest.raises(ValueError):
+        krum_aggregate(make_updates(4), n_byzantine=2)
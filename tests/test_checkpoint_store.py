@@ -0,0 +1,92 @@
+import os
+import pytest
+
+torch = pytest.importorskip("torch")
+from utils.checkpoint_store import CheckpointStore
+from utils.flat_tensors import load_checkpoint
+
+
+def make_state(seed):
+    g = torch.Generator().manual_seed(seed)
+    return {
+        "encoder.weight": torch.randn(64, 32, generator=g),
+        "encoder.bias": torch.randn(64, generator=g),
+        "head.weight": torch.randn(1, 64, generator=g).to(torch.float16),
+        "steps": torch.tensor(seed, dtype=torch.int64),
+    }
+
+
+def assert_state_equal(actual, expected):
+    assert actual.keys() == expected.keys()
+    for key in expected:
+        assert actual[key].dtype == expected[key].dtype, key
+        assert torch.equal(actual[key], expected[key]), key
+
+
+@pytest.fixture
+def store(tmp_path):
+    return CheckpointStore(str(tmp_path / "store"), chunk_mb=0.001, keep_last=2, keep_best=1)
+
+
+def test_put_get_round_trip(store):
+    state = make_state(1)
+    store.put(1, state)
+    assert_state_equal(store.get(1), state)
+    assert store.latest_round() == 1
+
+
+def test_unchanged_round_writes_no_new_chunks(store):
+    state = make_state(1)
+    assert store.put(1, state) > 0
+    assert store.put(2, state) == 0
+
+
+def test_resaving_a_round_with_state_replaces_the_checkout(store):
+    first, second = make_state(1), make_state(2)
+    store.put(3, first)
+    path = store.checkout(3, state=first)
+    assert_state_equal(load_checkpoint(path), first)
+
+    # Same round again (retrain after a restart): the file must hold the new weights
+    store.put(3, second)
+    path = store.checkout(3, state=second)
+    assert_state_equal(load_checkpoint(path), second)
+
+
+def test_resaving_a_round_without_state_checks_it_out_again(store):
+    store.put(3, make_state(1))
+    store.checkout(3)
+    store.put(3, make_state(2))
+    assert_state_equal(load_checkpoint(store.checkout(3)), make_state(2))
+
+
+def test_current_checkout_is_reused(store):
+    store.put(1, make_state(1))
+    path = store.checkout(1)
+    mtime = os.stat(path).st_mtime_ns
+    assert store.checkout(1) == path
+    assert os.stat(path).st_mtime_ns == mtime
+
+
+def test_retention_keeps_last_and_best(store):
+    for round_num, dice in enumerate([0.9, 0.1, 0.2, 0.3], start=1):
+        store.put(round_num, make_state(round_num), {"val_dice": dice})
+    assert store.rounds() == [1, 3, 4]
+    assert store.best_round() == 1
+    assert_state_equal(store.get(1), make_state(1))
+
+
+def test_commit_checkpoint_does_not_share_the_prediction_checkout(store):
+    pytest.importorskip("monai")
+    pytest.importorskip("tqdm")
+    from client import FederatedClient
+
+    fc = object.__new__(FederatedClient)
+    fc.client_id, fc.cur_round, fc.last_val_dice, fc.checkpoint_store = "test", 1, None, store
+    upload_path = fc.save_local_checkpoint(make_state(1))
+    predict_path = CheckpointStore(store.root).checkout()  # as find_latest_checkpoint does
+
+    assert upload_path != predict_path
+    fc.save_local_checkpoint(make_state(2), round_num=2)
+    assert_state_equal(load_checkpoint(predict_path), make_state(1))
+    assert_state_equal(load_checkpoint(upload_path), make_state(2))
@@ -0,0 +1,97 @@
+import io
+import hashlib
+from concurrent.futures import Future
+import pytest
+
+torch = pytest.importorskip("torch")
+np = pytest.importorskip("numpy")
+pytest.importorskip("flask")
+import config
+import client_backend
+
+
+class FakeResponse:
+    status_code = 200
+    text = "{}"
+
+    def json(self):
+        return {"success": True}
+
+
+class FakeUpstream:
+    """Stands in for the pooled upstream session and reads the proxied body like requests would."""
+
+    def __init__(self):
+        self.received = b""
+
+    def post(self, url, data=None, headers=None):
+        if hasattr(data, "read"):
+            for block in iter(lambda: data.read(64 * 1024), b""):
+                self.received += block
+        else:
+            for block in data:
+                self.received += block
+        return FakeResponse()
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    fake = FakeUpstream()
+    monkeypatch.setattr(client_backend, "upstream_session", fake)
+    return fake
+
+
+def stream_upload(body, sha256):
+    return client_backend.app.test_client().post(
+        "/api/send-local-model?federated_server_url=http://server",
+        data=body, content_type="multipart/form-data; boundary=x",
+        headers={"X-Content-SHA256": sha256},
+    )
+
+
+BODY = bytes(range(256)) * 4096 * 3  # ~3 MB, several proxy chunks
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_streamed_upload_with_matching_digest(upstream, monkeypatch, compress):
+    monkeypatch.setattr(config, "PROXY_COMPRESSION", compress)
+    response = stream_upload(BODY, hashlib.sha256(BODY).hexdigest())
+    assert response.status_code == 200
+    assert response.get_json()["success"]
+    if not compress:
+        assert upstream.received == BODY
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_streamed_upload_with_bad_digest_is_cut_short(upstream, monkeypatch, compress):
+    monkeypatch.setattr(config, "PROXY_COMPRESSION", compress)
+    response = stream_upload(BODY, hashlib.sha256(b"something else").hexdigest())
+    assert response.status_code == 400
+    assert response.get_json()["error"] == "Checksum mismatch"
+    if not compress:
+        assert len(upstream.received) < len(BODY)
+
+
+def test_predict_reports_bad_mask_as_json(monkeypatch):
+    class Predictor:
+        def submit(self, image):
+            future = Future()
+            future.set_result(torch.zeros(image.shape[1:], dtype=torch.bool))
+            return future
+
+    monkeypatch.setattr(client_backend, "get_predictor", lambda: Predictor())
+
+    def npy(array):
+        buf = io.BytesIO()
+        np.save(buf, array)
+        buf.seek(0)
+        return buf
+
+    image = np.zeros((16, 16, 16, 3), dtype=np.float16)
+    response = client_backend.app.test_client().post("/api/predict", data={
+        "image": (npy(image), "image.npy"),
+        "mask": (npy(np.zeros((16, 16), dtype=np.uint8)), "mask.npy"),  # 2-D: not a volume
+    }, content_type="multipart/form-data")
+
+    assert response.status_code == 500
+    assert response.get_json()["success"] is False
@@ -0,0 +1,104 @@
+import os
+import struct
+import pytest
+
+pytest.importorskip("torch")
+from utils.fed_utils import GlobalMetricsLog
+
+
+@pytest.fixture
+def csv_path(tmp_path):
+    return str(tmp_path / "logs" / "global_metrics.csv")
+
+
+def fill(log, n, start=1):
+    for r in range(start, start + n):
+        log.append({"round": r, "updates": 2 * r, "note": f"ründe {r}"})
+
+
+def test_append_and_read_back(csv_path):
+    log = GlobalMetricsLog(csv_path)
+    fill(log, 5)
+
+    assert len(log) == 5
+    assert log[0] == {"round": 1, "updates": 2, "note": "ründe 1"}
+    assert log[-1]["round"] == 5
+    assert [r["round"] for r in log[1:3]] == [2, 3]
+    assert [r["updates"] for r in log] == [2, 4, 6, 8, 10]
+    with pytest.raises(IndexError):
+        log[5]
+
+
+def test_reopen_picks_up_rows_from_other_writers(csv_path):
+    fill(GlobalMetricsLog(csv_path), 3)
+    with open(csv_path, "a", newline="") as f:
+        f.write("4,8,external\r\n")
+
+    log = GlobalMetricsLog(csv_path)
+    assert len(log) == 4
+    assert log[3] == {"round": 4, "updates": 8, "note": "external"}
+    assert log[2]["note"] == "ründe 3"
+
+
+def test_rewritten_csv_is_reindexed(csv_path):
+    fill(GlobalMetricsLog(csv_path), 5)
+    with open(csv_path, "w", newline="") as f:
+        f.write("round,updates,note\r\n1,100,rewritten\r\n2,200,rewritten too\r\n")
+
+    log = GlobalMetricsLog(csv_path)
+    assert len(log) == 2
+    assert [r["updates"] for r in log] == [100, 200]
+    assert log[1]["note"] == "rewritten too"
+
+
+def test_truncated_csv_is_reindexed(csv_path):
+    fill(GlobalMetricsLog(csv_path), 5)
+    with open(csv_path, "rb") as f:
+        lines = f.readlines()
+    with open(csv_path, "wb") as f:
+        f.writelines(lines[:3])
+
+    log = GlobalMetricsLog(csv_path)
+    assert [r["round"] for r in log] == [1, 2]
+
+
+def test_partial_last_row_is_indexed_once_complete(csv_path):
+    fill(GlobalMetricsLog(csv_path), 2)
+    with open(csv_path, "ab") as f:
+        f.write(b"3,6,half")
+
+    assert len(GlobalMetricsLog(csv_path)) == 2
+    with open(csv_path, "ab") as f:
+        f.write(b" written\r\n")
+    log = GlobalMetricsLog(csv_path)
+    assert len(log) == 3
+    assert log[2]["note"] == "half written"
+
+
+def test_new_keys_extend_the_header(csv_path):
+    log = GlobalMetricsLog(csv_path)
+    log.append({"round": 1, "updates": 2})
+    log.append({"round": 2, "updates": 4, "round_seconds": 1.5})
+
+    assert log.header == ["round", "updates", "round_seconds"]
+    assert log[0] == {"round": 1, "updates": 2, "round_seconds": ""}
+    assert log[1] == {"round": 2, "updates": 4, "round_seconds": 1.5}
+    assert len(GlobalMetricsLog(csv_path)) == 2
+
+
+def test_old_format_index_is_rebuilt(csv_path):
+    fill(GlobalMetricsLog(csv_path), 3)
+    # Headerless offsets, as written before the index recorded the CSV state
+    with open(csv_path + ".idx", "wb") as idx:
+        idx.write(struct.pack("<3Q", 1, 2, 3))
+
+    log = GlobalMetricsLog(csv_path)
+    assert [r["round"] for r in log] == [1, 2, 3]
+
+
+def test_deleted_csv_drops_index(csv_path):
+    fill(GlobalMetricsLog(csv_path), 2)
+    os.remove(csv_path)
+    log = GlobalMetricsLog(csv_path)
+    assert len(log) == 0
+    assert not os.path.exists(csv_path + ".idx")
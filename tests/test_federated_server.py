@@ -0,0 +1,103 @@
+import io
+import hashlib
+import os
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("flask")
+import federated_server
+from utils.flat_tensors import save_checkpoint
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    monkeypatch.setattr(federated_server, "DATA_DIR", str(tmp_path / "server"))
+    monkeypatch.setattr(federated_server, "aggregator", None)
+    monkeypatch.setitem(federated_server.server_state, "current_round", 1)
+    monkeypatch.setattr(federated_server, "publish_round",
+                        lambda r: federated_server.server_state.__setitem__("current_round", r))
+    return federated_server
+
+
+def write_update(tmp_path, name, value):
+    path = str(tmp_path / f"{name}.pth")
+    save_checkpoint({"w": torch.full((4,), float(value))}, path, fmt="pth")
+    return path
+
+
+def test_sync_round_counts_distinct_clients(server, tmp_path):
+    aggregator = server.Aggregator(mode="sync", clients_per_round=2)
+    aggregator.set_global({"w": torch.zeros(4)}, 1)
+
+    meta = {"round": 1, "dataset_size": 10}
+    aggregator._fold(write_update(tmp_path, "a1", 1.0), {**meta, "client_id": "a"})
+    aggregator._fold(write_update(tmp_path, "a2", 3.0), {**meta, "client_id": "a"})
+    assert server.server_state["current_round"] == 1  # one client twice is not two clients
+    assert aggregator.status()["buffered"] == 1
+
+    aggregator._fold(write_update(tmp_path, "b", 5.0), {**meta, "client_id": "b"})
+    assert server.server_state["current_round"] == 2
+    assert aggregator.history[-1]["updates"] == 2
+    # Only client a's latest update counts: (3 + 5) / 2
+    torch.testing.assert_close(aggregator.global_state["w"], torch.full((4,), 4.0))
+
+
+def test_async_buffer_counts_every_update(server, tmp_path):
+    aggregator = server.Aggregator(mode="async", buffer_size=2)
+    aggregator.set_global({"w": torch.zeros(4)}, 1)
+
+    meta = {"round": 1, "dataset_size": 10, "client_id": "a"}
+    aggregator._fold(write_update(tmp_path, "a1", 2.0), meta)
+    aggregator._fold(write_update(tmp_path, "a2", 4.0), meta)
+    assert server.server_state["current_round"] == 2
+    torch.testing.assert_close(aggregator.global_state["w"], torch.full((4,), 3.0))
+
+
+def upload(app, client_id, cur_round, data=b"weights"):
+    return app.test_client().post("/api/upload-client-weights", data={
+        "file": (io.BytesIO(data), "model.pth"), "client_id": client_id, "cur_round": cur_round,
+    }, content_type="multipart/form-data")
+
+
+@pytest.mark.parametrize("client_id", ["../../etc", "a/b", "..", ".hidden", ""])
+def test_upload_rejects_unsafe_client_id(server, client_id):
+    response = upload(server.app, client_id, "1")
+    assert response.status_code == 400
+    assert not os.path.exists(os.path.join(server.DATA_DIR, "etc"))
+
+
+@pytest.mark.parametrize("cur_round", ["abc", "1/../..", "1.5"])
+def test_upload_rejects_non_integer_round(server, cur_round):
+    response = upload(server.app, "site-1", cur_round)
+    assert response.status_code == 400
+    assert not os.path.exists(os.path.join(server.DATA_DIR, "client_updates"))
+
+
+def test_upload_stores_valid_update(server):
+    response = upload(server.app, "site 1", "3")
+    assert response.status_code == 200
+    assert response.get_json()["round"] == 3
+    path = os.path.join(server.DATA_DIR, "client_updates", "round_3", "client_site 1.upd")
+    with open(path, "rb") as f:
+        assert f.read() == b"weights"
+
+
+@pytest.mark.parametrize("body", [b"not json", b"[1, 2]", b'{"client_id": "site-1", "cur_round": 1}'])
+def test_upload_session_rejects_malformed_body(server, body):
+    response = server.app.test_client().post("/api/upload-session", data=body, content_type="application/json")
+    assert response.status_code == 400
+    assert response.get_json()["success"] is False
+
+
+def test_upload_chunk_index_must_be_declared(server):
+    client = server.app.test_client()
+    chunk = b"chunk bytes"
+    client.post("/api/upload-session", json={
+        "upload_id": "job1", "client_id": "site-1", "cur_round": 1,
+        "chunks": [{"bytes": len(chunk), "sha256": hashlib.sha256(chunk).hexdigest(), "tensors": ["w"]}],
+    })
+
+    response = client.put("/api/upload-session/job1/chunk/1", data=chunk)
+    assert response.status_code == 400
+    assert not os.path.exists(os.path.join(server.upload_session_dir("job1"), "chunk_0001.upd"))
+    assert client.put("/api/upload-session/job1/chunk/0", data=chunk).get_json()["complete"]
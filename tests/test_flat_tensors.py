@@ -0,0 +1,162 @@
+import io
+import os
+import hashlib
+import pytest
+
+torch = pytest.importorskip("torch")
+from utils.flat_tensors import (
+    ALIGN, FlatCheckpoint, TeeReader, convert_checkpoint, is_flat_file, load_checkpoint,
+    read_flat_into, save_checkpoint, save_flat, write_flat,
+)
+from utils.hashing import ChunkVerifier, IntegrityError, file_manifest, read_manifest
+
+
+def make_state():
+    g = torch.Generator().manual_seed(0)
+    return {
+        "conv.weight": torch.randn(8, 3, 3, 3, generator=g),
+        "conv.bias": torch.randn(8, generator=g),
+        "half": torch.randn(5, generator=g).to(torch.float16),
+        "bf16": torch.randn(7, generator=g).to(torch.bfloat16),
+        "steps": torch.tensor(3, dtype=torch.int64),
+        "mask": torch.tensor([True, False, True]),
+        "empty": torch.empty(0, 4),
+        "transposed": torch.randn(4, 6, generator=g).t(),  # non-contiguous
+    }
+
+
+def assert_state_equal(actual, expected):
+    assert list(actual.keys()) == list(expected.keys())
+    for key in expected:
+        assert actual[key].dtype == expected[key].dtype, key
+        assert actual[key].shape == expected[key].shape, key
+        assert torch.equal(actual[key], expected[key]), key
+
+
+def test_save_flat_round_trip(tmp_path):
+    path = str(tmp_path / "model.pth")
+    state = make_state()
+    save_flat(state, path)
+
+    assert is_flat_file(path)
+    assert_state_equal(load_checkpoint(path), state)
+
+
+def test_buffers_are_aligned(tmp_path):
+    path = str(tmp_path / "model.pth")
+    save_flat(make_state(), path)
+
+    checkpoint = FlatCheckpoint(path)
+    assert checkpoint.data_start % ALIGN == 0
+    assert all(entry["offset"] % ALIGN == 0 for entry in checkpoint.entries.values())
+
+
+def test_mapped_tensors_are_copy_on_write(tmp_path):
+    path = str(tmp_path / "model.pth")
+    state = make_state()
+    save_flat(state, path)
+
+    loaded = load_checkpoint(path)
+    loaded["conv.bias"].zero_()
+    assert_state_equal(load_checkpoint(path), state)
+
+
+def test_read_flat_into_fills_targets_in_place():
+    state = make_state()
+    buf = io.BytesIO()
+    write_flat(state, buf)
+    buf.seek(0)
+
+    target = {k: torch.zeros_like(v) for k, v in state.items()}
+    pointers = {k: v.data_ptr() for k, v in target.items()}
+    reader = TeeReader(buf)
+    read_flat_into(reader, target)
+
+    assert_state_equal(target, state)
+    assert all(target[k].data_ptr() == pointers[k] for k in target)
+    assert reader.hexdigest() == hashlib.sha256(buf.getvalue()).hexdigest()
+
+
+def test_read_flat_into_partial_stream():
+    state = make_state()
+    buf = io.BytesIO()
+    write_flat({"conv.bias": state["conv.bias"], "extra": torch.ones(3)}, buf)
+    buf.seek(0)
+
+    target = {k: torch.zeros_like(v) for k, v in state.items()}
+    with pytest.raises(KeyError):
+        read_flat_into(TeeReader(io.BytesIO(buf.getvalue())), target)
+    read_flat_into(TeeReader(buf), target, strict=False)
+    assert torch.equal(target["conv.bias"], state["conv.bias"])
+    assert not target["conv.weight"].any()
+
+
+def test_read_flat_into_rejects_shape_mismatch():
+    buf = io.BytesIO()
+    write_flat({"w": torch.ones(3)}, buf)
+    buf.seek(0)
+    with pytest.raises(ValueError):
+        read_flat_into(TeeReader(buf), {"w": torch.zeros(4)})
+
+
+def test_truncated_stream_raises():
+    buf = io.BytesIO()
+    write_flat(make_state(), buf)
+    with pytest.raises(EOFError):
+        read_flat_into(TeeReader(io.BytesIO(buf.getvalue()[:-16])), {k: torch.zeros_like(v) for k, v in make_state().items()})
+
+
+def test_save_flat_sidecar_matches_file(tmp_path):
+    path = str(tmp_path / "model.pth")
+    save_flat(make_state(), path)
+
+    sidecar = read_manifest(path)
+    assert sidecar is not None
+    with open(path, "rb") as f:
+        data = f.read()
+    verifier = ChunkVerifier(sidecar)
+    verifier.update(data)
+    assert verifier.finish()["root"] == sidecar["root"] == file_manifest(path)["root"]
+
+
+def test_verified_load_detects_corruption(tmp_path):
+    path = str(tmp_path / "model.pth")
+    save_flat(make_state(), path)
+    stat = (tmp_path / "model.pth").stat()
+
+    with open(path, "r+b") as f:
+        f.seek(-1, 2)
+        last = f.read(1)
+        f.seek(-1, 2)
+        f.write(bytes([last[0] ^ 0xFF]))
+    # Keep size and mtime so the sidecar still applies
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+    with pytest.raises(IntegrityError):
+        load_checkpoint(path, verify=True)
+
+
+@pytest.mark.parametrize("fmt", ["pth", "flat"])
+def test_save_checkpoint_formats(tmp_path, fmt):
+    path = str(tmp_path / "model.pth")
+    state = {k: v.contiguous() for k, v in make_state().items()}
+    save_checkpoint(state, path, fmt)
+
+    assert is_flat_file(path) == (fmt == "flat")
+    assert (read_manifest(path) is not None) == (fmt == "flat")
+    assert_state_equal(load_checkpoint(path), state)
+
+
+def test_convert_checkpoint_both_ways(tmp_path):
+    path = str(tmp_path / "model.pth")
+    state = {k: v.contiguous() for k, v in make_state().items()}
+    save_checkpoint(state, path, "pth")
+
+    convert_checkpoint(path, fmt="flat")
+    assert is_flat_file(path)
+    assert_state_equal(load_checkpoint(path), state)
+
+    convert_checkpoint(path, fmt="pth")
+    assert not is_flat_file(path)
+    assert read_manifest(path) is None
+    assert_state_equal(load_checkpoint(path), state)
@@ -0,0 +1,201 @@
+import os
+import threading
+import pytest
+
+import config
+from utils.hashing import (
+    ChunkHasher, ChunkVerifier, HashingWriter, IntegrityError, chunk_digest, file_manifest,
+    read_manifest, verified_prefix, verify_file, write_manifest,
+)
+
+CHUNK = 1024
+DATA = os.urandom(CHUNK * 5 + 300)  # five whole chunks and a partial one
+
+
+def manifest_of(data, chunk_size=CHUNK):
+    hasher = ChunkHasher(chunk_size)
+    hasher.update(data)
+    return hasher.finish()
+
+
+def test_manifest_is_independent_of_write_sizes():
+    reference = manifest_of(DATA)
+    hasher = ChunkHasher(CHUNK)
+    for start in range(0, len(DATA), 333):
+        hasher.update(DATA[start:start + 333])
+
+    assert hasher.finish() == reference
+    assert reference["size"] == len(DATA)
+    assert reference["chunks"] == [chunk_digest(DATA[i:i + CHUNK]) for i in range(0, len(DATA), CHUNK)]
+
+
+def test_root_changes_with_any_chunk():
+    damaged = DATA[:CHUNK * 3] + bytes([DATA[CHUNK * 3] ^ 1]) + DATA[CHUNK * 3 + 1:]
+    assert manifest_of(damaged)["root"] != manifest_of(DATA)["root"]
+
+
+def test_verifier_accepts_the_original():
+    verifier = ChunkVerifier(manifest_of(DATA))
+    for start in range(0, len(DATA), 700):
+        verifier.update(DATA[start:start + 700])
+    assert verifier.finish()["root"] == manifest_of(DATA)["root"]
+
+
+def test_verifier_stops_at_the_first_bad_chunk():
+    damaged = bytearray(DATA)
+    damaged[CHUNK * 2 + 10] ^= 0xFF
+    verifier = ChunkVerifier(manifest_of(DATA))
+
+    with pytest.raises(IntegrityError, match="Chunk 2"):
+        for start in range(0, len(damaged), 100):
+            verifier.update(damaged[start:start + 100])
+    assert verifier.size <= CHUNK * 3  # nothing after the bad chunk was read
+
+
+def test_verifier_rejects_truncated_and_oversized_streams():
+    manifest = manifest_of(DATA)
+    short = ChunkVerifier(manifest)
+    short.update(DATA[:-1])
+    with pytest.raises(IntegrityError, match="Truncated"):
+        short.finish()
+
+    with pytest.raises(IntegrityError):
+        ChunkVerifier(manifest).update(DATA + b"x")
+
+
+def test_verifier_resumes_at_a_chunk_boundary():
+    manifest = manifest_of(DATA)
+    verifier = ChunkVerifier(manifest, offset=CHUNK * 2)
+    verifier.update(DATA[CHUNK * 2:])
+    assert verifier.finish()["root"] == manifest["root"]
+    with pytest.raises(ValueError):
+        ChunkVerifier(manifest, offset=CHUNK + 1)
+
+
+def test_hashing_writer_and_sidecar(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "INTEGRITY_CHUNK_MB", CHUNK / 2**20)
+    path = str(tmp_path / "model.bin")
+    with open(path, "wb") as f:
+        writer = HashingWriter(f)
+        writer.write(DATA)
+    write_manifest(path, writer.manifest())
+
+    assert read_manifest(path) == manifest_of(DATA)
+    assert file_manifest(path) == manifest_of(DATA)
+    verify_file(path, read_manifest(path))
+
+    # Rewriting the file makes the sidecar stale
+    with open(path, "ab") as f:
+        f.write(b"more")
+    assert read_manifest(path) is None
+    assert file_manifest(path) == manifest_of(DATA + b"more")
+
+
+def test_verified_prefix(tmp_path):
+    manifest = manifest_of(DATA)
+    path = str(tmp_path / "model.part")
+    assert verified_prefix(path, manifest) == 0
+
+    with open(path, "wb") as f:
+        f.write(DATA[:CHUNK * 3 + 100])  # three whole chunks and a partial one
+    assert verified_prefix(path, manifest) == CHUNK * 3
+
+    with open(path, "r+b") as f:
+        f.seek(CHUNK + 5)
+        f.write(b"\0\0\0")
+    assert verified_prefix(path, manifest) == CHUNK  # stops at the damaged chunk
+
+
+def test_verify_file_reports_damage(tmp_path):
+    path = str(tmp_path / "model.bin")
+    damaged = bytearray(DATA)
+    damaged[-1] ^= 0xFF
+    with open(path, "wb") as f:
+        f.write(damaged)
+    with pytest.raises(IntegrityError, match="Chunk 5"):
+        verify_file(path, manifest_of(DATA))
+
+
+# --- Resuming the global model download against the reference server ---
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    pytest.importorskip("torch")
+    pytest.importorskip("flask")
+    from werkzeug.serving import make_server
+    import federated_server
+
+    monkeypatch.setattr(config, "INTEGRITY_CHUNK_MB", CHUNK / 2**20)
+    monkeypatch.setattr(federated_server, "DATA_DIR", str(tmp_path / "server"))
+    os.makedirs(federated_server.global_dir())
+    with open(federated_server.global_model_path(), "wb") as f:
+        f.write(DATA)
+
+    http = make_server("127.0.0.1", 0, federated_server.app, threaded=True)
+    threading.Thread(target=http.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{http.server_port}"
+    http.shutdown()
+
+
+@pytest.fixture
+def downloader(tmp_path, monkeypatch):
+    """A FederatedClient reduced to what pull_global_model needs, recording request headers."""
+    pytest.importorskip("monai")
+    pytest.importorskip("tqdm")
+    import client as client_module
+
+    monkeypatch.setattr(config, "CHECKPOINT_FORMAT", "pth")
+    fc = object.__new__(client_module.FederatedClient)
+    fc.client_id = "test"
+    fc.global_model_dir = str(tmp_path / "client")
+    fc.global_model_path = os.path.join(fc.global_model_dir, "global_latest.pth")
+    os.makedirs(fc.global_model_dir)
+
+    fc.requests_made = []
+    real_get = client_module.requests.get
+
+    def get(url, **kwargs):
+        fc.requests_made.append((url.rsplit("/", 1)[-1], kwargs.get("headers") or {}))
+        return real_get(url, **kwargs)
+
+    monkeypatch.setattr(client_module.requests, "get", get)
+    return fc
+
+
+def downloads(fc):
+    return [headers for endpoint, headers in fc.requests_made if endpoint == "get-global-model"]
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_pull_resumes_after_the_verified_prefix(server, downloader):
+    with open(downloader.global_model_path + ".part", "wb") as f:
+        f.write(DATA[:CHUNK * 3 + 50])
+
+    path = downloader.pull_global_model(server)
+
+    assert read(path) == DATA
+    assert [h.get("Range") for h in downloads(downloader)] == [f"bytes={CHUNK * 3}-"]
+    assert not os.path.exists(path + ".part")
+
+
+def test_pull_discards_damaged_part_from_the_bad_chunk(server, downloader):
+    damaged = bytearray(DATA[:CHUNK * 4])
+    damaged[CHUNK + 1] ^= 0xFF  # e.g. left over from an older model
+    with open(downloader.global_model_path + ".part", "wb") as f:
+        f.write(damaged)
+
+    path = downloader.pull_global_model(server)
+
+    assert read(path) == DATA
+    assert [h.get("Range") for h in downloads(downloader)] == [f"bytes={CHUNK}-"]
+
+
+def test_pull_skips_an_unchanged_model(server, downloader):
+    assert read(downloader.pull_global_model(server)) == DATA
+    downloader.requests_made.clear()
+
+    assert read(downloader.pull_global_model(server)) == DATA
+    assert downloads(downloader) == []  # the manifest root matched the local copy
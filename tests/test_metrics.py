@@ -0,0 +1,51 @@
+import math
+import pytest
+
+torch = pytest.importorskip("torch")
+from utils.metrics import compute_segmentation_metrics, mean_dice
+
+
+def make_masks():
+    pred = torch.zeros(4, 4, 3, dtype=torch.bool)
+    true = torch.zeros(4, 4, 3, dtype=torch.bool)
+    pred[:2, :2, 0] = True  # 4 voxels, all correct
+    true[:2, :2, 0] = True
+    pred[:2, :, 1] = True  # 8 predicted, 4 of them correct
+    true[:, :2, 1] = True  # 8 true
+    true[0, 0, 2] = True  # missed entirely
+    return pred, true
+
+
+def test_metrics_match_hand_counts():
+    pred, true = make_masks()
+    m = compute_segmentation_metrics(pred, true)
+
+    tp, p, t, n = 8, 12, 13, 48
+    assert m.dice == pytest.approx(2 * tp / (p + t))
+    assert m.iou == pytest.approx(tp / (p + t - tp))
+    assert m.sensitivity == pytest.approx(tp / t)
+    assert m.specificity == pytest.approx((n - p - t + tp) / (n - t))
+    assert m.pixel_acc == pytest.approx((n - p - t + 2 * tp) / n)
+    assert (m.pred_volume, m.true_volume) == (p, t)
+    assert m.dice_per_slice == pytest.approx([1.0, 0.5, 0.0], abs=1e-6)
+
+
+def test_per_slice_can_be_skipped():
+    pred, true = make_masks()
+    full = compute_segmentation_metrics(pred, true)
+    volume_only = compute_segmentation_metrics(pred, true, per_slice=False)
+    assert volume_only.dice_per_slice is None
+    assert volume_only.dice == full.dice
+
+
+def test_float_masks_are_thresholded():
+    pred, true = make_masks()
+    m = compute_segmentation_metrics(pred.float() * 0.9, true.float())
+    assert m.dice == compute_segmentation_metrics(pred, true).dice
+
+
+def test_empty_ground_truth_is_skipped_by_mean_dice():
+    pred, true = make_masks()
+    empty = compute_segmentation_metrics(pred, torch.zeros_like(true))
+    assert math.isnan(empty.dice)
+    assert mean_dice([empty, compute_segmentation_metrics(true, true)]) == pytest.approx(1.0)
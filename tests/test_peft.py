@@ -0,0 +1,104 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("flask")
+import torch.nn as nn
+import federated_server
+from utils.flat_tensors import save_checkpoint
+from utils.peft import ADAPTER_ROOT, apply_peft, trainable_state_dict
+
+
+class Attention(nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.qkv = nn.Linear(8, 24)
+        self.out_proj = nn.Linear(8, 8)
+
+
+class Block(nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.attn = Attention()
+
+
+class Encoder(nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.blocks = nn.ModuleList([Block(), Block()])
+
+
+class TinyViTModel(nn.Module):
+    """Just enough of UNETR's naming (vit.*.attn.qkv / out_proj) for apply_peft."""
+
+    def __init__(self):
+        super().__init__()
+        self.vit = Encoder()
+        self.head = nn.Linear(8, 1)
+
+
+def lora_model(seed=0):
+    torch.manual_seed(123)  # same base weights, like clients starting from one global model
+    model = TinyViTModel()
+    trainable = apply_peft(model, "lora", frozen_prefixes=("vit.",), rank=2, alpha=4, seed=seed)
+    return model, trainable
+
+
+def adapter_state(model):
+    return {k: v for k, v in model.state_dict().items() if k.startswith(ADAPTER_ROOT + ".")}
+
+
+def test_adapters_are_identical_across_clients():
+    a, _ = lora_model()
+    torch.manual_seed(999)  # unrelated global RNG use between clients must not matter
+    b, _ = lora_model()
+    state_a, state_b = adapter_state(a), adapter_state(b)
+    assert state_a and state_a.keys() == state_b.keys()
+    for key in state_a:
+        assert torch.equal(state_a[key], state_b[key]), key
+
+
+def test_adapters_differ_per_layer_and_seed():
+    a, _ = lora_model(seed=0)
+    c, _ = lora_model(seed=1)
+    a_state = adapter_state(a)
+    first, second = sorted(k for k in a_state if k.endswith("lora_A"))[:2]
+    assert not torch.equal(a_state[first], a_state[second])
+    assert not torch.equal(a_state[first], adapter_state(c)[first])
+
+
+def test_two_client_lora_round(tmp_path, monkeypatch):
+    monkeypatch.setattr(federated_server, "DATA_DIR", str(tmp_path / "server"))
+    monkeypatch.setitem(federated_server.server_state, "current_round", 1)
+    monkeypatch.setattr(federated_server, "publish_round",
+                        lambda r: federated_server.server_state.__setitem__("current_round", r))
+    aggregator = federated_server.Aggregator(mode="sync", clients_per_round=2)
+
+    # The server's global model is the plain base model: no adapters
+    torch.manual_seed(123)
+    base_state = TinyViTModel().state_dict()
+    aggregator.set_global(base_state, 1)
+
+    uploads, sizes = [], [30, 10]
+    for i, size in enumerate(sizes):
+        model, trainable = lora_model()
+        with torch.no_grad():
+            for name, param in model.named_parameters():
+                if param.requires_grad:
+                    param.add_(0.1 * (i + 1))  # stand-in for local training
+        update = {k: v.clone() for k, v in trainable_state_dict(model, trainable).items()}
+        path = str(tmp_path / f"client_{i}.pth")
+        save_checkpoint(update, path, fmt="flat")
+        aggregator._fold(path, {"client_id": str(i), "round": 1, "dataset_size": size})
+        uploads.append(update)
+
+    assert federated_server.server_state["current_round"] == 2
+    assert len(aggregator.history) == 1
+    global_state = aggregator.global_state
+    for key in uploads[0]:
+        expected = (uploads[0][key] * sizes[0] + uploads[1][key] * sizes[1]) / sum(sizes)
+        assert key in global_state
+        torch.testing.assert_close(global_state[key].float(), expected.float(), rtol=1e-5, atol=1e-6)
+    # Frozen encoder weights are untouched
+    for key, value in base_state.items():
+        if key.startswith("vit."):
+            torch.testing.assert_close(global_state[key], value)
@@ -0,0 +1,56 @@
+import os
+import time
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("numpy")
+from utils.prediction_cache import PredictionCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return PredictionCache(cache_dir=str(tmp_path / "cache"), max_bytes=1024 * 1024)
+
+
+def make_mask(seed=0):
+    g = torch.Generator().manual_seed(seed)
+    return torch.rand(4, 16, 16, generator=g) > 0.5
+
+
+def test_round_trip(cache):
+    mask = make_mask()
+    cache.put("a", mask)
+    assert torch.equal(cache.get("a"), mask)
+    assert cache.get("missing") is None
+
+
+@pytest.mark.parametrize("damage", [
+    lambda data: b"not a zip file at all",
+    lambda data: data[:len(data) // 2],  # truncated
+    lambda data: data[:40] + bytes(b ^ 0xFF for b in data[40:80]) + data[80:],  # corrupt member
+])
+def test_damaged_entry_is_a_miss_and_evicted(cache, damage):
+    cache.put("a", make_mask())
+    path = cache._path("a")
+    with open(path, "rb") as f:
+        data = f.read()
+    with open(path, "wb") as f:
+        f.write(damage(data))
+
+    assert cache.get("a") is None
+    assert not os.path.exists(path)
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = PredictionCache(cache_dir=str(tmp_path / "cache"), max_bytes=10 ** 9)
+    for i, key in enumerate("abc"):
+        cache.put(key, make_mask(i))
+        past = time.time() - 100 + i
+        os.utime(cache._path(key), (past, past))
+    cache.get("a")  # now the most recently used
+
+    sizes = {key: os.path.getsize(cache._path(key)) for key in "abc"}
+    cache.max_bytes = sizes["a"] + sizes["c"]
+    cache._evict()
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
@@ -0,0 +1,69 @@
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("monai")
+import config
+import client as client_module
+from client import FederatedClient
+
+
+class FakeResponse:
+    def __init__(self, status_code, payload=None):
+        self.status_code = status_code
+        self.payload = payload
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise client_module.requests.HTTPError(f"{self.status_code} error")
+
+    def json(self):
+        return self.payload
+
+
+def make_client():
+    # wait_for_round only needs the round bookkeeping, not a model
+    fc = object.__new__(FederatedClient)
+    fc.client_id = "test"
+    fc.cur_round = 3
+    fc.round_deadline = None
+    fc.long_poll_rounds = True
+    return fc
+
+
+def test_long_poll(monkeypatch):
+    calls = []
+
+    def fake_get(url, params=None, timeout=None):
+        calls.append(url)
+        return FakeResponse(200, {"current_round": 4, "changed": True, "deadline": 123.0})
+
+    monkeypatch.setattr(client_module.requests, "get", fake_get)
+    fc = make_client()
+    assert fc.wait_for_round("http://server") == 4
+    assert calls == ["http://server/api/wait-round"]
+    assert fc.round_deadline == 123.0
+
+
+@pytest.mark.parametrize("status", [404, 405])
+def test_falls_back_to_polling_without_wait_round(monkeypatch, status):
+    calls = []
+    rounds = iter([3, 3, 5])
+
+    def fake_get(url, params=None, timeout=None):
+        calls.append(url.rsplit("/", 1)[-1])
+        if url.endswith("/api/wait-round"):
+            return FakeResponse(status)
+        return FakeResponse(200, {"current_round": next(rounds)})
+
+    monkeypatch.setattr(client_module.requests, "get", fake_get)
+    monkeypatch.setattr(config, "ROUND_POLL_INTERVAL", 0)
+    fc = make_client()
+    assert fc.wait_for_round("http://server") == 5
+    assert calls == ["wait-round", "get-current-round", "get-current-round", "get-current-round"]
+    assert not fc.long_poll_rounds
+
+    # Later waits go straight to polling
+    calls.clear()
+    rounds = iter([6])
+    assert fc.wait_for_round("http://server", after_round=5) == 6
+    assert calls == ["get-current-round"]
@@ -0,0 +1,37 @@
+import socket
+import time
+from types import SimpleNamespace
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("monai")
+pytest.importorskip("tqdm")
+import config
+from client import FederatedClient
+
+
+@pytest.fixture
+def stalled_backend(monkeypatch):
+    """A backend that accepts the connection but never answers."""
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    sock.listen(1)
+    monkeypatch.setattr(config, "CLIENT_BACKEND_URL", f"http://127.0.0.1:{sock.getsockname()[1]}")
+    yield
+    sock.close()
+
+
+def test_stalled_upload_times_out(tmp_path, monkeypatch, stalled_backend):
+    monkeypatch.setattr(config, "UPLOAD_TIMEOUT", (1, 0.5))
+    monkeypatch.setattr(config, "UPDATE_ENCODING", None)
+    path = tmp_path / "upload.pth"
+    path.write_bytes(b"weights")
+
+    fc = object.__new__(FederatedClient)
+    fc.client_id, fc.cur_round, fc.model_preset = "test", 1, "tiny"
+    fc.peft_mode, fc.upload_scheduler = False, None
+    fc.train_loader = SimpleNamespace(dataset=[0] * 4)
+
+    start = time.perf_counter()
+    assert fc.send_update("http://server", str(path), base_state=None, samples_trained=4) is None
+    assert time.perf_counter() - start < 10
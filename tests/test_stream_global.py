@@ -0,0 +1,104 @@
+import os
+import threading
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("flask")
+pytest.importorskip("monai")
+pytest.importorskip("tqdm")
+from werkzeug.serving import make_server
+import config
+import client as client_module
+import federated_server
+from utils.flat_tensors import save_checkpoint
+
+
+@pytest.fixture
+def server_url(tmp_path, monkeypatch):
+    monkeypatch.setattr(federated_server, "DATA_DIR", str(tmp_path / "server"))
+    os.makedirs(federated_server.global_dir())
+    server = make_server("127.0.0.1", 0, federated_server.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+def make_model(seed):
+    torch.manual_seed(seed)
+    return torch.nn.Sequential(torch.nn.Linear(64, 256), torch.nn.Linear(256, 64))
+
+
+def publish(model):
+    save_checkpoint({k: v.clone() for k, v in model.state_dict().items()}, federated_server.global_model_path(), "pth")
+
+
+@pytest.fixture
+def fc(tmp_path, monkeypatch):
+    """A FederatedClient reduced to what stream_global_model needs, around a small CPU model."""
+    monkeypatch.setattr(config, "INTEGRITY_CHUNK_MB", 16 / 1024)
+    fc = object.__new__(client_module.FederatedClient)
+    fc.client_id = "test"
+    fc.model = make_model(0)
+    fc.peft_mode = False
+    fc.device = "cpu"
+    fc.cur_round = 1
+    fc.loaded_global_digest = None
+    fc.round_base_state = None
+    fc.global_store = None
+    fc.optimizer = torch.optim.Adam(fc.model.parameters())
+    fc.global_model_dir = str(tmp_path / "client")
+    fc.global_model_path = os.path.join(fc.global_model_dir, "global_latest.pth")
+    return fc
+
+
+def corrupt_stream_after(monkeypatch, n_bytes):
+    """Flip one byte of every global model download once `n_bytes` have been read."""
+    real_get = client_module.requests.get
+
+    def get(url, **kwargs):
+        response = real_get(url, **kwargs)
+        if url.endswith("/api/get-global-model"):
+            raw, seen = response.raw, [0]
+            real_readinto = raw.readinto
+
+            def readinto(buffer):
+                n = real_readinto(buffer)
+                if seen[0] <= n_bytes < seen[0] + n:
+                    memoryview(buffer).cast("B")[n_bytes - seen[0]] ^= 0xFF
+                seen[0] += n
+                return n
+
+            raw.readinto = readinto
+        return response
+
+    monkeypatch.setattr(client_module.requests, "get", get)
+
+
+def assert_model_equals(model, reference):
+    for key, value in reference.state_dict().items():
+        assert torch.equal(model.state_dict()[key], value), key
+
+
+def test_stream_loads_in_place(fc, server_url):
+    publish(make_model(1))
+    params = [p.data_ptr() for p in fc.model.parameters()]
+
+    fc.stream_global_model(server_url)
+
+    assert_model_equals(fc.model, make_model(1))
+    assert [p.data_ptr() for p in fc.model.parameters()] == params
+
+
+def test_failed_stream_restores_the_loaded_global(fc, server_url, monkeypatch):
+    publish(make_model(1))
+    fc.stream_global_model(server_url)
+    loaded = fc.loaded_global_digest
+
+    publish(make_model(2))
+    corrupt_stream_after(monkeypatch, 40_000)  # past the first tensors, so some were overwritten
+    with pytest.raises(IOError):
+        fc.stream_global_model(server_url)
+
+    assert_model_equals(fc.model, make_model(1))
+    assert fc.loaded_global_digest == loaded
+    assert not os.path.exists(fc.global_model_path + ".tmp")
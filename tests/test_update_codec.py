@@ -0,0 +1,154 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+from utils.update_codec import (
+    accumulate_delta, decode_delta, decode_update, encode_update, is_encoded_update,
+)
+from utils.fed_utils import StreamingFedAvg, fed_avg, fed_avg_deltas
+
+
+def perturb(base, seed, scale=0.01):
+    g = torch.Generator().manual_seed(seed)
+    return {k: (v.float() + scale * torch.randn(v.shape, generator=g)).to(v.dtype) if v.is_floating_point() else v + 1
+            for k, v in base.items()}
+
+
+def make_states(seed=0):
+    g = torch.Generator().manual_seed(seed)
+    base = {
+        "conv.weight": torch.randn(16, 8, 3, generator=g),
+        "conv.bias": torch.randn(16, generator=g),
+        "norm.weight": torch.randn(16, generator=g).half(),
+        "steps": torch.tensor(7),
+    }
+    return base, perturb(base, seed + 100)
+
+
+@pytest.mark.parametrize("quantization, atol", [("fp32", 1e-6), ("fp16", 1e-4), ("int8", 5e-4)])
+def test_delta_round_trip(quantization, atol):
+    base, trained = make_states()
+    blob = encode_update(trained, base, quantization=quantization)
+
+    assert is_encoded_update(blob)
+    decoded = decode_update(blob, base)
+    assert decoded.keys() == trained.keys()
+    for key, value in trained.items():
+        assert decoded[key].dtype == value.dtype, key
+        if value.is_floating_point():
+            half_ulp = 2e-3 if value.dtype == torch.float16 else 0.0  # decoded fp16 tensors are re-rounded
+            torch.testing.assert_close(decoded[key].float(), value.float(), rtol=0, atol=atol + half_ulp)
+        else:
+            assert torch.equal(decoded[key], value)
+
+
+def test_full_weights_round_trip():
+    _, trained = make_states()
+    blob = encode_update(trained, None, quantization="fp32")
+    decoded = decode_update(blob)
+    for key, value in trained.items():
+        assert torch.equal(decoded[key].to(value.dtype), value), key
+    with pytest.raises(ValueError):
+        decode_delta(blob)
+
+
+def test_zero_delta_int8():
+    base, _ = make_states()
+    deltas, raw = decode_delta(encode_update(base, base, quantization="int8"))
+    assert all(not d.any() for d in deltas.values())
+    assert torch.equal(raw["steps"], base["steps"])
+
+
+def test_rejects_bad_input():
+    base, trained = make_states()
+    with pytest.raises(ValueError):
+        encode_update(trained, base, quantization="int4")
+    with pytest.raises(ValueError):
+        encode_update(trained, None, topk_ratio=0.1)
+    with pytest.raises(ValueError):
+        decode_update(b"not an update")
+    with pytest.raises(ValueError):
+        decode_update(encode_update(trained, base), None)
+
+
+def test_topk_keeps_largest_entries_and_feeds_back_the_rest():
+    base, trained = make_states()
+    residual = {}
+    blob = encode_update(trained, base, quantization="fp32", topk_ratio=0.25, residual=residual)
+    deltas, _ = decode_delta(blob)
+
+    for key in ("conv.weight", "conv.bias"):
+        full = trained[key].float() - base[key].float()
+        k = int(full.numel() * 0.25)
+        sent = deltas[key].flatten()
+        assert int((sent != 0).sum()) == k
+        expected = full.flatten().abs().topk(k).indices
+        assert torch.equal(sent[expected], full.flatten()[expected])
+        # Everything not sent is carried to the next round
+        torch.testing.assert_close(deltas[key] + residual[key], full)
+
+
+def test_accumulate_delta_matches_dense_decode():
+    base, trained = make_states()
+    for ratio in (None, 0.1):
+        blob = encode_update(trained, base, quantization="fp16", topk_ratio=ratio)
+        deltas, raw = decode_delta(blob)
+        acc = {k: torch.ones(v.shape) for k, v in base.items() if v.is_floating_point()}
+        returned_raw = accumulate_delta(blob, acc, alpha=0.5)
+        for key, delta in deltas.items():
+            torch.testing.assert_close(acc[key], 1 + 0.5 * delta)
+        assert returned_raw.keys() == raw.keys()
+
+
+def test_accumulate_delta_adds_missing_tensors():
+    base, trained = make_states()
+    trained["lora.A"] = torch.randn(4, 16)
+    blob = encode_update(trained, {**base, "lora.A": torch.zeros(4, 16)}, quantization="fp32", topk_ratio=0.5)
+    acc = {}
+    accumulate_delta(blob, acc)
+    assert acc["lora.A"].shape == (4, 16)
+    assert int((acc["lora.A"] != 0).sum()) == 32
+
+
+def test_fed_avg_deltas_matches_reference(tmp_path):
+    base, _ = make_states()
+    paths, sizes, trained_states = [], [30, 10, 60], []
+    for i, size in enumerate(sizes):
+        trained = perturb(base, seed=i)
+        path = tmp_path / f"client_{i}.upd"
+        path.write_bytes(encode_update(trained, base, quantization="fp32"))
+        paths.append(str(path))
+        trained_states.append(trained)
+
+    result = fed_avg_deltas(paths, sizes, base)
+    for key, value in base.items():
+        if not value.is_floating_point():
+            continue
+        expected = sum(s * t[key].float() for s, t in zip(sizes, trained_states)) / sum(sizes)
+        atol = 2e-3 if value.dtype == torch.float16 else 1e-5
+        torch.testing.assert_close(result[key].float(), expected, rtol=0, atol=atol)
+
+
+def test_streaming_fed_avg_matches_reference():
+    base, _ = make_states()
+    states = [perturb(base, seed) for seed in range(3)]
+    sizes = [1, 2, 5]
+    result = fed_avg(states, sizes)
+    for key in ("conv.weight", "conv.bias"):
+        expected = sum(s * st[key].double() for s, st in zip(sizes, states)) / sum(sizes)
+        torch.testing.assert_close(result[key], expected.float())
+    assert result["norm.weight"].dtype == torch.float16
+    assert torch.equal(result["steps"], states[0]["steps"])
+
+
+def test_streaming_fed_avg_extends_layout_for_new_tensors():
+    first = {"w": torch.full((3,), 1.0)}
+    second = {"w": torch.full((3,), 3.0), "lora.A": torch.full((2, 2), 4.0)}
+    aggregator = StreamingFedAvg(first)
+    aggregator.add(first, 1.0)
+    aggregator.add(second, 1.0)
+    aggregator.add({"w": torch.full((3,), 5.0), "lora.A": torch.full((2, 2), 8.0)}, 2.0)
+
+    result = aggregator.result()
+    torch.testing.assert_close(result["w"], torch.full((3,), (1 + 3 + 10) / 4))
+    # Averaged over the updates that carry it
+    torch.testing.assert_close(result["lora.A"], torch.full((2, 2), (4 + 16) / 3))
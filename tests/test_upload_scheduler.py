@@ -0,0 +1,160 @@
+import os
+import shutil
+import threading
+from datetime import datetime
+import pytest
+
+torch = pytest.importorskip("torch")
+requests = pytest.importorskip("requests")
+pytest.importorskip("flask")
+from werkzeug.serving import make_server
+import federated_server
+from utils.flat_tensors import load_checkpoint
+from utils.upload_scheduler import REJECTED_DIR, UploadRejected, UploadScheduler, current_rate_limit
+
+
+@pytest.fixture
+def server_url(tmp_path, monkeypatch):
+    """The reference server on a free local port, storing uploads under tmp_path."""
+    monkeypatch.setattr(federated_server, "DATA_DIR", str(tmp_path / "server"))
+    monkeypatch.setattr(federated_server, "aggregator", None)
+    monkeypatch.setattr(federated_server, "CHUNK_FAULT_RATE", 0.0)
+    server = make_server("127.0.0.1", 0, federated_server.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    monkeypatch.setattr("utils.upload_scheduler.time.sleep", lambda seconds: None)
+
+
+def make_state():
+    g = torch.Generator().manual_seed(0)
+    return {f"layer{i}.weight": torch.randn(64, 64, generator=g) * (i + 1) for i in range(6)}
+
+
+META = {"client_id": "site1", "cur_round": 1, "dataset_size": 10}
+
+
+def make_scheduler(tmp_path):
+    # 16 KB tensors, ~20 KB chunks: one tensor per chunk
+    return UploadScheduler(queue_dir=str(tmp_path / "queue"), chunk_mb=0.02, retries=1)
+
+
+class FailingSession(requests.Session):
+    """Drops the connection on the `fail_at`-th chunk PUT, as if the client crashed mid-upload."""
+
+    def __init__(self, fail_at):
+        super().__init__()
+        self.fail_at = fail_at
+        self.puts = []
+
+    def request(self, method, url, *args, **kwargs):
+        if method == "PUT":
+            if len(self.puts) + 1 == self.fail_at:
+                raise requests.ConnectionError("connection dropped")
+            self.puts.append(int(url.split("/chunk/")[1].split("?")[0]))
+        return super().request(method, url, *args, **kwargs)
+
+
+def received_update(server_dir, n_chunks):
+    update_dir = os.path.join(server_dir, "client_updates", "round_1", "client_site1")
+    state = {}
+    for i in range(n_chunks):
+        state.update(load_checkpoint(os.path.join(update_dir, f"chunk_{i:04d}.upd")))
+    return state
+
+
+def test_chunks_are_ordered_by_magnitude(tmp_path):
+    scheduler = make_scheduler(tmp_path)
+    scheduler.enqueue("http://unused", META, make_state())
+
+    chunks = scheduler.pending()[0]["chunks"]
+    assert [c["tensors"] for c in chunks] == [[f"layer{i}.weight"] for i in reversed(range(6))]
+
+
+def test_interrupted_upload_resumes_after_restart(tmp_path, server_url, no_backoff):
+    scheduler = make_scheduler(tmp_path)
+    scheduler.session = FailingSession(fail_at=3)
+    state = make_state()
+    job_id = scheduler.enqueue(server_url, META, state)
+    n_chunks = len(scheduler.pending()[0]["chunks"])
+
+    with pytest.raises(IOError):
+        scheduler.upload(job_id)
+    assert scheduler.session.puts == [0, 1]
+    assert [job["job_id"] for job in scheduler.pending()] == [job_id]
+
+    # A new scheduler over the same queue, as after a restart, sends only the missing chunks
+    restarted = make_scheduler(tmp_path)
+    restarted.session = FailingSession(fail_at=None)
+    results = restarted.upload_all()
+
+    assert restarted.session.puts == list(range(2, n_chunks))
+    assert len(results) == 1 and results[0]["complete"]
+    assert restarted.pending() == []
+    received = received_update(federated_server.DATA_DIR, n_chunks)
+    assert received.keys() == state.keys()
+    for key in state:
+        assert torch.equal(received[key], state[key]), key
+
+
+def test_rejected_job_is_parked_and_does_not_block_the_next(tmp_path, server_url, no_backoff):
+    scheduler = make_scheduler(tmp_path)
+    rejected = scheduler.enqueue(server_url, {**META, "model_preset": "no-such-preset"}, make_state())
+    scheduler.enqueue(server_url, META, make_state())
+
+    results = scheduler.upload_all()
+
+    assert len(results) == 1 and results[0]["complete"]
+    assert scheduler.pending() == []
+    assert os.path.exists(os.path.join(scheduler.queue_dir, REJECTED_DIR, rejected, "job.json"))
+    with pytest.raises(UploadRejected):
+        scheduler.upload(scheduler.enqueue(server_url, {**META, "cur_round": "latest"}, make_state()))
+
+
+def test_unreachable_server_keeps_the_job(tmp_path, no_backoff):
+    scheduler = make_scheduler(tmp_path)
+    job_id = scheduler.enqueue("http://127.0.0.1:9", META, make_state())
+    assert scheduler.upload_all() == []
+    assert [job["job_id"] for job in scheduler.pending()] == [job_id]
+
+
+def test_completed_session_is_not_sent_again(tmp_path, server_url):
+    scheduler = make_scheduler(tmp_path)
+    job_id = scheduler.enqueue(server_url, META, make_state())
+    job_dir = os.path.join(scheduler.queue_dir, job_id)
+    shutil.copytree(job_dir, job_dir + ".bak")
+    assert scheduler.upload(job_id)["complete"]
+    # As if the client stopped after the last chunk but before dequeuing the job
+    os.replace(job_dir + ".bak", job_dir)
+
+    restarted = make_scheduler(tmp_path)
+    restarted.session = FailingSession(fail_at=None)
+    results = restarted.upload_all()
+
+    assert restarted.session.puts == []
+    assert len(results) == 1 and results[0]["complete"]
+    assert restarted.pending() == []
+
+
+def test_pending_removes_jobs_without_job_json(tmp_path):
+    scheduler = make_scheduler(tmp_path)
+    job_id = scheduler.enqueue("http://unused", META, make_state())
+    orphan = os.path.join(scheduler.queue_dir, "crashed-during-enqueue")
+    os.makedirs(orphan)
+    with open(os.path.join(orphan, "chunk_0000.upd"), "wb") as f:
+        f.write(b"partial")
+
+    assert [job["job_id"] for job in scheduler.pending()] == [job_id]
+    assert not os.path.exists(orphan)
+
+
+def test_rate_schedule_windows():
+    schedule = [("08:00", "18:00", 2.0), ("22:00", "06:00", 0)]
+    assert current_rate_limit(datetime(2024, 1, 1, 9, 30), schedule, default=None) == 2.0
+    assert current_rate_limit(datetime(2024, 1, 1, 23, 0), schedule, default=None) == 0
+    assert current_rate_limit(datetime(2024, 1, 1, 3, 0), schedule, default=None) == 0
+    assert current_rate_limit(datetime(2024, 1, 1, 19, 0), schedule, default=5.0) == 5.0
@@ -0,0 +1,72 @@
+import time
+import queue
+import threading
+from concurrent.futures import Future
+import torch
+from utils.inference_runtime import sliding_window_inference
+
+
+class CoalescingPredictor:
+    """Holds a warm model and batches concurrent predict requests.
+
+    Requests that arrive within `window_ms` of each other and share a volume
+    shape are stacked into one sliding-window call of up to `max_batch` volumes.
+    """
+
+    def __init__(self, model, device, roi_size=(128, 160, 160), threshold=0.5,
+                 window_ms=20, max_batch=4, sw_batch_size=1):
+        self.model = model.eval()
+        self.device = device
+        self.roi_size = tuple(roi_size)
+        self.logit_threshold = torch.logit(torch.tensor(threshold)).item()
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self.sw_batch_size = sw_batch_size
+
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def submit(self, image):
+        """Queue a [C, D, H, W] image; the future resolves to a bool [1, D, H, W] mask on CPU."""
+        future = Future()
+        self._queue.put((image, future))
+        return future
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        shape = batch[0][0].shape
+        deferred = []
+        deadline = time.monotonic() + self.window
+
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            (batch if item[0].shape == shape else deferred).append(item)
+
+        # Different shapes can't be stacked, they go in the next batch
+        for item in deferred:
+            self._queue.put(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                images = torch.stack([image for image, _ in batch]).to(self.device)
+                with torch.inference_mode():
+                    logits = sliding_window_inference(
+                        images, self.roi_size, self.sw_batch_size * len(batch), self.model
+                    )
+                    masks = (logits >= self.logit_threshold).cpu()
+
+                for i, (_, future) in enumerate(batch):
+                    future.set_result(masks[i])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
@@ -0,0 +1,189 @@
+import os
+import json
+import time
+import torch
+import config
+from utils.flat_tensors import _DTYPES, _NAMES, _as_bytes, save_checkpoint
+from utils.hashing import chunk_digest
+
+
+def _write_atomic(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class CheckpointStore:
+    """Content-addressed, deduplicated store of per-round state dicts.
+
+    Each tensor is split into fixed-size chunks that are stored once under
+    their BLAKE2b hash in objects/, so chunks that do not change between
+    rounds (frozen layers, an unchanged global model) cost no extra disk.
+    A round is a small JSON manifest listing its tensors' chunks, and
+    index.json maps round → manifest, so finding the latest or best round
+    never scans the directory. After every put, rounds outside the
+    retention policy (last `keep_last` plus the `keep_best` highest
+    `best_metric`) are dropped and unreferenced chunks are deleted.
+
+        root/index.json
+        root/manifests/round_N.json
+        root/objects/ab/abcdef...
+    """
+
+    def __init__(self, root, chunk_mb=None, keep_last=None, keep_best=None, best_metric="val_dice"):
+        self.root = root
+        self.chunk_bytes = int((chunk_mb or config.CHECKPOINT_CHUNK_MB) * 1024 * 1024)
+        self.keep_last = config.CHECKPOINT_KEEP_LAST if keep_last is None else keep_last
+        self.keep_best = config.CHECKPOINT_KEEP_BEST if keep_best is None else keep_best
+        self.best_metric = best_metric
+        self.index_path = os.path.join(root, "index.json")
+        os.makedirs(os.path.join(root, "manifests"), exist_ok=True)
+        os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+        self.index = self._read_index()
+
+    # --- Index ---
+    def _read_index(self):
+        if not os.path.exists(self.index_path):
+            return {"latest": None, "rounds": {}}
+        with open(self.index_path) as f:
+            return json.load(f)
+
+    def _write_index(self):
+        _write_atomic(self.index_path, json.dumps(self.index, indent=1).encode())
+
+    def rounds(self):
+        return sorted(int(r) for r in self.index["rounds"])
+
+    def latest_round(self):
+        return self.index["latest"]
+
+    def best_round(self):
+        scored = [(entry["metrics"][self.best_metric], int(r))
+                  for r, entry in self.index["rounds"].items()
+                  if self.best_metric in entry.get("metrics", {})]
+        return max(scored)[1] if scored else None
+
+    def metrics(self, round_num):
+        return self.index["rounds"][str(round_num)].get("metrics", {})
+
+    # --- Objects ---
+    def _object_path(self, digest):
+        return os.path.join(self.root, "objects", digest[:2], digest)
+
+    def _put_chunk(self, data):
+        digest = chunk_digest(data)
+        path = self._object_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            _write_atomic(path, data)
+            return digest, len(data)
+        return digest, 0
+
+    def _manifest_path(self, round_num):
+        return os.path.join(self.root, "manifests", f"round_{round_num}.json")
+
+    def _read_manifest(self, round_num):
+        with open(self._manifest_path(round_num)) as f:
+            return json.load(f)
+
+    # --- Rounds ---
+    def put(self, round_num, state_dict, metrics=None):
+        """Store a round's state dict; returns the number of new bytes written."""
+        tensors, written = [], 0
+        for name, tensor in state_dict.items():
+            tensor = tensor.detach().cpu().contiguous()
+            raw = memoryview(_as_bytes(tensor).numpy()) if tensor.numel() else memoryview(b"")
+            chunks = []
+            for start in range(0, len(raw), self.chunk_bytes):
+                digest, n = self._put_chunk(raw[start:start + self.chunk_bytes])
+                chunks.append(digest)
+                written += n
+            tensors.append({"name": name, "dtype": _NAMES[tensor.dtype], "shape": list(tensor.shape), "chunks": chunks})
+
+        _write_atomic(self._manifest_path(round_num), json.dumps({"round": round_num, "tensors": tensors}).encode())
+        self.index["rounds"][str(round_num)] = {"time": time.time(), "metrics": metrics or {}}
+        self.index["latest"] = max(self.rounds())
+        self._write_index()
+        self.apply_retention()
+        return written
+
+    def get(self, round_num=None, map_location="cpu"):
+        """Reassemble a round's state dict (the latest round by default)."""
+        round_num = self.latest_round() if round_num is None else round_num
+        if round_num is None:
+            raise FileNotFoundError(f"No rounds stored in {self.root}")
+
+        state = {}
+        for entry in self._read_manifest(round_num)["tensors"]:
+            tensor = torch.empty(entry["shape"], dtype=_DTYPES[entry["dtype"]])
+            buffer = _as_bytes(tensor).numpy() if tensor.numel() else None
+            offset = 0
+            for digest in entry["chunks"]:
+                with open(self._object_path(digest), "rb") as f:
+                    offset += f.readinto(memoryview(buffer)[offset:])
+            state[entry["name"]] = tensor.to(map_location)
+        return state
+
+    def _stamp(self, round_num):
+        """Identifies one stored version of a round: its number and the hash of its manifest."""
+        with open(self._manifest_path(round_num), "rb") as f:
+            return f"{round_num}:{chunk_digest(f.read())}"
+
+    def checkout(self, round_num=None, path=None, state=None):
+        """Materialize a round as a checkpoint file (config.CHECKPOINT_FORMAT) and return its path.
+
+        Pass the round's `state` when it is already in memory to skip reading
+        it back; it is always written. Without it, an existing file is reused
+        only if it holds the round as currently stored (a round that was put
+        again is checked out again).
+        """
+        round_num = self.latest_round() if round_num is None else round_num
+        path = path or os.path.join(self.root, "checkout.pth")
+        stamp_path = path + ".round"
+        stamp = self._stamp(round_num) if str(round_num) in self.index["rounds"] else None
+
+        if state is None and stamp is not None and os.path.exists(path) and os.path.exists(stamp_path):
+            with open(stamp_path) as f:
+                if f.read().strip() == stamp:
+                    return path
+
+        # No stamp while the file is being replaced, so a crash in between never looks current
+        if os.path.exists(stamp_path):
+            os.remove(stamp_path)
+        save_checkpoint(self.get(round_num) if state is None else state, path)
+        if stamp is not None:
+            _write_atomic(stamp_path, stamp.encode())
+        return path
+
+    # --- Retention ---
+    def apply_retention(self):
+        """Drop rounds outside keep-last-K + keep-best-B, then delete unreferenced chunks."""
+        rounds = self.rounds()
+        keep = set(rounds[-self.keep_last:]) if self.keep_last else set()
+        scored = sorted(((self.metrics(r)[self.best_metric], r) for r in rounds
+                         if self.best_metric in self.metrics(r)), reverse=True)
+        keep.update(r for _, r in scored[:self.keep_best])
+
+        dropped = [r for r in rounds if r not in keep]
+        if not dropped:
+            return []
+        for r in dropped:
+            del self.index["rounds"][str(r)]
+            os.remove(self._manifest_path(r))
+        self.index["latest"] = max(keep) if keep else None
+        self._write_index()
+
+        live = {d for r in keep for entry in self._read_manifest(r)["tensors"] for d in entry["chunks"]}
+        objects_dir = os.path.join(self.root, "objects")
+        for prefix in os.listdir(objects_dir):
+            for digest in os.listdir(os.path.join(objects_dir, prefix)):
+                if digest not in live:
+                    os.remove(os.path.join(objects_dir, prefix, digest))
+        return dropped
+
+    def disk_usage(self):
+        total = 0
+        for dirpath, _, files in os.walk(self.root):
+            total += sum(os.path.getsize(os.path.join(dirpath, f)) for f in files)
+        return total
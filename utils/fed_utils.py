@@ -1,44 +1,516 @@
+import io
 import os
-import copy
+import re
+import csv
+import json
+import zlib
+import struct
+import tempfile
+import numpy as np
 import torch
-import pandas as pd
-from glob import glob
+import config
+from utils.update_codec import MAGIC, is_encoded_update, decode_update, accumulate_delta
+from utils.flat_tensors import load_checkpoint, save_checkpoint
+
+# --- Update access (state dicts, memory-mapped checkpoints or encoded deltas) ---
+def _open_update(update, global_state=None):
+    if isinstance(update, dict):
+        return update
+    with open(update, "rb") as f:
+        if is_encoded_update(f.read(len(MAGIC))):
+            return load_client_update(update, global_state)
+    return load_checkpoint(update, mmap=True)
+
+
+def _float_layout(template_state):
+    """(key, shape, numel, offset, dtype) for every floating-point tensor, plus the total size."""
+    layout, offset = [], 0
+    for key, value in template_state.items():
+        if value.is_floating_point():
+            layout.append((key, tuple(value.shape), value.numel(), offset, value.dtype))
+            offset += value.numel()
+    return layout, offset
+
+
+# --- Streaming FedAvg (one client in memory at a time) ---
+class StreamingFedAvg:
+    """Weighted average built by folding in one client update at a time.
+
+    Floating-point tensors live in a single flat, preallocated accumulator
+    (fp64 by default) updated with in-place weighted adds, so aggregating N
+    clients needs one accumulator plus one client update in memory. Updates
+    can be state dicts or checkpoint paths; flat and .pth files are memory-mapped.
+
+    The layout comes from `template_state`; a tensor first seen in a later
+    update extends it. Each tensor is averaged over the updates that
+    contain it.
+    """
+
+    def __init__(self, template_state, accum_dtype=torch.float64, global_state=None):
+        self.layout, offset = _float_layout(template_state)
+        self.acc = torch.zeros(offset, dtype=accum_dtype)
+        self.weights = [0.0] * len(self.layout)  # per tensor: total weight of the updates holding it
+        self.non_float = {}
+        self.total_weight = 0.0
+        self.global_state = global_state  # needed to decode delta-encoded uploads
+
+    def _extend(self, key, value):
+        self.layout.append((key, tuple(value.shape), value.numel(), self.acc.numel(), value.dtype))
+        self.acc = torch.cat([self.acc, self.acc.new_zeros(value.numel())])
+        self.weights.append(0.0)
+
+    def add(self, update, weight):
+        state = _open_update(update, self.global_state)
+        known = {entry[0] for entry in self.layout}
+        for key, value in state.items():
+            if value.is_floating_point() and key not in known:
+                self._extend(key, value)
+        for i, (key, shape, numel, offset, _) in enumerate(self.layout):
+            if key in state:
+                self.acc[offset:offset + numel].add_(state[key].reshape(-1), alpha=weight)
+                self.weights[i] += weight
+        for key, value in state.items():
+            if key not in self.non_float and not value.is_floating_point():
+                self.non_float[key] = value.clone()
+        self.total_weight += weight
+
+    def result(self):
+        avg_state = dict(self.non_float)
+        for (key, shape, numel, offset, dtype), weight in zip(self.layout, self.weights):
+            if weight:
+                avg_state[key] = (self.acc[offset:offset + numel] / weight).view(shape).to(dtype)
+        return avg_state
+
 
 # --- FedAvg (weighted by dataset size) ---
 def fed_avg(state_dicts, data_sizes):
+    """Weighted FedAvg over state dicts or checkpoint paths, streamed one client at a time."""
+    aggregator = StreamingFedAvg(_open_update(state_dicts[0]))
+    for state, size in zip(state_dicts, data_sizes):
+        aggregator.add(state, size)
 
-    total_size = sum(data_sizes)
-    avg_state = copy.deepcopy(state_dicts[0])
+    return aggregator.result()
+
+
+# --- Robust aggregation (median, trimmed mean, Krum) over a memory-mapped update matrix ---
+class FlatUpdateStack:
+    """Client updates flattened into the rows of one on-disk [n_clients, n_params] fp32 matrix.
 
-    for key in avg_state.keys():
-        # Weighted sum
-        avg_state[key] = sum(
-            state_dicts[i][key] * (data_sizes[i] / total_size)
-            for i in range(len(state_dicts))
+    Rows are written one client at a time, and the aggregators below read it
+    back in column chunks of at most `chunk_mb`, so the working set stays
+    bounded no matter how many clients or parameters there are.
+    """
+
+    def __init__(self, updates, global_state=None, work_dir=None, chunk_mb=None):
+        first = _open_update(updates[0], global_state)
+        self.layout, self.n_params = _float_layout(first)
+        self.non_float = {k: v.clone() for k, v in first.items() if not v.is_floating_point()}
+        self.n_clients = len(updates)
+        chunk_bytes = int((chunk_mb or config.AGGREGATION_CHUNK_MB) * 1024 * 1024)
+        self.chunk = max(1, chunk_bytes // (4 * self.n_clients))
+
+        fd, self.path = tempfile.mkstemp(suffix=".npy", dir=work_dir)
+        os.close(fd)
+        self.matrix = np.lib.format.open_memmap(
+            self.path, mode="w+", dtype=np.float32, shape=(self.n_clients, self.n_params)
         )
+        for i, update in enumerate(updates):
+            state = first if i == 0 else _open_update(update, global_state)
+            row = torch.from_numpy(self.matrix[i])
+            for key, shape, numel, offset, _ in self.layout:
+                row[offset:offset + numel].copy_(state[key].reshape(-1))
+        self.matrix.flush()
+
+    def chunks(self):
+        """Yield (start, stop, block) with block a contiguous [n_clients, stop - start] array."""
+        for start in range(0, self.n_params, self.chunk):
+            stop = min(start + self.chunk, self.n_params)
+            yield start, stop, np.ascontiguousarray(self.matrix[:, start:stop])
+
+    def reduce(self, fn):
+        """Apply fn(block) -> [stop - start] per column chunk and unflatten into a state dict."""
+        out = np.empty(self.n_params, dtype=np.float32)
+        for start, stop, block in self.chunks():
+            out[start:stop] = fn(block)
+        return self.to_state(out)
+
+    def to_state(self, flat):
+        flat = torch.from_numpy(flat)
+        state = dict(self.non_float)
+        for key, shape, numel, offset, dtype in self.layout:
+            state[key] = flat[offset:offset + numel].view(shape).to(dtype)
+        return state
+
+    def close(self):
+        del self.matrix
+        os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def median_aggregate(updates, global_state=None, chunk_mb=None):
+    """Coordinate-wise median of the client updates."""
+    with FlatUpdateStack(updates, global_state, chunk_mb=chunk_mb) as stack:
+        return stack.reduce(lambda block: np.median(block, axis=0))
+
+
+def trimmed_mean_aggregate(updates, trim_ratio=0.1, global_state=None, chunk_mb=None):
+    """Coordinate-wise mean after dropping the `trim_ratio` largest and smallest values."""
+    n = len(updates)
+    k = int(n * trim_ratio)
+    if 2 * k >= n:
+        raise ValueError(f"trim_ratio={trim_ratio} removes all {n} clients")
+
+    def trimmed(block):
+        if k == 0:
+            return block.mean(axis=0)
+        # Partial sort: only the k smallest / largest need to be placed
+        block = np.partition(block, (k, n - k - 1), axis=0)
+        return block[k:n - k].mean(axis=0)
+
+    with FlatUpdateStack(updates, global_state, chunk_mb=chunk_mb) as stack:
+        return stack.reduce(trimmed)
+
+
+def pairwise_sq_distances(stack):
+    """[n_clients, n_clients] squared L2 distances, accumulated chunk by chunk in fp64."""
+    dist = np.zeros((stack.n_clients, stack.n_clients), dtype=np.float64)
+    for _, _, block in stack.chunks():
+        block = block.astype(np.float64)
+        sq = np.einsum("ij,ij->i", block, block)
+        dist += sq[:, None] + sq[None, :] - 2.0 * (block @ block.T)
+    np.maximum(dist, 0.0, out=dist)
+    np.fill_diagonal(dist, 0.0)
+    return dist
+
+
+def krum_scores(dist, n_byzantine):
+    """Krum score per client: sum of distances to its n - f - 2 nearest neighbours."""
+    n = dist.shape[0]
+    n_neighbours = n - n_byzantine - 2
+    if n_neighbours < 1:
+        raise ValueError(f"Krum needs more than f + 2 clients (n={n}, f={n_byzantine})")
+    nearest = np.sort(dist, axis=1)[:, 1:n_neighbours + 1]  # column 0 is the distance to itself
+    return nearest.sum(axis=1)
+
+
+def krum_aggregate(updates, n_byzantine=1, multi_krum=1, global_state=None, chunk_mb=None):
+    """(Multi-)Krum: average of the `multi_krum` clients with the lowest Krum scores.
+
+    Returns the aggregated state dict and the indices of the selected clients.
+    """
+    with FlatUpdateStack(updates, global_state, chunk_mb=chunk_mb) as stack:
+        scores = krum_scores(pairwise_sq_distances(stack), n_byzantine)
+        selected = np.argsort(scores)[:multi_krum]
+        return stack.reduce(lambda block: block[selected].mean(axis=0)), selected.tolist()
+
+
+# --- Client update loading (raw .pth or encoded delta) ---
+def load_client_update(path, global_state):
+    """Load an uploaded client update as a full state dict.
+
+    Encoded updates are deltas against the global weights of the round they
+    were trained in, so `global_state` must be that round's global model.
+    """
+    with open(path, "rb") as f:
+        if is_encoded_update(f.read(len(MAGIC))):
+            f.seek(0)
+            return decode_update(f.read(), global_state)
+
+    return load_checkpoint(path)
 
+
+# --- FedAvg over encoded deltas (dense, quantized or top-k sparse) ---
+def fed_avg_deltas(update_paths, data_sizes, global_state):
+    """Weighted average applied as global + sum(w_i * delta_i).
+
+    Deltas are added one client at a time into a single fp32 accumulator;
+    top-k entries are scattered in place, so sparse updates are never
+    expanded into dense per-client tensors. Tensors the global model lacks
+    are averaged from zero.
+    """
+    total_size = sum(data_sizes)
+    acc = {k: torch.zeros_like(v, dtype=torch.float32, device="cpu")
+           for k, v in global_state.items() if v.is_floating_point()}
+    raw_state = {}
+
+    for path, size in zip(update_paths, data_sizes):
+        with open(path, "rb") as f:
+            raw_state.update(accumulate_delta(f.read(), acc, alpha=size / total_size))
+
+    avg_state = {}
+    for key, value in global_state.items():
+        if key in acc:
+            avg_state[key] = (value.detach().cpu().float() + acc[key]).to(value.dtype)
+        else:
+            avg_state[key] = raw_state.get(key, value)
+    for key in acc.keys() - global_state.keys():
+        avg_state[key] = acc[key]
+    for key in raw_state.keys() - avg_state.keys():
+        avg_state[key] = raw_state[key]
     return avg_state
 
 
-# --- Resume Global State (checkpoint + logs) ---
+# --- Resume Global State (round index + lazily read metrics) ---
+ROUND_INDEX_FILE = "round_index.json"
+_CKPT_PATTERN = re.compile(r"global_round_(\d+)\.pth$")
+_OFFSET = struct.Struct("<Q")
+_IDX_MAGIC = b"GMIDX002"
+_IDX_HEADER = struct.Struct("<8sQqI")  # magic, end of the last indexed row, CSV mtime_ns, its CRC32
+
+
+def _parse_value(value):
+    for cast in (int, float):
+        try:
+            return cast(value)
+        except ValueError:
+            pass
+    return value
+
+
+class GlobalRoundIndex:
+    """Round number → global checkpoint file, persisted in global_dir/round_index.json.
+
+    The directory is scanned once, with numeric round ordering, the first
+    time. After that, new rounds are picked up by probing for
+    global_round_{latest + 1}.pth, so opening the index does not depend on
+    how many rounds exist.
+    """
+
+    def __init__(self, global_dir):
+        self.global_dir = global_dir
+        self.path = os.path.join(global_dir, ROUND_INDEX_FILE)
+        self.checkpoints = {}
+        self.latest = None
+
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                data = json.load(f)
+            self.checkpoints = {int(r): name for r, name in data["checkpoints"].items()}
+            self.latest = data["latest"]
+            self._probe()
+        elif os.path.isdir(global_dir):
+            self._scan()
+
+    def path_for(self, round_num):
+        return os.path.join(self.global_dir, self.checkpoints[round_num])
+
+    def _scan(self):
+        for name in os.listdir(self.global_dir):
+            match = _CKPT_PATTERN.match(name)
+            if match:
+                self.checkpoints[int(match.group(1))] = name
+        self.latest = max(self.checkpoints) if self.checkpoints else None
+        self._save()
+
+    def _probe(self):
+        changed = False
+        # Rounds written by something that did not update the index
+        while os.path.exists(os.path.join(self.global_dir, f"global_round_{(self.latest or 0) + 1}.pth")):
+            self.latest = (self.latest or 0) + 1
+            self.checkpoints[self.latest] = f"global_round_{self.latest}.pth"
+            changed = True
+        # Checkpoints deleted from under the index
+        while self.latest is not None and not os.path.exists(self.path_for(self.latest)):
+            del self.checkpoints[self.latest]
+            self.latest = max(self.checkpoints) if self.checkpoints else None
+            changed = True
+        if changed:
+            self._save()
+
+    def _save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"latest": self.latest, "checkpoints": self.checkpoints}, f)
+        os.replace(tmp_path, self.path)
+
+    def add(self, round_num, name):
+        self.checkpoints[round_num] = name
+        self.latest = max(self.latest or round_num, round_num)
+        self._save()
+
+
+class GlobalMetricsLog:
+    """Row-indexed view of global_metrics.csv that reads rows on demand.
+
+    A sidecar .idx file holds the uint64 byte offset of every data row,
+    after a header recording where the last indexed row ends, its CRC and
+    the CSV's mtime. Rows appended since the last open are scanned from where
+    the index stops; a CSV that was rewritten or truncated is re-indexed
+    from scratch. Single rows are read by seeking to their offset, so the
+    CSV is never parsed as a whole. Supports len(), indexing, iteration and
+    append(), like the list of records it replaces.
+    """
+
+    def __init__(self, csv_path):
+        self.csv_path = csv_path
+        self.idx_path = csv_path + ".idx"
+        self.header = None
+        self._sync()
+
+    # --- Index ---
+    def _read_meta(self):
+        """(end of the last indexed row, CSV mtime_ns, last row CRC), or None for a missing or old-format index."""
+        if not os.path.exists(self.idx_path):
+            return None
+        with open(self.idx_path, "rb") as idx:
+            head = idx.read(_IDX_HEADER.size)
+        if len(head) < _IDX_HEADER.size or not head.startswith(_IDX_MAGIC):
+            return None
+        return _IDX_HEADER.unpack(head)[1:]
+
+    def _write_meta(self, crc, end=None):
+        st = os.stat(self.csv_path)
+        with open(self.idx_path, "r+b") as idx:
+            idx.write(_IDX_HEADER.pack(_IDX_MAGIC, st.st_size if end is None else end, st.st_mtime_ns, crc))
+
+    def _sync(self):
+        if not os.path.exists(self.csv_path):
+            if os.path.exists(self.idx_path):
+                os.remove(self.idx_path)
+            self.header = None
+            return
+
+        st = os.stat(self.csv_path)
+        meta = self._read_meta()
+        with open(self.csv_path, "rb") as f:
+            self.header = next(csv.reader([f.readline().decode()]), None)
+            if meta is not None and meta[:2] == (st.st_size, st.st_mtime_ns):
+                return
+
+            # Resume after the last indexed row if it is still where and what it was;
+            # otherwise (rewritten, truncated or never indexed) rebuild from the first row
+            data_start, resume = f.tell(), False
+            if meta is not None and len(self) and st.st_size >= meta[0]:
+                f.seek(self._offset(len(self) - 1))
+                line = f.readline()
+                resume = f.tell() == meta[0] and zlib.crc32(line) == meta[2]
+            crc, start = (meta[2], meta[0]) if resume else (0, data_start)
+
+            f.seek(start)
+            offsets = []
+            while True:
+                pos = f.tell()
+                line = f.readline()
+                if not line.endswith(b"\n"):
+                    f.seek(pos)  # end of file, or a row still being written
+                    break
+                if line.strip():
+                    offsets.append(pos)
+                    crc = zlib.crc32(line)
+            end = f.tell()
+
+        if not resume:
+            tmp_path = self.idx_path + ".tmp"
+            with open(tmp_path, "wb") as idx:
+                idx.write(_IDX_HEADER.pack(_IDX_MAGIC, 0, 0, 0))
+            os.replace(tmp_path, self.idx_path)
+        with open(self.idx_path, "ab") as idx:
+            idx.write(b"".join(_OFFSET.pack(o) for o in offsets))
+        self._write_meta(crc, end)
+
+    def _offset(self, i):
+        with open(self.idx_path, "rb") as idx:
+            idx.seek(_IDX_HEADER.size + i * _OFFSET.size)
+            return _OFFSET.unpack(idx.read(_OFFSET.size))[0]
+
+    def _parse(self, line):
+        values = next(csv.reader([line.decode()]))
+        return {k: _parse_value(v) for k, v in zip(self.header, values)}
+
+    def __len__(self):
+        if not os.path.exists(self.idx_path):
+            return 0
+        return max(0, os.path.getsize(self.idx_path) - _IDX_HEADER.size) // _OFFSET.size
+
+    def __getitem__(self, i):
+        n = len(self)
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(n))]
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError(i)
+        with open(self.csv_path, "rb") as f:
+            f.seek(self._offset(i))
+            return self._parse(f.readline())
+
+    def __iter__(self):
+        if not len(self):
+            return
+        with open(self.csv_path, "rb") as f:
+            f.seek(self._offset(0))
+            for line in f:
+                if line.strip():
+                    yield self._parse(line)
+
+    # --- Writing (binary, so offsets are exact byte positions) ---
+    @staticmethod
+    def _encode_row(values):
+        buf = io.StringIO()
+        csv.writer(buf).writerow(values)
+        return buf.getvalue().encode()
+
+    def _extend_header(self, keys):
+        """Rewrite the CSV with `keys` added to the header; earlier rows get empty values for them."""
+        with open(self.csv_path, newline="") as f:
+            rows = list(csv.reader(f))[1:]
+        tmp_path = self.csv_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(self._encode_row(self.header + keys))
+            for row in rows:
+                f.write(self._encode_row(row + [""] * (len(self.header) + len(keys) - len(row))))
+        os.replace(tmp_path, self.csv_path)
+        self._sync()
+
+    def append(self, record):
+        """Append one metrics row (writing the header on first use, extending it for new keys)."""
+        self._sync()
+        os.makedirs(os.path.dirname(self.csv_path) or ".", exist_ok=True)
+        if self.header is None:
+            self.header = list(record)
+            with open(self.csv_path, "wb") as f:
+                f.write(self._encode_row(self.header))
+            self._sync()
+        new_keys = [k for k in record if k not in self.header]
+        if new_keys:
+            self._extend_header(new_keys)
+
+        row = self._encode_row([record.get(k, "") for k in self.header])
+        with open(self.csv_path, "ab") as f:
+            offset = f.seek(0, os.SEEK_END)
+            f.write(row)
+        with open(self.idx_path, "ab") as idx:
+            idx.write(_OFFSET.pack(offset))
+        self._write_meta(zlib.crc32(row))
+
+
 def resume_global_state(global_dir, logs_dir):
+    """Return (start_round, global_weights, global_metrics) for the latest recorded round.
 
-    global_metrics_path = os.path.join(logs_dir, "global_metrics.csv")
-    start_round = 1
-    global_weights = None
-    global_metrics_list = []
+    Rounds are ordered numerically through GlobalRoundIndex. The weights are
+    memory-mapped, so tensors are only read when they are used.
+    global_metrics is a GlobalMetricsLog that reads rows lazily.
+    """
+    index = GlobalRoundIndex(global_dir)
+    global_metrics = GlobalMetricsLog(os.path.join(logs_dir, "global_metrics.csv"))
 
-    # Find latest checkpoint
-    ckpts = glob(os.path.join(global_dir, "global_round_*.pth"))
-    ckpts.sort()
+    if index.latest is None:
+        return 1, None, global_metrics
 
-    if len(ckpts) > 0:
-        latest_ckpt = ckpts[-1]
-        start_round = int(latest_ckpt.split("_round_")[-1].split(".pth")[0]) + 1
-        global_weights = torch.load(latest_ckpt, map_location="cpu")
+    global_weights = load_checkpoint(index.path_for(index.latest), mmap=True)
+    return index.latest + 1, global_weights, global_metrics
 
-    # Load existing metrics if CSV exists
-    if os.path.exists(global_metrics_path):
-        global_metrics_list = pd.read_csv(global_metrics_path).to_dict("records")
 
-    return start_round, global_weights, global_metrics_list
+def record_global_round(global_dir, logs_dir, round_num, state_dict, metrics=None):
+    """Save a round's global checkpoint and metrics row, keeping both indexes current."""
+    os.makedirs(global_dir, exist_ok=True)
+    name = f"global_round_{round_num}.pth"
+    save_checkpoint(state_dict, os.path.join(global_dir, name))
+    GlobalRoundIndex(global_dir).add(round_num, name)
+    if metrics is not None:
+        GlobalMetricsLog(os.path.join(logs_dir, "global_metrics.csv")).append({"round": round_num, **metrics})
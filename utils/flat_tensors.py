@@ -0,0 +1,292 @@
+import os
+import json
+import mmap
+import struct
+import hashlib
+import argparse
+from glob import glob
+from collections.abc import Mapping
+import torch
+import config
+from utils.hashing import HashingWriter, write_manifest, read_manifest, manifest_path, verify_file
+
+# Layout: MAGIC | uint64 header length | JSON header | tensor buffers in header order.
+# The header is space-padded and buffers start on ALIGN-byte boundaries so a
+# memory-mapped file can be viewed as tensors without copying.
+MAGIC = b"FLTNSR01"
+_LEN = struct.Struct("<Q")
+ALIGN = 64
+
+_DTYPES = {
+    "float32": torch.float32, "float16": torch.float16, "bfloat16": torch.bfloat16,
+    "float64": torch.float64, "int64": torch.int64, "int32": torch.int32,
+    "int16": torch.int16, "int8": torch.int8, "uint8": torch.uint8, "bool": torch.bool,
+}
+_NAMES = {v: k for k, v in _DTYPES.items()}
+
+
+def is_flat_file(path):
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def _as_bytes(tensor):
+    """Flat uint8 view over a contiguous tensor's storage (works for 0-dim and bf16)."""
+    return tensor.reshape(-1).view(torch.uint8)
+
+
+def _align(n):
+    return -(-n // ALIGN) * ALIGN
+
+
+# --- Writing ---
+def write_flat(state_dict, f):
+    """Write a state dict as a header plus raw contiguous tensor buffers."""
+    entries, tensors, offset = [], [], 0
+    for name, tensor in state_dict.items():
+        tensor = tensor.detach().cpu().contiguous()
+        nbytes = tensor.numel() * tensor.element_size()
+        offset = _align(offset)
+        entries.append({
+            "name": name,
+            "dtype": _NAMES[tensor.dtype],
+            "shape": list(tensor.shape),
+            "offset": offset,
+            "nbytes": nbytes,
+        })
+        tensors.append(tensor)
+        offset += nbytes
+
+    header = json.dumps({"tensors": entries}).encode()
+    prefix = len(MAGIC) + _LEN.size
+    header += b" " * (_align(prefix + len(header)) - prefix - len(header))
+    f.write(MAGIC)
+    f.write(_LEN.pack(len(header)))
+    f.write(header)
+
+    pos = 0
+    for entry, tensor in zip(entries, tensors):
+        if tensor.numel():
+            f.write(b"\0" * (entry["offset"] - pos))
+            f.write(memoryview(_as_bytes(tensor).numpy()))
+            pos = entry["offset"] + entry["nbytes"]
+
+
+def save_flat(state_dict, path):
+    """Atomically write a flat checkpoint (temp file, fsync, rename).
+
+    The bytes are chunk-hashed as they are written, and the manifest is kept
+    in a sidecar so serving or verifying the file never re-reads it to hash.
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        writer = HashingWriter(f)
+        write_flat(state_dict, writer)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    write_manifest(path, writer.manifest())
+
+
+# --- Streaming reads ---
+class TeeReader:
+    """Wraps a readable stream, copying every byte read to `sink` and optionally hashing it.
+
+    A `verifier` (utils.hashing.ChunkVerifier) checks the bytes against a
+    chunk manifest as they arrive and raises IntegrityError at the first
+    bad chunk, before the rest of the stream is read.
+    """
+
+    def __init__(self, raw, sink=None, hash=True, verifier=None):
+        self.raw = raw
+        self.sink = sink
+        self.sha256 = hashlib.sha256() if hash else None
+        self.verifier = verifier
+
+    def readinto(self, buffer):
+        view = memoryview(buffer).cast("B")
+        filled = 0
+        while filled < len(view):
+            n = self.raw.readinto(view[filled:])
+            if not n:
+                raise EOFError(f"Stream ended after {filled} of {len(view)} bytes")
+            filled += n
+        if self.sha256 is not None:
+            self.sha256.update(view)
+        if self.verifier is not None:
+            self.verifier.update(view)
+        if self.sink is not None:
+            self.sink.write(view)
+        return filled
+
+    def read_exact(self, n):
+        buffer = bytearray(n)
+        self.readinto(buffer)
+        return bytes(buffer)
+
+    def hexdigest(self):
+        return self.sha256.hexdigest()
+
+
+def read_header(reader):
+    if reader.read_exact(len(MAGIC)) != MAGIC:
+        raise ValueError("Not a flat tensor stream")
+    (header_len,) = _LEN.unpack(reader.read_exact(_LEN.size))
+    return json.loads(reader.read_exact(header_len))
+
+
+def _skip_to(reader, pos, entry):
+    """Consume alignment padding before `entry`; returns the position after it."""
+    if entry["offset"] > pos:
+        reader.read_exact(entry["offset"] - pos)
+    return entry["offset"] + entry["nbytes"]
+
+
+def read_flat_into(reader, target_state, strict=True):
+    """Deserialize a flat stream straight into the tensors of `target_state`.
+
+    CPU targets are filled in place from the stream; other devices go through
+    one reusable pinned staging buffer sized to the largest tensor, so no
+    second full copy of the model is ever held. With strict=False the stream
+    may cover only part of the model, and stream tensors the model does not
+    have are skipped.
+    """
+    header = read_header(reader)
+    entries = header["tensors"]
+
+    names = {e["name"] for e in entries}
+    mismatched = sorted(names.symmetric_difference(target_state))
+    if strict and mismatched:
+        raise KeyError(f"Stream and model tensors differ: {mismatched[:5]}")
+
+    staging, pos = None, 0
+    for entry in entries:
+        target = target_state.get(entry["name"])
+        if target is None:
+            # Not in the model (strict=False): consume and discard its bytes
+            if entry["nbytes"]:
+                pos = _skip_to(reader, pos, entry)
+                reader.read_exact(entry["nbytes"])
+            continue
+        dtype = _DTYPES[entry["dtype"]]
+        if list(target.shape) != entry["shape"]:
+            raise ValueError(f"Shape mismatch for {entry['name']}: {entry['shape']} vs {list(target.shape)}")
+        if entry["nbytes"] == 0:
+            continue
+        pos = _skip_to(reader, pos, entry)
+
+        with torch.no_grad():
+            if target.device.type == "cpu" and target.dtype == dtype and target.is_contiguous():
+                reader.readinto(_as_bytes(target).numpy())
+                continue
+
+            if staging is None:
+                largest = max(e["nbytes"] for e in entries)
+                staging = torch.empty(largest, dtype=torch.uint8, pin_memory=torch.cuda.is_available())
+            chunk = staging[:entry["nbytes"]]
+            reader.readinto(chunk.numpy())
+            target.copy_(chunk.view(dtype).view(entry["shape"]))
+
+    return header
+
+
+# --- Memory-mapped reads ---
+class FlatCheckpoint(Mapping):
+    """Read-only mapping over a memory-mapped flat checkpoint.
+
+    Tensors are created on access as views into the mapping, so opening a
+    checkpoint costs only the header parse and pages are read as they are
+    touched. The mapping is copy-on-write: in-place edits stay private.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"Not a flat checkpoint: {path}")
+        (header_len,) = _LEN.unpack_from(self._mmap, len(MAGIC))
+        data_start = len(MAGIC) + _LEN.size + header_len
+        header = json.loads(self._mmap[len(MAGIC) + _LEN.size:data_start])
+        self.data_start = data_start
+        self.entries = {e["name"]: e for e in header["tensors"]}
+
+    def __getitem__(self, name):
+        entry = self.entries[name]
+        dtype = _DTYPES[entry["dtype"]]
+        if entry["nbytes"] == 0:
+            return torch.empty(entry["shape"], dtype=dtype)
+        count = entry["nbytes"] // dtype.itemsize
+        tensor = torch.frombuffer(self._mmap, dtype=dtype, count=count, offset=self.data_start + entry["offset"])
+        return tensor.view(entry["shape"])
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def load_flat(path, map_location="cpu"):
+    """Load a flat checkpoint as a state dict; CPU tensors are zero-copy views of the mapping."""
+    checkpoint = FlatCheckpoint(path)
+    if torch.device(map_location).type == "cpu":
+        return dict(checkpoint.items())
+    return {name: tensor.to(map_location) for name, tensor in checkpoint.items()}
+
+
+# --- Checkpoint I/O (flat or pickled .pth, detected by content) ---
+def load_checkpoint(path, map_location="cpu", mmap=False, verify=False):
+    """Load a state dict from a flat or .pth checkpoint.
+
+    Flat files are always memory-mapped; `mmap=True` also maps .pth files
+    (zipfile format only) instead of reading them into memory. With
+    `verify=True` a file that has a manifest sidecar is checked against it
+    first (IntegrityError on mismatch).
+    """
+    manifest = read_manifest(path) if verify else None
+    if manifest is not None:
+        verify_file(path, manifest)
+    if is_flat_file(path):
+        return load_flat(path, map_location)
+    if mmap:
+        return torch.load(path, map_location=map_location, mmap=True, weights_only=True)
+    return torch.load(path, map_location=map_location)
+
+
+def save_checkpoint(state_dict, path, fmt=None):
+    """Atomically write a state dict in config.CHECKPOINT_FORMAT ("flat" or "pth")."""
+    if (fmt or config.CHECKPOINT_FORMAT) == "flat":
+        save_flat(state_dict, path)
+        return
+    tmp_path = path + ".tmp"
+    torch.save(state_dict, tmp_path)
+    os.replace(tmp_path, path)
+    if os.path.exists(manifest_path(path)):
+        os.remove(manifest_path(path))  # describes the flat file this one replaced
+
+
+def convert_checkpoint(src, dst=None, fmt="flat"):
+    """Rewrite a checkpoint in another format (in place when `dst` is omitted)."""
+    state = load_checkpoint(src)
+    if isinstance(state, dict) and "model_state_dict" in state:
+        state = state["model_state_dict"]
+    if fmt == "pth":
+        state = {k: v.clone() for k, v in state.items()}  # detach from the source mapping
+    save_checkpoint(state, dst or src, fmt)
+    return dst or src
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert checkpoints between .pth and the flat format")
+    parser.add_argument("paths", nargs="+", help="Checkpoint files or directories (*.pth inside)")
+    parser.add_argument("--to", choices=("flat", "pth"), default="flat")
+    args = parser.parse_args()
+
+    for path in args.paths:
+        files = sorted(glob(os.path.join(path, "**", "*.pth"), recursive=True)) if os.path.isdir(path) else [path]
+        for file in files:
+            if is_flat_file(file) == (args.to == "flat"):
+                continue
+            before = os.path.getsize(file)
+            convert_checkpoint(file, fmt=args.to)
+            print(f"{file}: {before / 2**20:.1f} MB → {os.path.getsize(file) / 2**20:.1f} MB ({args.to})")
@@ -0,0 +1,51 @@
+import os
+import time
+import threading
+
+
+def _poll_for_file(path, timeout, max_interval):
+    deadline = None if timeout is None else time.monotonic() + timeout
+    interval = 0.1
+    while not os.path.exists(path):
+        if deadline is not None and time.monotonic() >= deadline:
+            return False
+        time.sleep(interval)
+        interval = min(interval * 2, max_interval)
+    return True
+
+
+def wait_for_file(path, timeout=None, max_interval=5.0):
+    """Block until `path` exists, using filesystem notifications when watchdog is installed.
+
+    Without watchdog this falls back to polling with exponential backoff.
+    Returns False if `timeout` seconds pass first.
+    """
+    if os.path.exists(path):
+        return True
+
+    try:
+        from watchdog.observers import Observer
+        from watchdog.events import FileSystemEventHandler
+    except ImportError:
+        return _poll_for_file(path, timeout, max_interval)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    appeared = threading.Event()
+
+    class _Handler(FileSystemEventHandler):
+        def on_any_event(self, event):
+            if os.path.exists(path):
+                appeared.set()
+
+    observer = Observer()
+    observer.schedule(_Handler(), directory, recursive=False)
+    observer.start()
+    try:
+        # The file may have appeared before the watch was in place
+        if os.path.exists(path):
+            return True
+        return appeared.wait(timeout)
+    finally:
+        observer.stop()
+        observer.join()
@@ -0,0 +1,202 @@
+import os
+import json
+import hashlib
+import config
+
+CHUNK_SIZE = 1024 * 1024
+CHUNK_DIGEST_SIZE = 20  # BLAKE2b-160, the same key CheckpointStore files its objects under
+
+# (abspath, size, mtime_ns) → hex digest, so unchanged files are hashed once per process
+_digest_memo = {}
+_manifest_memo = {}
+
+
+class IntegrityError(IOError):
+    """Data does not match the hash it was announced with."""
+
+
+def file_digest(path, chunk_size=CHUNK_SIZE):
+    """SHA-256 of a file, streamed in chunks and memoised on (path, size, mtime)."""
+    st = os.stat(path)
+    memo_key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    if memo_key in _digest_memo:
+        return _digest_memo[memo_key]
+
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+
+    _digest_memo[memo_key] = h.hexdigest()
+    return _digest_memo[memo_key]
+
+
+def stream_digest(stream, chunk_size=CHUNK_SIZE):
+    """SHA-256 of a seekable stream's remaining bytes; the position is restored afterwards."""
+    start = stream.tell()
+    h = hashlib.sha256()
+    for chunk in iter(lambda: stream.read(chunk_size), b""):
+        h.update(chunk)
+    stream.seek(start)
+    return h.hexdigest()
+
+
+def chunk_digest(data):
+    return hashlib.blake2b(data, digest_size=CHUNK_DIGEST_SIZE).hexdigest()
+
+
+# --- Chunk manifests ---
+# A manifest lists the BLAKE2b digest of every `chunk_size` bytes of a file,
+# and its "root" (the hash of that list) identifies the whole file. Receivers
+# check each chunk as it arrives and stop at the first bad one instead of
+# finding out after the whole transfer; the root doubles as a cache key.
+def _root(digests):
+    return hashlib.blake2b("".join(digests).encode(), digest_size=CHUNK_DIGEST_SIZE).hexdigest()
+
+
+class ChunkHasher:
+    """Incremental per-chunk digests over a byte stream fed in arbitrary pieces."""
+
+    def __init__(self, chunk_size=None):
+        self.chunk_size = chunk_size or int(config.INTEGRITY_CHUNK_MB * 1024 * 1024)
+        self.digests = []
+        self.size = 0
+        self._current = hashlib.blake2b(digest_size=CHUNK_DIGEST_SIZE)
+        self._filled = 0
+
+    def update(self, data):
+        view = memoryview(data).cast("B")
+        while len(view):
+            n = min(len(view), self.chunk_size - self._filled)
+            self._current.update(view[:n])
+            self._filled += n
+            self.size += n
+            view = view[n:]
+            if self._filled == self.chunk_size:
+                self._chunk_done(self._current.hexdigest())
+
+    def _chunk_done(self, digest):
+        self.digests.append(digest)
+        self._current = hashlib.blake2b(digest_size=CHUNK_DIGEST_SIZE)
+        self._filled = 0
+
+    def finish(self):
+        """Close the last partial chunk and return the manifest."""
+        if self._filled:
+            self._chunk_done(self._current.hexdigest())
+        return {"chunk_size": self.chunk_size, "size": self.size, "chunks": self.digests, "root": _root(self.digests)}
+
+
+class ChunkVerifier(ChunkHasher):
+    """ChunkHasher that raises IntegrityError as soon as a chunk differs from `manifest`.
+
+    `offset` (a multiple of the chunk size) starts verification mid-file,
+    e.g. when resuming a download after an already verified prefix.
+    """
+
+    def __init__(self, manifest, offset=0):
+        super().__init__(manifest["chunk_size"])
+        if offset % self.chunk_size:
+            raise ValueError(f"Offset {offset} is not on a {self.chunk_size}-byte chunk boundary")
+        self.manifest = manifest
+        self.digests = list(manifest["chunks"][:offset // self.chunk_size])
+        self.size = offset
+
+    def update(self, data):
+        if self.size + len(memoryview(data).cast("B")) > self.manifest["size"]:
+            raise IntegrityError(f"Received more than the announced {self.manifest['size']} bytes")
+        super().update(data)
+
+    def _chunk_done(self, digest):
+        index = len(self.digests)
+        if digest != self.manifest["chunks"][index]:
+            raise IntegrityError(f"Chunk {index} (bytes {index * self.chunk_size}+) does not match the manifest")
+        super()._chunk_done(digest)
+
+    def finish(self):
+        if self.size != self.manifest["size"]:
+            raise IntegrityError(f"Truncated: {self.size} of {self.manifest['size']} bytes")
+        return super().finish()
+
+
+class HashingWriter:
+    """File wrapper that builds a chunk manifest of everything written through it."""
+
+    def __init__(self, f, chunk_size=None):
+        self.f = f
+        self.hasher = ChunkHasher(chunk_size)
+
+    def write(self, data):
+        self.hasher.update(data)
+        return self.f.write(data)
+
+    def manifest(self):
+        return self.hasher.finish()
+
+
+def manifest_path(path):
+    return path + ".manifest.json"
+
+
+def write_manifest(path, manifest):
+    """Store `manifest` next to `path`, stamped with the file's size and mtime so stale sidecars are ignored."""
+    st = os.stat(path)
+    sidecar = {**manifest, "mtime_ns": st.st_mtime_ns}
+    with open(manifest_path(path) + ".tmp", "w") as f:
+        json.dump(sidecar, f)
+    os.replace(manifest_path(path) + ".tmp", manifest_path(path))
+    _manifest_memo[(os.path.abspath(path), st.st_size, st.st_mtime_ns)] = manifest
+
+
+def read_manifest(path):
+    """The sidecar manifest of `path`, or None if there is none or the file changed since it was written."""
+    if not os.path.exists(manifest_path(path)):
+        return None
+    st = os.stat(path)
+    with open(manifest_path(path)) as f:
+        sidecar = json.load(f)
+    if (sidecar["size"], sidecar.pop("mtime_ns")) != (st.st_size, st.st_mtime_ns):
+        return None
+    return sidecar
+
+
+def file_manifest(path):
+    """Chunk manifest of a file: memoised, read from a fresh sidecar, or hashed in one pass."""
+    st = os.stat(path)
+    memo_key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    if memo_key in _manifest_memo:
+        return _manifest_memo[memo_key]
+
+    manifest = read_manifest(path)
+    if manifest is None:
+        hasher = ChunkHasher()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(hasher.chunk_size), b""):
+                hasher.update(block)
+        manifest = hasher.finish()
+
+    _manifest_memo[memo_key] = manifest
+    return manifest
+
+
+def verified_prefix(path, manifest):
+    """Length of the leading whole chunks of `path` that match `manifest` (for resuming downloads)."""
+    if manifest["chunk_size"] <= 0 or not os.path.exists(path):
+        return 0
+    good = 0
+    with open(path, "rb") as f:
+        for expected in manifest["chunks"]:
+            block = f.read(manifest["chunk_size"])
+            if len(block) < manifest["chunk_size"] or chunk_digest(block) != expected:
+                break
+            good += len(block)
+    return good
+
+
+def verify_file(path, manifest):
+    """Raise IntegrityError at the first chunk of `path` that does not match `manifest`."""
+    verifier = ChunkVerifier(manifest)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(verifier.chunk_size), b""):
+            verifier.update(block)
+    verifier.finish()
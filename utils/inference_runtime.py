@@ -0,0 +1,142 @@
+import os
+import json
+import math
+import itertools
+import torch
+import torch.nn.functional as F
+
+# Extensions produced by export_model.py
+TORCHSCRIPT_EXTS = (".ts", ".torchscript")
+ONNX_EXTS = (".onnx",)
+META_FILE = "meta.json"
+
+
+# --- Padding (mirrors monai DivisiblePad(k, method="symmetric")) ---
+def pad_divisible(tensor, k=16):
+    """Zero-pad the spatial dims of a [C, *spatial] tensor up to a multiple of k."""
+    pad = []
+    for size in reversed(tensor.shape[1:]):
+        diff = (k - size % k) % k
+        pad.extend([diff // 2, diff - diff // 2])
+    if not any(pad):
+        return tensor
+    return F.pad(tensor, pad)
+
+
+# --- Sliding window (mirrors monai sliding_window_inference, constant blending) ---
+def _window_starts(size, roi, overlap):
+    if roi >= size:
+        return [0]
+    interval = max(int(roi * (1 - overlap)), 1)
+    num = math.ceil((size - roi) / interval) + 1
+    return sorted({min(i * interval, size - roi) for i in range(num)})
+
+
+def sliding_window_inference(inputs, roi_size, sw_batch_size, predictor, overlap=0.25):
+    """Torch-only sliding window over a [B, C, *spatial] volume, returning logits."""
+    spatial = inputs.shape[2:]
+
+    # Pad up to the ROI when the volume is smaller, cropped back at the end
+    pad, crop = [], []
+    for size, roi in zip(reversed(spatial), reversed(roi_size)):
+        diff = max(roi - size, 0)
+        pad.extend([diff // 2, diff - diff // 2])
+    if any(pad):
+        inputs = F.pad(inputs, pad)
+    padded = inputs.shape[2:]
+    for dim, size in enumerate(spatial):
+        before = pad[2 * (len(spatial) - 1 - dim)]
+        crop.append(slice(before, before + size))
+
+    starts = [_window_starts(s, r, overlap) for s, r in zip(padded, roi_size)]
+    windows = [
+        tuple(slice(st, st + r) for st, r in zip(start, roi_size))
+        for start in itertools.product(*starts)
+    ]
+
+    # Windows from every volume in the batch share the predictor calls
+    items = [(b, w) for b in range(inputs.shape[0]) for w in windows]
+    output, count = None, None
+    for i in range(0, len(items), sw_batch_size):
+        chunk = items[i:i + sw_batch_size]
+        patches = torch.cat([inputs[b:b + 1, :, w[0], w[1], w[2]] for b, w in chunk])
+        logits = predictor(patches)
+
+        if output is None:
+            output = torch.zeros(
+                (inputs.shape[0], logits.shape[1], *padded),
+                dtype=logits.dtype, device=inputs.device
+            )
+            count = torch.zeros((1, 1, *padded), dtype=logits.dtype, device=inputs.device)
+
+        for j, (b, w) in enumerate(chunk):
+            output[b:b + 1, :, w[0], w[1], w[2]] += logits[j:j + 1]
+            if b == 0:
+                count[:, :, w[0], w[1], w[2]] += 1
+
+    output /= count
+    return output[(slice(None), slice(None), *crop)]
+
+
+# --- Exported artifact loading (no MONAI import) ---
+def is_exported_model(path):
+    return str(path).lower().endswith(TORCHSCRIPT_EXTS + ONNX_EXTS)
+
+
+class ExportedModel:
+    """Callable wrapper around a TorchScript or ONNX artifact written by export_model.py."""
+
+    def __init__(self, runner, meta, device):
+        self.runner = runner
+        self.meta = meta
+        self.device = device
+        self.roi_size = tuple(meta.get("roi_size", (128, 160, 160)))
+
+    def __call__(self, x):
+        return self.runner(x)
+
+    def eval(self):
+        return self
+
+
+def _load_torchscript(path, device):
+    extra = {META_FILE: ""}
+    module = torch.jit.load(path, map_location=device, _extra_files=extra)
+    module.eval()
+    meta = json.loads(extra[META_FILE] or "{}")
+    return ExportedModel(module, meta, device)
+
+
+def _load_onnx(path, device):
+    try:
+        import onnxruntime as ort
+    except ImportError:
+        raise ImportError("onnxruntime is required to run .onnx artifacts (pip install onnxruntime)")
+
+    providers = ["CPUExecutionProvider"]
+    if str(device).startswith("cuda"):
+        providers.insert(0, "CUDAExecutionProvider")
+    session = ort.InferenceSession(path, providers=providers)
+    input_name = session.get_inputs()[0].name
+
+    meta_path = os.path.splitext(path)[0] + ".json"
+    meta = {}
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+
+    def run(x):
+        out = session.run(None, {input_name: x.detach().cpu().numpy()})[0]
+        return torch.from_numpy(out).to(x.device)
+
+    return ExportedModel(run, meta, device)
+
+
+def load_inference_model(path, device):
+    """Load an exported artifact for inference-only use."""
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Model artifact not found: {path}")
+
+    if str(path).lower().endswith(ONNX_EXTS):
+        return _load_onnx(path, device)
+    return _load_torchscript(path, device)
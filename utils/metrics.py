@@ -0,0 +1,78 @@
+import math
+from dataclasses import dataclass, asdict
+import torch
+
+
+@dataclass
+class SegmentationMetrics:
+    """All segmentation metrics for one prediction/ground-truth pair."""
+    dice_per_slice: list  # None when not requested
+    dice: float
+    iou: float
+    pixel_acc: float
+    sensitivity: float
+    specificity: float
+    pred_volume: float
+    true_volume: float
+
+    def to_dict(self):
+        return asdict(self)
+
+
+def _binarize(mask, threshold):
+    if mask.dtype == torch.bool:
+        return mask
+    if mask.is_floating_point():
+        return mask > threshold
+    return mask != 0
+
+
+def _ratio(num, den):
+    return num / den if den > 0 else math.nan
+
+
+def compute_segmentation_metrics(pred_mask, true_mask, slice_dim=-1, threshold=0.5,
+                                 voxel_volume=1.0, eps=1e-8, per_slice=True):
+    """Compute every metric in one pass on the device of `pred_mask`.
+
+    Masks may be bool, integer or float (thresholded at `threshold`). Per-slice
+    Dice is taken along `slice_dim` (skipped with per_slice=False); volume Dice
+    is NaN when the ground truth is empty, matching monai's
+    DiceMetric(ignore_empty=True). Results reach the host in a single sync.
+    """
+    pred = _binarize(pred_mask, threshold)
+    true = _binarize(true_mask.to(pred.device), threshold)
+
+    # [S, N] views, one row per slice
+    pred = pred.movedim(slice_dim, 0).reshape(pred.shape[slice_dim], -1)
+    true = true.movedim(slice_dim, 0).reshape(true.shape[slice_dim], -1)
+
+    tp_s = (pred & true).sum(dim=1)
+    pred_s = pred.sum(dim=1)
+    true_s = true.sum(dim=1)
+
+    # Totals and per-slice Dice in one float64 tensor (exact for counts below 2**53)
+    values = torch.stack([tp_s.sum(), pred_s.sum(), true_s.sum()]).double()
+    if per_slice:
+        values = torch.cat([values, ((2.0 * tp_s) / (pred_s + true_s + eps)).double()])
+    values = values.tolist()  # single device → host sync
+    tp, p, t = (int(v) for v in values[:3])
+    n = pred.numel()
+    tn = n - p - t + tp
+
+    return SegmentationMetrics(
+        dice_per_slice=values[3:] if per_slice else None,
+        dice=_ratio(2.0 * tp, p + t) if t > 0 else math.nan,
+        iou=_ratio(tp, p + t - tp),
+        pixel_acc=(tp + tn) / n,
+        sensitivity=_ratio(tp, t),
+        specificity=_ratio(tn, n - t),
+        pred_volume=p * voxel_volume,
+        true_volume=t * voxel_volume,
+    )
+
+
+def mean_dice(metrics_list):
+    """Average volume Dice over cases, skipping NaN (empty ground truth) like DiceMetric.aggregate."""
+    values = [m.dice for m in metrics_list if not math.isnan(m.dice)]
+    return sum(values) / len(values) if values else math.nan
@@ -0,0 +1,129 @@
+import math
+import zlib
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+# Adapters live under this submodule, so the base model's parameter names are unchanged
+ADAPTER_ROOT = "lora_adapters"
+PEFT_MODES = (None, "decoder", "lora")
+
+
+class LoRAAdapter(nn.Module):
+    """Low-rank update B @ A for one nn.Linear, added to its output by a forward hook."""
+
+    def __init__(self, linear, rank=8, alpha=16, seed=0):
+        super().__init__()
+        device, dtype = linear.weight.device, linear.weight.dtype
+        # kaiming_uniform_(a=sqrt(5)) bounds, drawn from a seeded generator so that
+        # every client starts from the same A and the adapters can be averaged
+        bound = 1 / math.sqrt(linear.in_features)
+        generator = torch.Generator().manual_seed(seed)
+        init = (torch.rand(rank, linear.in_features, generator=generator) * 2 - 1) * bound
+        self.lora_A = nn.Parameter(init.to(device=device, dtype=dtype))
+        self.lora_B = nn.Parameter(torch.zeros(linear.out_features, rank, device=device, dtype=dtype))
+        # Kept as a buffer so checkpoints carry what is needed to merge them
+        self.register_buffer("scale", torch.tensor(alpha / rank))
+
+    def delta_weight(self):
+        return (self.lora_B @ self.lora_A) * self.scale
+
+    def hook(self, module, inputs, output):
+        return output + F.linear(F.linear(inputs[0], self.lora_A), self.lora_B) * self.scale
+
+
+def _adapter_key(module_name):
+    return module_name.replace(".", "__")
+
+
+def _module_name(adapter_key):
+    return adapter_key.replace("__", ".")
+
+
+def freeze(model, prefixes):
+    """Stop gradients for every parameter whose name starts with one of `prefixes`."""
+    for name, param in model.named_parameters():
+        if name.startswith(tuple(prefixes)):
+            param.requires_grad_(False)
+
+
+def add_lora_adapters(model, targets, rank=8, alpha=16, within=("vit.",), seed=0):
+    """Attach LoRA adapters to nn.Linear layers under `within` whose names end with one of `targets`.
+
+    Each adapter's initial A is seeded from `seed` and its layer name, so
+    clients sharing `seed` create identical adapters.
+    """
+    adapters = nn.ModuleDict()
+    hooks = []
+    for name, module in model.named_modules():
+        if isinstance(module, nn.Linear) and name.startswith(tuple(within)) and name.endswith(tuple(targets)):
+            adapter = LoRAAdapter(module, rank, alpha, seed=seed + zlib.crc32(name.encode()))
+            adapters[_adapter_key(name)] = adapter
+            hooks.append(module.register_forward_hook(adapter.hook))
+
+    model.add_module(ADAPTER_ROOT, adapters)
+    model._lora_hooks = hooks
+    return adapters
+
+
+def apply_peft(model, mode, frozen_prefixes=("vit.",), lora_targets=("attn.qkv", "attn.out_proj"), rank=8, alpha=16,
+               seed=0):
+    """Configure parameter-efficient training in place and return the trainable parameter names.
+
+    mode=None trains everything; "decoder" freezes `frozen_prefixes` (the ViT
+    encoder by default); "lora" freezes them too and adds trainable low-rank
+    adapters to the matching encoder linears.
+    """
+    if mode not in PEFT_MODES:
+        raise ValueError(f"Unknown PEFT mode '{mode}', expected one of {PEFT_MODES}")
+
+    if mode is not None:
+        freeze(model, frozen_prefixes)
+    if mode == "lora":
+        add_lora_adapters(model, lora_targets, rank, alpha, within=frozen_prefixes, seed=seed)
+
+    return {name for name, param in model.named_parameters() if param.requires_grad}
+
+
+def trainable_state_dict(model, trainable):
+    """The subset of model.state_dict() that is trained (and uploaded), plus adapter scales."""
+    return {k: v for k, v in model.state_dict().items()
+            if k in trainable or k.startswith(ADAPTER_ROOT + ".")}
+
+
+# --- Merging adapters back into full weights (inference / export) ---
+def merge_lora_state(state_dict):
+    """Fold adapter weights into their base linears and drop the adapter keys.
+
+    Works on plain state dicts, so checkpoints trained with LoRA load into a
+    stock UNETR for inference or export.
+    """
+    prefix = ADAPTER_ROOT + "."
+    merged = {k: v for k, v in state_dict.items() if not k.startswith(prefix)}
+    adapters = {k[len(prefix):].rsplit(".", 1)[0] for k in state_dict if k.startswith(prefix)}
+
+    for adapter in adapters:
+        a = state_dict[f"{prefix}{adapter}.lora_A"].float()
+        b = state_dict[f"{prefix}{adapter}.lora_B"].float()
+        scale = state_dict[f"{prefix}{adapter}.scale"].float()
+        weight_key = f"{_module_name(adapter)}.weight"
+        base = merged[weight_key]
+        merged[weight_key] = (base.float() + (b @ a) * scale).to(base.dtype)
+    return merged
+
+
+def merge_lora(model):
+    """Fold adapters into the model's linears in place and remove them."""
+    adapters = getattr(model, ADAPTER_ROOT, None)
+    if adapters is None:
+        return model
+
+    modules = dict(model.named_modules())
+    with torch.no_grad():
+        for key, adapter in adapters.items():
+            modules[_module_name(key)].weight.add_(adapter.delta_weight())
+    for hook in model._lora_hooks:
+        hook.remove()
+    del model._modules[ADAPTER_ROOT]
+    del model._lora_hooks
+    return model
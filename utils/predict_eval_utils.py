@@ -1,46 +1,35 @@
 import torch
-from monai.inferers import sliding_window_inference
-from monai.metrics import DiceMetric
-import numpy as np
+from utils.inference_runtime import sliding_window_inference
+from utils.metrics import compute_segmentation_metrics
 
-def predict(model, image, device, threshold=0.5, roi_size=(128, 160, 160), sw_batch_size=1):
+def alloc_mask(shape, device):
+    """Preallocate a host bool mask, pinned when results come back from a GPU."""
+    return torch.empty(shape, dtype=torch.bool, pin_memory=str(device).startswith("cuda"))
 
+def predict(model, image, device, threshold=0.5, roi_size=(128, 160, 160), sw_batch_size=1, out=None):
+    """Predict a bool [1, D, H, W] mask for a [C, D, H, W] image.
+
+    The image crosses to `device` once (a no-op if it is already there). The
+    mask stays on `device` unless `out` is given, in which case it is copied
+    into that preallocated buffer with a single transfer.
+    """
     model.eval()
-    image = image.unsqueeze(0).to(device)  # Add batch dimension
+    image = image.unsqueeze(0).to(device, non_blocking=True)  # Add batch dimension
 
-    with torch.no_grad():
+    with torch.inference_mode():
         output = sliding_window_inference(image, roi_size, sw_batch_size, model)
-        pred_mask = (torch.sigmoid(output) >= threshold).float()
+        # sigmoid(x) >= t  <=>  x >= logit(t), so no probability map is materialised
+        pred_mask = output[0] >= torch.logit(torch.tensor(threshold)).item()
+        del output
 
-    return pred_mask.squeeze(0).cpu()  # Remove batch dimension and move to CPU
+    if out is None:
+        return pred_mask
+    out.copy_(pred_mask)
+    return out
 
 def evaluate(pred_mask, true_mask):
+    metrics = compute_segmentation_metrics(pred_mask, true_mask)
+    return metrics.dice, metrics.pixel_acc
 
-    device = pred_mask.device
-    pred_mask = pred_mask.unsqueeze(0).unsqueeze(0).float()  # [B, C, H, W, D]
-    true_mask = true_mask.unsqueeze(0).unsqueeze(0).float().to(device)
-
-    dice_metric = DiceMetric(include_background=False, reduction="mean")
-    dice_metric(y_pred=pred_mask, y=true_mask)
-    dice_score = dice_metric.aggregate().item()
-    dice_metric.reset()
-
-    correct = (pred_mask == true_mask).float().sum()
-    total = true_mask.numel()
-    pixel_acc = (correct / total).item()
-
-    return dice_score, pixel_acc
-
-def evaluate_per_slice(pred_mask, mask):
-    dice_scores = []
-    for i in range(pred_mask.shape[-1]):  # iterate over depth
-        pred_slice = pred_mask[..., i]
-        mask_slice = mask[..., i]
-        intersection = (pred_slice * mask_slice).sum()
-        dice = (2. * intersection) / (pred_slice.sum() + mask_slice.sum() + 1e-8)
-        dice_scores.append(dice.item())
-    return dice_scores
-
-
-
-
+def evaluate_per_slice(pred_mask, mask, slice_dim=-1):
+    return compute_segmentation_metrics(pred_mask, mask, slice_dim=slice_dim).dice_per_slice
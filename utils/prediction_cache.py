@@ -0,0 +1,81 @@
+import os
+import json
+import zlib
+import hashlib
+import zipfile
+import numpy as np
+import torch
+import config
+from utils.hashing import file_digest
+
+
+class PredictionCache:
+    """Content-addressed on-disk cache of predicted masks.
+
+    Entries are keyed by (image hash, checkpoint hash, inference settings), so
+    selecting a new round checkpoint never hits stale results. Masks are stored
+    bit-packed and compressed; once the cache exceeds `max_bytes` the least
+    recently used entries are evicted.
+    """
+
+    def __init__(self, cache_dir=config.PREDICTION_CACHE_DIR, max_bytes=config.PREDICTION_CACHE_MAX_MB * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def make_key(self, image_path, model_path, **settings):
+        payload = json.dumps({
+            "image": file_digest(image_path),
+            "model": file_digest(model_path),
+            "settings": settings,
+        }, sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.npz")
+
+    def get(self, key):
+        """Return the cached bool mask, or None on a miss."""
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+
+        try:
+            with np.load(path) as data:
+                shape = tuple(data["shape"])
+                bits = np.unpackbits(data["bits"], count=int(np.prod(shape)))
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile, zlib.error):
+            # Corrupt or truncated entry (e.g. written by a crashed process): drop it and recompute
+            if os.path.exists(path):
+                os.remove(path)
+            return None
+
+        os.utime(path)  # mark as recently used
+        return torch.from_numpy(bits.reshape(shape).astype(bool))
+
+    def put(self, key, mask):
+        mask = mask.cpu().numpy().astype(bool)
+        tmp_path = self._path(key) + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez_compressed(f, bits=np.packbits(mask.ravel()), shape=np.array(mask.shape))
+        os.replace(tmp_path, self._path(key))
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".npz"):
+                st = os.stat(os.path.join(self.cache_dir, name))
+                entries.append((st.st_mtime, st.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.cache_dir, name))
+            total -= size
+
+    def clear(self):
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".npz"):
+                os.remove(os.path.join(self.cache_dir, name))
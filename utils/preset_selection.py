@@ -0,0 +1,168 @@
+"""Pick the largest UNETR preset this machine can train within a round's time budget.
+
+Each preset gets a short on-device micro-benchmark (a few training steps
+and validation forwards at the real input size), which is extrapolated to a
+full round: EPOCHS_PER_CLIENT epochs over the local training set plus
+validation. The recommendation is the largest preset whose estimate fits
+config.ROUND_TIME_BUDGET_S and the device's memory.
+
+A federation trains one preset, so each site runs this and the server is
+started with the smallest preset any site recommends:
+
+    python -m utils.preset_selection --device cuda --out preset_report.json
+    python federated_server.py --model-preset small
+"""
+import os
+import math
+import json
+import time
+import resource
+import argparse
+import torch
+import config
+from models.unetr_model import UNETR_PRESETS, get_unetr
+from utils.train_utils import combined_loss
+
+INPUT_SHAPE = (3, 128, 160, 160)
+
+
+def _sync(device):
+    if torch.device(device).type == "cuda":
+        torch.cuda.synchronize(device)
+
+
+def measure_preset(preset, device, batch_size=1, steps=3, warmup=1):
+    """Seconds per training step and per validation volume, peak memory (MB) and parameter count.
+
+    On CPU, peak memory is the process's peak RSS, which only grows; measure
+    presets smallest first so each reading is dominated by the current one.
+    """
+    cuda = torch.device(device).type == "cuda"
+    if cuda:
+        torch.cuda.empty_cache()
+        torch.cuda.reset_peak_memory_stats(device)
+
+    model = get_unetr(device, preset)
+    optimizer = torch.optim.Adam(model.parameters(), lr=1e-4)
+    scaler = torch.cuda.amp.GradScaler() if cuda else None
+    images = torch.randn(batch_size, *INPUT_SHAPE, device=device)
+    masks = (torch.rand(batch_size, 1, *INPUT_SHAPE[1:], device=device) > 0.5).float()
+
+    def train_step():
+        optimizer.zero_grad()
+        with torch.cuda.amp.autocast(enabled=cuda):
+            loss = combined_loss(model(images), masks)
+        if scaler is not None:
+            scaler.scale(loss).backward()
+            scaler.step(optimizer)
+            scaler.update()
+        else:
+            loss.backward()
+            optimizer.step()
+
+    model.train()
+    for _ in range(warmup):
+        train_step()
+    _sync(device)
+    start = time.perf_counter()
+    for _ in range(steps):
+        train_step()
+    _sync(device)
+    step_s = (time.perf_counter() - start) / steps
+
+    model.eval()
+    with torch.no_grad(), torch.cuda.amp.autocast(enabled=cuda):
+        model(images[:1])
+        _sync(device)
+        start = time.perf_counter()
+        for _ in range(steps):
+            model(images[:1])
+        _sync(device)
+    val_s = (time.perf_counter() - start) / steps
+
+    if cuda:
+        peak_mb = torch.cuda.max_memory_allocated(device) / 2**20
+    else:
+        peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return {
+        "preset": preset,
+        "params_m": sum(p.numel() for p in model.parameters()) / 1e6,
+        "step_s": step_s,
+        "val_s": val_s,
+        "peak_mb": peak_mb,
+    }
+
+
+def estimate_round_s(measurement, n_train, n_val, epochs=None, batch_size=1):
+    """Local training time of one round: `epochs` passes over the data, each followed by validation."""
+    epochs = config.EPOCHS_PER_CLIENT if epochs is None else epochs
+    return epochs * (math.ceil(n_train / batch_size) * measurement["step_s"] + n_val * measurement["val_s"])
+
+
+def recommend(measurements, n_train, n_val, budget_s=None, epochs=None, batch_size=1, memory_limit_mb=None):
+    """Name of the largest measured preset that fits the time budget and memory; the smallest if none does."""
+    budget_s = config.ROUND_TIME_BUDGET_S if budget_s is None else budget_s
+    best = None
+    for m in sorted(measurements, key=lambda m: list(UNETR_PRESETS).index(m["preset"])):
+        if m.get("oom"):
+            continue
+        if memory_limit_mb is not None and m["peak_mb"] > memory_limit_mb:
+            continue
+        if estimate_round_s(m, n_train, n_val, epochs, batch_size) <= budget_s:
+            best = m["preset"]
+    return best or next(iter(UNETR_PRESETS))
+
+
+def benchmark_presets(device, batch_size=1, steps=3):
+    """Measure every preset, smallest first, stopping at the first one that runs out of memory."""
+    measurements = []
+    for preset in UNETR_PRESETS:
+        try:
+            measurements.append(measure_preset(preset, device, batch_size, steps))
+        except torch.cuda.OutOfMemoryError:
+            measurements.append({"preset": preset, "oom": True})
+            break
+    return measurements
+
+
+if __name__ == "__main__":
+    from glob import glob
+
+    parser = argparse.ArgumentParser(description="Recommend a UNETR preset for a per-round time budget")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--budget-s", type=float, default=config.ROUND_TIME_BUDGET_S)
+    parser.add_argument("--epochs", type=int, default=config.EPOCHS_PER_CLIENT)
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--steps", type=int, default=3, help="timed steps per preset")
+    parser.add_argument("--train-samples", type=int, default=None, help="default: count data/Training/images")
+    parser.add_argument("--val-samples", type=int, default=None, help="default: count data/Validation/images")
+    parser.add_argument("--out", default=None, help="write the measurements and recommendation as JSON")
+    args = parser.parse_args()
+
+    data_root = os.path.join(config.BASE_DIR, "data")
+    n_train = args.train_samples or len(glob(os.path.join(data_root, "Training", "images", "*.npy")))
+    n_val = args.val_samples or len(glob(os.path.join(data_root, "Validation", "images", "*.npy")))
+    memory_limit = None
+    if torch.device(args.device).type == "cuda":
+        memory_limit = 0.9 * torch.cuda.get_device_properties(args.device).total_memory / 2**20
+
+    measurements = benchmark_presets(args.device, args.batch_size, args.steps)
+    print(f"{n_train} training / {n_val} validation volumes, {args.epochs} epoch(s), budget {args.budget_s:.0f}s")
+    print(f"{'preset':<8}{'params M':>10}{'step s':>9}{'val s':>8}{'peak MB':>10}{'round s':>10}")
+    for m in measurements:
+        if m.get("oom"):
+            print(f"{m['preset']:<8}{'out of memory':>55}")
+            continue
+        m["round_s"] = estimate_round_s(m, n_train, n_val, args.epochs, args.batch_size)
+        print(f"{m['preset']:<8}{m['params_m']:>10.1f}{m['step_s']:>9.2f}{m['val_s']:>8.2f}"
+              f"{m['peak_mb']:>10.0f}{m['round_s']:>10.0f}")
+
+    choice = recommend(measurements, n_train, n_val, args.budget_s, args.epochs, args.batch_size, memory_limit)
+    fits = any(m["preset"] == choice and m.get("round_s", math.inf) <= args.budget_s for m in measurements)
+    print(f"\nRecommended preset: {choice}" + ("" if fits else " (no preset fits the budget; smallest chosen)"))
+    print("The federation trains a single preset: use the smallest one recommended across sites.")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"device": args.device, "budget_s": args.budget_s, "recommended": choice,
+                       "measurements": measurements}, f, indent=2)
@@ -0,0 +1,113 @@
+import os
+import csv
+import math
+import time
+from datetime import datetime
+import config
+
+TIMING_FIELDS = ["timestamp", "round", "epoch", "samples", "train_s", "data_wait_s", "val_s"]
+
+
+class EpochBudget:
+    """Predicts local round time from past epochs and sizes the next round to fit a deadline.
+
+    Every epoch's training time, data-loader wait and validation time are
+    appended to `timings_path`. Per-sample training cost and per-epoch
+    validation cost are exponentially weighted means over that history, so
+    recent hardware and load conditions count most. Without timing history
+    the epoch durations in logs.csv (gaps between its timestamps) are used
+    as a rough starting point.
+    """
+
+    def __init__(self, timings_path="timings.csv", logs_path="logs.csv", smoothing=0.3):
+        self.timings_path = timings_path
+        self.smoothing = smoothing
+        self.sec_per_sample = None
+        self.val_s = None
+        self.data_wait_share = None
+        self.commit_s = None
+        self.epoch_s_from_logs = None
+
+        if os.path.exists(timings_path):
+            with open(timings_path, newline="") as f:
+                for row in csv.DictReader(f):
+                    self._update(int(row["samples"]), float(row["train_s"]), float(row["data_wait_s"]), float(row["val_s"]))
+        elif os.path.exists(logs_path):
+            self._bootstrap_from_logs(logs_path)
+
+    def _ewma(self, old, new):
+        return new if old is None else (1 - self.smoothing) * old + self.smoothing * new
+
+    def _update(self, samples, train_s, data_wait_s, val_s):
+        if samples:
+            self.sec_per_sample = self._ewma(self.sec_per_sample, train_s / samples)
+        self.val_s = self._ewma(self.val_s, val_s)
+        if train_s:
+            self.data_wait_share = self._ewma(self.data_wait_share, data_wait_s / train_s)
+
+    def _bootstrap_from_logs(self, logs_path):
+        """Epoch durations from consecutive logs.csv timestamps of the same round (train + val together)."""
+        with open(logs_path, newline="") as f:
+            rows = list(csv.DictReader(f))
+        durations = []
+        for prev, row in zip(rows, rows[1:]):
+            if row["round"] == prev["round"]:
+                fmt = "%Y-%m-%d %H:%M:%S"
+                durations.append((datetime.strptime(row["timestamp"], fmt) - datetime.strptime(prev["timestamp"], fmt)).total_seconds())
+        if durations:
+            self.epoch_s_from_logs = sum(durations[-10:]) / len(durations[-10:])
+
+    @property
+    def has_history(self):
+        return self.sec_per_sample is not None or self.epoch_s_from_logs is not None
+
+    def record_epoch(self, round_num, epoch, samples, train_s, data_wait_s, val_s):
+        self._update(samples, train_s, data_wait_s, val_s)
+        new_file = not os.path.exists(self.timings_path)
+        with open(self.timings_path, "a", newline="") as f:
+            writer = csv.writer(f)
+            if new_file:
+                writer.writerow(TIMING_FIELDS)
+            writer.writerow([datetime.now().strftime("%Y-%m-%d %H:%M:%S"), round_num, epoch, samples,
+                             f"{train_s:.3f}", f"{data_wait_s:.3f}", f"{val_s:.3f}"])
+
+    def record_commit(self, seconds):
+        self.commit_s = self._ewma(self.commit_s, seconds)
+
+    def predict(self, epochs, samples_per_epoch):
+        """Seconds for `epochs` local epochs of `samples_per_epoch` samples, plus the upload."""
+        if self.sec_per_sample is None:
+            if self.epoch_s_from_logs is None:
+                return None
+            return epochs * self.epoch_s_from_logs + (self.commit_s or 0.0)
+        epoch_s = samples_per_epoch * self.sec_per_sample + (self.val_s or 0.0)
+        return epochs * epoch_s + (self.commit_s or 0.0)
+
+    def plan(self, n_samples, seconds_left, max_epochs=None, min_samples=None, safety=None):
+        """(epochs, samples_per_epoch) that is predicted to finish within `seconds_left`.
+
+        Prefers whole epochs; if even one full epoch does not fit, the single
+        epoch is cut to as many samples as fit, but never below `min_samples`.
+        Without history, or without a deadline, the configured epochs run in full.
+        """
+        max_epochs = config.EPOCHS_PER_CLIENT if max_epochs is None else max_epochs
+        min_samples = config.MIN_SAMPLES_PER_ROUND if min_samples is None else min_samples
+        safety = config.DEADLINE_SAFETY if safety is None else safety
+        if seconds_left is None or not self.has_history:
+            return max_epochs, n_samples
+
+        budget = seconds_left * safety
+        for epochs in range(max_epochs, 0, -1):
+            if self.predict(epochs, n_samples) <= budget:
+                return epochs, n_samples
+
+        if self.sec_per_sample is None:
+            return 1, n_samples
+        per_sample_budget = budget - (self.val_s or 0.0) - (self.commit_s or 0.0)
+        samples = math.floor(per_sample_budget / self.sec_per_sample) if per_sample_budget > 0 else 0
+        return 1, max(min(samples, n_samples), min(min_samples, n_samples))
+
+
+def seconds_until(deadline):
+    """Seconds left until a server deadline given as a Unix timestamp (None if there is none)."""
+    return None if deadline is None else deadline - time.time()
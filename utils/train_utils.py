@@ -1,9 +1,10 @@
+import time
 import torch
 import torch.nn as nn
 from tqdm import tqdm
 from monai.losses import DiceLoss
-from monai.metrics import DiceMetric
 from monai.inferers import sliding_window_inference
+from utils.metrics import compute_segmentation_metrics, mean_dice
 
 
 # --- LOSS DEFINITIONS ---
@@ -16,11 +17,20 @@ def combined_loss(pred, target):
 
 
 # --- TRAINING LOOP ---
-def train_one_epoch(model, loader, optimizer, criterion, device, scaler=None):
+def train_one_epoch(model, loader, optimizer, criterion, device, scaler=None, max_batches=None, stats=None):
+    """One pass over `loader` (or its first `max_batches` batches).
+
+    If a `stats` dict is given it is filled with the samples seen, total
+    seconds and seconds spent waiting on the data loader.
+    """
     model.train()
     running_loss = 0.0
+    n_batches = n_samples = 0
+    data_wait = 0.0
+    start = fetched = time.perf_counter()
 
-    for images, masks in tqdm(loader, desc="Training", leave=False):
+    for images, masks in tqdm(loader, desc="Training", leave=False, total=max_batches):
+        data_wait += time.perf_counter() - fetched
         images, masks = images.to(device), masks.to(device)
 
         optimizer.zero_grad()
@@ -37,8 +47,16 @@ def train_one_epoch(model, loader, optimizer, criterion, device, scaler=None):
             optimizer.step()
 
         running_loss += loss.item()
+        n_batches += 1
+        n_samples += images.shape[0]
+        fetched = time.perf_counter()
+        if max_batches is not None and n_batches >= max_batches:
+            break
+
+    if stats is not None:
+        stats.update(samples=n_samples, seconds=time.perf_counter() - start, data_wait_s=data_wait)
 
-    avg_loss = running_loss / len(loader)
+    avg_loss = running_loss / max(n_batches, 1)
     print(f"  [Train] Avg Loss: {avg_loss:.4f}")
     return avg_loss
 
@@ -48,7 +66,7 @@ def evaluate(model, loader, criterion, device, threshold=0.5):
     """Run evaluation on validation or test set."""
     model.eval()
     val_loss = 0.0
-    dice_metric = DiceMetric(include_background=False, reduction="mean")
+    case_metrics = []
 
     with torch.no_grad():
         for images, masks in tqdm(loader, desc="Validation", leave=False):
@@ -57,15 +75,16 @@ def evaluate(model, loader, criterion, device, threshold=0.5):
             loss = criterion(outputs, masks)
             val_loss += loss.item()
 
-            preds = (torch.sigmoid(outputs) >= threshold).float()
-            dice_metric(y_pred=preds, y=masks)
+            preds = torch.sigmoid(outputs) >= threshold
+            case_metrics.extend(
+                compute_segmentation_metrics(preds[i], masks[i], per_slice=False) for i in range(preds.shape[0])
+            )
 
-    mean_dice = dice_metric.aggregate().item()
+    val_dice = mean_dice(case_metrics)
     avg_loss = val_loss / len(loader)
-    dice_metric.reset()
 
-    print(f"  [Val] Avg Loss: {avg_loss:.4f}, Dice: {mean_dice:.4f}")
-    return avg_loss, mean_dice
+    print(f"  [Val] Avg Loss: {avg_loss:.4f}, Dice: {val_dice:.4f}")
+    return avg_loss, val_dice
 
 
 # --- SLIDING WINDOW EVALUATION ---
@@ -76,7 +95,7 @@ def evaluate_model(
     """Full 3D sliding-window evaluation for volumetric inference."""
     model.eval()
     running_loss = 0.0
-    dice_metric = DiceMetric(include_background=False, reduction="mean")
+    case_metrics = []
     n_batches = 0
 
     with torch.no_grad():
@@ -90,13 +109,14 @@ def evaluate_model(
             loss = loss_fn(outputs, masks)
             running_loss += loss.item()
 
-            preds = (torch.sigmoid(outputs) >= threshold).float()
-            dice_metric(y_pred=preds, y=masks)
+            preds = torch.sigmoid(outputs) >= threshold
+            case_metrics.extend(
+                compute_segmentation_metrics(preds[i], masks[i], per_slice=False) for i in range(preds.shape[0])
+            )
             n_batches += 1
 
     avg_loss = running_loss / n_batches if n_batches > 0 else float("nan")
-    avg_dice = dice_metric.aggregate().item() if n_batches > 0 else float("nan")
-    dice_metric.reset()
+    avg_dice = mean_dice(case_metrics)
 
     print(f"  [Eval] Avg Loss: {avg_loss:.4f}, Dice: {avg_dice:.4f}")
     return avg_loss, avg_dice
@@ -0,0 +1,188 @@
+import io
+import zlib
+import torch
+
+# Encoded updates start with this tag so receivers can tell them from raw .pth files
+MAGIC = b"FLUPD1"
+QUANTIZATIONS = ("fp32", "fp16", "int8")
+
+
+def is_encoded_update(blob):
+    return bytes(blob[:len(MAGIC)]) == MAGIC
+
+
+# --- Per-tensor quantization ---
+def _quantize(delta, quantization):
+    if quantization == "fp32":
+        return {"kind": "fp32", "data": delta}
+    if quantization == "fp16":
+        return {"kind": "fp16", "data": delta.half()}
+
+    # int8: symmetric per-tensor scale
+    scale = delta.abs().max().item() / 127.0
+    if scale == 0.0:
+        return {"kind": "zero", "shape": tuple(delta.shape)}
+    q = torch.round(delta / scale).clamp_(-127, 127).to(torch.int8)
+    return {"kind": "int8", "data": q, "scale": scale}
+
+
+def _dequantize(entry):
+    kind = entry["kind"]
+    if kind == "zero":
+        return torch.zeros(entry["shape"])
+    if kind == "int8":
+        return entry["data"].float() * entry["scale"]
+    if kind == "topk":
+        dense = torch.zeros(entry["numel"])
+        indices = torch.cumsum(entry["gaps"].long(), dim=0)
+        dense[indices] = _dequantize(entry["values"])
+        return dense.view(entry["shape"])
+    return entry["data"].float()
+
+
+# --- Top-k sparsification ---
+def _sparsify(delta, ratio, quantization):
+    """Keep the k largest-magnitude entries as sorted index gaps plus quantized values."""
+    flat = delta.flatten()
+    k = max(1, int(flat.numel() * ratio))
+    if k >= flat.numel():
+        return _quantize(delta, quantization)
+
+    indices = flat.abs().topk(k, sorted=False).indices.sort().values
+    # Gaps between sorted indices are small and compress far better than raw indices
+    gaps = torch.diff(indices, prepend=indices.new_zeros(1)).to(torch.int32)
+    return {
+        "kind": "topk",
+        "shape": tuple(delta.shape),
+        "numel": flat.numel(),
+        "gaps": gaps,
+        "values": _quantize(flat[indices], quantization),
+    }
+
+
+# --- Encode / decode ---
+def encode_update(state_dict, base_state=None, quantization="fp16", compression_level=6,
+                  topk_ratio=None, residual=None):
+    """Encode a client state dict as a compressed, quantized delta from `base_state`.
+
+    Without a base state the full weights are quantized instead. Non-float
+    tensors (e.g. counters) are always sent unchanged.
+
+    With `topk_ratio`, only that fraction of each tensor's delta (largest
+    magnitude first) is sent. If a `residual` dict is given it acts as
+    error feedback: it is added to the delta before selection and updated in
+    place with whatever was not transmitted.
+    """
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"Unknown quantization '{quantization}', expected one of {QUANTIZATIONS}")
+    if topk_ratio is not None and base_state is None:
+        raise ValueError("Top-k sparsification needs the base state to compute deltas")
+
+    tensors = {}
+    for key, value in state_dict.items():
+        value = value.detach().cpu()
+        if not value.is_floating_point():
+            tensors[key] = {"kind": "raw", "data": value}
+            continue
+
+        delta = value.float()
+        if base_state is not None:
+            delta = delta - base_state[key].detach().cpu().float()
+
+        if topk_ratio is None:
+            tensors[key] = _quantize(delta, quantization)
+            continue
+
+        if residual is not None and key in residual:
+            delta = delta + residual[key]
+        tensors[key] = _sparsify(delta, topk_ratio, quantization)
+        if residual is not None:
+            residual[key] = delta - _dequantize(tensors[key])
+
+    payload = {
+        "delta": base_state is not None,
+        "quantization": quantization,
+        "tensors": tensors,
+    }
+    buf = io.BytesIO()
+    torch.save(payload, buf)
+    return MAGIC + zlib.compress(buf.getvalue(), compression_level)
+
+
+def _load_payload(blob):
+    if not is_encoded_update(blob):
+        raise ValueError("Not an encoded model update")
+
+    raw = zlib.decompress(bytes(blob[len(MAGIC):]))
+    return torch.load(io.BytesIO(raw), map_location="cpu", weights_only=True)
+
+
+def decode_delta(blob):
+    """Return (deltas, raw) for a delta update: dequantized float deltas and unchanged non-float tensors."""
+    payload = _load_payload(blob)
+    if not payload["delta"]:
+        raise ValueError("Update holds full weights, not a delta")
+
+    deltas, raw = {}, {}
+    for key, entry in payload["tensors"].items():
+        if entry["kind"] == "raw":
+            raw[key] = entry["data"]
+        else:
+            deltas[key] = _dequantize(entry)
+    return deltas, raw
+
+
+def _shape(entry):
+    return tuple(entry["shape"]) if "shape" in entry else tuple(entry["data"].shape)
+
+
+def accumulate_delta(blob, acc, alpha=1.0):
+    """Add `alpha` * a delta update into the float tensors of `acc` in place; returns its raw tensors.
+
+    Top-k entries are scattered straight into the accumulator with
+    index_add_, so a sparse update is never expanded to a dense tensor.
+    Tensors missing from `acc` are added as zeros first.
+    """
+    payload = _load_payload(blob)
+    if not payload["delta"]:
+        raise ValueError("Update holds full weights, not a delta")
+
+    raw = {}
+    for key, entry in payload["tensors"].items():
+        if entry["kind"] == "raw":
+            raw[key] = entry["data"]
+            continue
+        if key not in acc:
+            acc[key] = torch.zeros(_shape(entry))
+        target = acc[key]
+        if entry["kind"] == "zero":
+            continue
+        if entry["kind"] == "topk":
+            indices = torch.cumsum(entry["gaps"].long(), dim=0)
+            values = _dequantize(entry["values"]).to(target.dtype)
+            target.view(-1).index_add_(0, indices, values, alpha=alpha)
+        else:
+            target.add_(_dequantize(entry).to(target.dtype), alpha=alpha)
+    return raw
+
+
+def decode_update(blob, base_state=None):
+    """Rebuild a full state dict from an encoded update and the base it was taken against."""
+    payload = _load_payload(blob)
+
+    if payload["delta"] and base_state is None:
+        raise ValueError("Update is a delta but no base state was given")
+
+    state = {}
+    for key, entry in payload["tensors"].items():
+        if entry["kind"] == "raw":
+            state[key] = entry["data"]
+            continue
+
+        value = _dequantize(entry)
+        if payload["delta"]:
+            base = base_state[key].detach().cpu()
+            state[key] = (base.float() + value).to(base.dtype)
+        else:
+            state[key] = value
+    return state
@@ -0,0 +1,300 @@
+import io
+import os
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import threading
+from datetime import datetime
+import requests
+import torch
+import config
+from utils.update_codec import encode_update
+from utils.flat_tensors import write_flat
+
+BLOCK_SIZE = 64 * 1024
+REJECTED_DIR = "rejected"  # under queue_dir: jobs the server refused, kept for inspection
+RETRYABLE_4XX = (404, 408, 429)  # e.g. the session or endpoint is gone for now; not the job's fault
+
+
+class UploadRejected(IOError):
+    """The server refused a job (4xx); sending it again unchanged cannot succeed."""
+
+
+# --- Bandwidth caps ---
+def _minutes(hhmm):
+    hours, minutes = hhmm.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+def current_rate_limit(now=None, schedule=None, default=None):
+    """Upload cap in MB/s for the current time of day (None = unlimited, 0 = paused).
+
+    `schedule` is a list of ("HH:MM", "HH:MM", mbps) windows; windows may wrap
+    past midnight. Outside every window `default` applies.
+    """
+    schedule = config.UPLOAD_RATE_SCHEDULE if schedule is None else schedule
+    default = config.UPLOAD_RATE_LIMIT_MBPS if default is None else default
+    now = now or datetime.now()
+    minute = now.hour * 60 + now.minute
+    for start, end, mbps in schedule:
+        start, end = _minutes(start), _minutes(end)
+        inside = start <= minute < end if start <= end else (minute >= start or minute < end)
+        if inside:
+            return mbps
+    return default
+
+
+class TokenBucket:
+    """Blocking byte-rate limiter; the rate is re-read from the schedule as it changes."""
+
+    def __init__(self, rate_fn=current_rate_limit, burst_bytes=4 * BLOCK_SIZE):
+        self.rate_fn = rate_fn
+        self.burst = burst_bytes
+        self.tokens = burst_bytes
+        self.last = time.monotonic()
+
+    def consume(self, n):
+        while True:
+            mbps = self.rate_fn()
+            now = time.monotonic()
+            if mbps is None:
+                self.last = now
+                return
+            if mbps == 0:  # paused window
+                time.sleep(30)
+                self.last = time.monotonic()
+                continue
+
+            rate = mbps * 1024 * 1024
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * rate)
+            self.last = now
+            if self.tokens >= n:
+                self.tokens -= n
+                return
+            time.sleep((n - self.tokens) / rate)
+
+
+class ThrottledReader:
+    """File-like request body that releases bytes through a TokenBucket.
+
+    Having a length lets requests send a Content-Length instead of chunking.
+    """
+
+    def __init__(self, data, bucket):
+        self.view = memoryview(data)
+        self.bucket = bucket
+        self.pos = 0
+
+    def __len__(self):
+        return len(self.view) - self.pos
+
+    def read(self, n=-1):
+        n = min(BLOCK_SIZE if n is None or n < 0 else n, BLOCK_SIZE, len(self))
+        block = self.view[self.pos:self.pos + n]
+        self.bucket.consume(len(block))
+        self.pos += len(block)
+        return bytes(block)
+
+
+# --- Persistent, chunked upload queue ---
+class UploadScheduler:
+    """Persistent queue of chunked, resumable, rate-limited update uploads.
+
+    enqueue() orders the update's tensors by delta magnitude, largest first,
+    and packs them into chunks of about `chunk_mb`. Each chunk is a
+    self-contained encoded update (or flat file) for its tensors, so the
+    server can decode each one as soon as it arrives. Chunks and a job.json
+    are written to `queue_dir` before anything is sent, so a restart picks
+    the job up again. The upload opens a session on the server, skips chunks
+    it already has, and PUTs the rest through a token bucket that follows
+    config.UPLOAD_RATE_SCHEDULE. A session the server already completed is
+    not sent again, and a job the server rejects is moved to
+    queue_dir/rejected/ instead of being retried.
+    """
+
+    def __init__(self, queue_dir=None, chunk_mb=None, retries=None):
+        self.queue_dir = queue_dir or config.UPLOAD_QUEUE_DIR
+        self.chunk_bytes = int((chunk_mb or config.UPLOAD_CHUNK_MB) * 1024 * 1024)
+        self.retries = config.UPLOAD_RETRIES if retries is None else retries
+        self.bucket = TokenBucket()
+        self.lock = threading.Lock()  # one job uploads at a time
+        self._writing = set()  # jobs being enqueued: no job.json yet, but not abandoned either
+        self.session = requests.Session()
+        os.makedirs(self.queue_dir, exist_ok=True)
+
+    # --- Enqueue ---
+    def _priority(self, state, base_state):
+        def magnitude(key):
+            tensor = state[key]
+            if not tensor.is_floating_point() or tensor.numel() == 0:
+                return float("inf")  # tiny non-float tensors (counters) go first
+            value = tensor.detach().float()
+            if base_state is not None and key in base_state:
+                value = value - base_state[key].detach().cpu().float()
+            return float(torch.linalg.vector_norm(value))
+        return sorted(state, key=magnitude, reverse=True)
+
+    def _groups(self, state, order):
+        group, size = [], 0
+        for key in order:
+            nbytes = state[key].numel() * state[key].element_size()
+            if group and size + nbytes > self.chunk_bytes:
+                yield group
+                group, size = [], 0
+            group.append(key)
+            size += nbytes
+        if group:
+            yield group
+
+    def enqueue(self, endpoint, meta, state, base_state=None, quantization=None,
+                compression_level=6, topk_ratio=None, residual=None):
+        """Encode `state` into prioritized chunks on disk and return the job id.
+
+        `endpoint` is the base URL serving /api/upload-session (the server or
+        client_backend's proxy, with its query string). With `quantization`
+        set, chunks are encoded deltas against `base_state`; otherwise they
+        are flat files of full weights.
+        """
+        state = {k: v.detach().cpu() for k, v in state.items()}
+        job_id = uuid.uuid4().hex
+        job_dir = os.path.join(self.queue_dir, job_id)
+        self._writing.add(job_id)
+        try:
+            os.makedirs(job_dir)
+            chunks = []
+            for i, keys in enumerate(self._groups(state, self._priority(state, base_state))):
+                subset = {k: state[k] for k in keys}
+                if quantization:
+                    blob = encode_update(
+                        subset, None if base_state is None else {k: base_state[k] for k in keys},
+                        quantization=quantization, compression_level=compression_level,
+                        topk_ratio=topk_ratio, residual=residual
+                    )
+                else:
+                    buf = io.BytesIO()
+                    write_flat(subset, buf)
+                    blob = buf.getvalue()
+                name = f"chunk_{i:04d}.upd"
+                with open(os.path.join(job_dir, name), "wb") as f:
+                    f.write(blob)
+                chunks.append({"file": name, "bytes": len(blob), "sha256": hashlib.sha256(blob).hexdigest(), "tensors": keys})
+
+            job = {"job_id": job_id, "endpoint": endpoint, "meta": meta, "chunks": chunks, "created": time.time()}
+            tmp_path = os.path.join(job_dir, "job.json.tmp")
+            with open(tmp_path, "w") as f:
+                json.dump(job, f)
+            os.replace(tmp_path, os.path.join(job_dir, "job.json"))
+        finally:
+            self._writing.discard(job_id)
+        return job_id
+
+    # --- Upload ---
+    def pending(self):
+        """Queued jobs, oldest first.
+
+        A directory without job.json is a job that was never fully written
+        (a crash during enqueue); it can never be sent and is removed.
+        """
+        jobs = []
+        for job_id in os.listdir(self.queue_dir):
+            if job_id == REJECTED_DIR:
+                continue
+            job_dir = os.path.join(self.queue_dir, job_id)
+            path = os.path.join(job_dir, "job.json")
+            if os.path.exists(path):
+                with open(path) as f:
+                    jobs.append(json.load(f))
+            elif os.path.isdir(job_dir) and job_id not in self._writing:
+                print(f"[UPLOAD] Removing incomplete job {job_id}")
+                shutil.rmtree(job_dir, ignore_errors=True)
+        return sorted(jobs, key=lambda job: job["created"])
+
+    def _request(self, method, url, body=None, **kwargs):
+        for attempt in range(1, self.retries + 1):
+            try:
+                data = None if body is None else ThrottledReader(body, self.bucket)
+                response = self.session.request(method, url, data=data, timeout=60, **kwargs)
+                if response.status_code < 500:
+                    return response
+                error = f"HTTP {response.status_code}"
+            except requests.RequestException as e:
+                error = str(e)
+            print(f"[UPLOAD] {method} {url} failed ({error}), retry {attempt}/{self.retries}")
+            time.sleep(min(2 ** attempt, 60))
+        raise IOError(f"{method} {url} failed after {self.retries} attempts")
+
+    def _raise_for_status(self, response):
+        if 400 <= response.status_code < 500 and response.status_code not in RETRYABLE_4XX:
+            raise UploadRejected(f"HTTP {response.status_code}: {response.text[:200]}")
+        response.raise_for_status()
+
+    def _park(self, job_id):
+        rejected_dir = os.path.join(self.queue_dir, REJECTED_DIR)
+        os.makedirs(rejected_dir, exist_ok=True)
+        os.replace(os.path.join(self.queue_dir, job_id), os.path.join(rejected_dir, job_id))
+
+    def upload(self, job_id):
+        """Send one job's missing chunks; returns the server's final response and dequeues the job.
+
+        Raises UploadRejected, after moving the job to queue_dir/rejected/, if
+        the server refuses it; other IOErrors leave it queued.
+        """
+        job_dir = os.path.join(self.queue_dir, job_id)
+        with open(os.path.join(job_dir, "job.json")) as f:
+            job = json.load(f)
+        base, _, query = job["endpoint"].partition("?")
+
+        with self.lock:
+            try:
+                result = self._send(job, job_id, base, query)
+            except UploadRejected as e:
+                print(f"[UPLOAD] Job {job_id} rejected ({e}), moved to {REJECTED_DIR}/")
+                self._park(job_id)
+                raise
+
+        shutil.rmtree(job_dir)
+        return result
+
+    def _send(self, job, job_id, base, query):
+        job_dir = os.path.join(self.queue_dir, job_id)
+        response = self._request("POST", f"{base}/api/upload-session?{query}", json={
+            **job["meta"],
+            "upload_id": job_id,
+            "chunks": [{"bytes": c["bytes"], "sha256": c["sha256"], "tensors": c["tensors"]} for c in job["chunks"]],
+        })
+        self._raise_for_status(response)
+        result = response.json()
+        if result.get("complete"):
+            return result  # delivered before the job was dequeued (e.g. a crash right after the last chunk)
+        received = set(result["received"])
+
+        for index, chunk in enumerate(job["chunks"]):
+            if index in received:
+                continue
+            with open(os.path.join(job_dir, chunk["file"]), "rb") as f:
+                data = f.read()
+            response = self._request(
+                "PUT", f"{base}/api/upload-session/{job_id}/chunk/{index}?{query}",
+                body=data, headers={"X-Content-SHA256": chunk["sha256"]}
+            )
+            self._raise_for_status(response)
+            result = response.json()
+        return result
+
+    def upload_all(self):
+        """Deliver every queued job (e.g. left over from before a restart); returns the delivered jobs' responses.
+
+        A job that fails stays queued for the next call (a rejected one is
+        parked) and does not hold up the others.
+        """
+        results = []
+        for job in self.pending():
+            try:
+                results.append(self.upload(job["job_id"]))
+            except UploadRejected:
+                pass
+            except IOError as e:
+                print(f"[UPLOAD] Job {job['job_id']} failed ({e}), kept for later")
+        return results